@@ -1,14 +1,122 @@
 # auth.py
 from jose import JWTError, jwt
 from datetime import datetime, timedelta
-from typing import Dict
+import hashlib
+import heapq
+import os
+import sqlite3
+import threading
+import time
 
-SECRET_KEY = "SECRET_KEY"  
+SECRET_KEY = "SECRET_KEY"
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24  # 1 day
 
-# In-memory blacklist store (for testing only)
-blacklisted_tokens: Dict[str, datetime] = {}
+# "memory" is per process; use "sqlite" when running more than one worker
+TOKEN_REVOCATION_STORE = os.getenv("TOKEN_REVOCATION_STORE", "memory")
+TOKEN_REVOCATION_DB = os.getenv("TOKEN_REVOCATION_DB", "./revoked_tokens.sqlite3")
+
+
+class RevocationStore:
+    """Revoked tokens, each kept only until the token would have expired anyway."""
+
+    def revoke(self, token: str, expires_at: float):
+        raise NotImplementedError
+
+    def is_revoked(self, token: str) -> bool:
+        raise NotImplementedError
+
+
+class MemoryRevocationStore(RevocationStore):
+    """
+    Dict for O(1) lookups plus a min-heap on expiry, so expired entries are
+    evicted in O(log n) each without scanning or waiting for a lookup.
+    """
+
+    def __init__(self):
+        self._expiry: dict[str, float] = {}
+        self._heap: list[tuple[float, str]] = []
+        self._lock = threading.Lock()
+
+    def _evict(self, now: float):
+        while self._heap and self._heap[0][0] <= now:
+            expires_at, token = heapq.heappop(self._heap)
+            # Skip stale heap entries of tokens that were revoked again later
+            if self._expiry.get(token) == expires_at:
+                del self._expiry[token]
+
+    def revoke(self, token: str, expires_at: float):
+        with self._lock:
+            self._evict(time.time())
+            self._expiry[token] = expires_at
+            heapq.heappush(self._heap, (expires_at, token))
+
+    def is_revoked(self, token: str) -> bool:
+        expires_at = self._expiry.get(token)
+        return expires_at is not None and expires_at > time.time()
+
+    def __len__(self):
+        return len(self._expiry)
+
+
+class SQLiteRevocationStore(RevocationStore):
+    """
+    Revocations in a local SQLite file that every worker on the host opens,
+    so a logout in one process is honoured by all of them. Tokens are stored
+    as SHA-256 digests under a primary key; expired rows are purged at most
+    once per `purge_interval` seconds.
+    """
+
+    def __init__(self, path: str, purge_interval: float = 60):
+        self.path = path
+        self.purge_interval = purge_interval
+        self._next_purge = 0.0
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS revoked_tokens ("
+                "token_hash TEXT PRIMARY KEY, expires_at REAL NOT NULL) WITHOUT ROWID"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_revoked_tokens_expires_at ON revoked_tokens (expires_at)")
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5)
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _digest(token: str) -> str:
+        return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+    def revoke(self, token: str, expires_at: float):
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO revoked_tokens (token_hash, expires_at) VALUES (?, ?)",
+                (self._digest(token), expires_at),
+            )
+            if now >= self._next_purge:
+                conn.execute("DELETE FROM revoked_tokens WHERE expires_at <= ?", (now,))
+                self._next_purge = now + self.purge_interval
+
+    def is_revoked(self, token: str) -> bool:
+        row = self._connect().execute(
+            "SELECT 1 FROM revoked_tokens WHERE token_hash = ? AND expires_at > ?",
+            (self._digest(token), time.time()),
+        ).fetchone()
+        return row is not None
+
+
+def _make_revocation_store() -> RevocationStore:
+    if TOKEN_REVOCATION_STORE == "sqlite":
+        return SQLiteRevocationStore(TOKEN_REVOCATION_DB)
+    return MemoryRevocationStore()
+
+
+revoked_tokens: RevocationStore = _make_revocation_store()
 
 def create_access_token(data: dict):
     to_encode = data.copy()
@@ -25,25 +133,15 @@ def decode_access_token(token: str):
     except JWTError:
         return None
 
-def delete_access_token(token: str):
-    blacklist_token(token)
+def delete_access_token(token: str, payload: dict):
+    blacklist_token(token, payload)
     return {"message": "Token has been invalidated"}
 
-def blacklist_token(token: str):
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        exp = payload.get("exp")
-        if exp:
-            expiry_time = datetime.utcfromtimestamp(exp)
-            blacklisted_tokens[token] = expiry_time
-    except JWTError:
-        pass  # Token is invalid, ignore
+def blacklist_token(token: str, payload: dict):
+    """Revoke a token until its expiry. `payload` is the already-decoded token."""
+    exp = payload.get("exp")
+    if exp:
+        revoked_tokens.revoke(token, float(exp))
 
 def is_token_blacklisted(token: str) -> bool:
-    expiry = blacklisted_tokens.get(token)
-    if not expiry:
-        return False
-    if datetime.utcnow() >= expiry:
-        del blacklisted_tokens[token]
-        return False
-    return True
+    return revoked_tokens.is_revoked(token)
@@ -0,0 +1,87 @@
+"""
+One SMTP connection per message vs the pooled connections of mailer.py.
+
+Starts a local aiosmtpd server that delays its EHLO answer by --latency
+seconds (a remote relay's handshake cost) and sends --messages messages from
+--threads threads (the job workers) twice: through a pool that never keeps
+connections (the old behaviour) and through a pool of --pool-size.
+
+Run from backend/:
+
+    pip install -r requirements-dev.txt
+    python benchmarks/smtp_outbox.py --messages 200 --threads 4 --latency 0.05
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from aiosmtpd.controller import Controller
+
+PORT = 8025
+os.environ.setdefault("SMTP_HOST", "127.0.0.1")
+os.environ.setdefault("SMTP_PORT", str(PORT))
+os.environ.setdefault("SMTP_USE_TLS", "false")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import mailer  # noqa: E402
+
+
+class Handler:
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.received = 0
+
+    async def handle_EHLO(self, server, session, envelope, hostname, responses):
+        await asyncio.sleep(self.latency)
+        session.host_name = hostname
+        return responses
+
+    async def handle_DATA(self, server, session, envelope):
+        self.received += 1
+        return "250 OK"
+
+
+def run(pool: mailer.SMTPPool, messages: int, threads: int) -> float:
+    def send(n):
+        pool.send(mailer.build_message(f"user{n}@example.com", f"Message {n}", "<p>Hello</p>"))
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(threads) as executor:
+        list(executor.map(send, range(messages)))
+    elapsed = time.perf_counter() - started
+    pool.close()
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=200)
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--pool-size", type=int, default=4)
+    parser.add_argument("--latency", type=float, default=0.05)
+    args = parser.parse_args()
+
+    handler = Handler(args.latency)
+    controller = Controller(handler, hostname="127.0.0.1", port=PORT)
+    controller.start()
+    try:
+        for label, pool in (
+            ("connection per message", mailer.SMTPPool(size=args.threads, idle_timeout=0)),
+            (f"pool of {args.pool_size}", mailer.SMTPPool(size=args.pool_size)),
+        ):
+            elapsed = run(pool, args.messages, args.threads)
+            print(
+                f"{label:>24}: {elapsed:6.2f}s  {args.messages / elapsed:7.1f} msg/s  "
+                f"{pool.connects} connections"
+            )
+    finally:
+        controller.stop()
+    print(f"server received {handler.received} messages")
+
+
+if __name__ == "__main__":
+    main()
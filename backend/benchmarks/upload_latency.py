@@ -0,0 +1,104 @@
+"""
+Latency of /api/me while image uploads run in parallel.
+
+Start the API first (uvicorn main:app --port 8000 --workers 1), then:
+
+    pip install -r requirements-dev.txt
+    python benchmarks/upload_latency.py --email you@example.com --password secret
+
+Several clients keep uploading a large generated photo while another client
+polls /api/me. The p50/p99 of /api/me shows how much the uploads stall the
+event loop; with transcoding inline it degrades to the encode time per photo.
+"""
+import argparse
+import asyncio
+import io
+import statistics
+import time
+
+import httpx
+from PIL import Image
+
+
+def make_photo(width: int, height: int) -> bytes:
+    # Noise compresses badly, which is close to the worst case for the encoder
+    img = Image.effect_noise((width, height), 64).convert("RGB")
+    buf = io.BytesIO()
+    img.save(buf, format="JPEG", quality=92)
+    return buf.getvalue()
+
+
+async def uploader(client: httpx.AsyncClient, photo: bytes, domain_id: int | None, stop: asyncio.Event, done: list):
+    params = {"domain_id": domain_id} if domain_id else None
+    while not stop.is_set():
+        files = {"file": (f"bench-{time.monotonic_ns()}.jpg", photo, "image/jpeg")}
+        res = await client.post("/api/upload", files=files, params=params)
+        res.raise_for_status()
+        done.append(res.json()["id"])
+
+
+async def poll_me(client: httpx.AsyncClient, samples: list, stop: asyncio.Event, interval: float):
+    while not stop.is_set():
+        start = time.perf_counter()
+        res = await client.get("/api/me")
+        res.raise_for_status()
+        samples.append((time.perf_counter() - start) * 1000)
+        await asyncio.sleep(interval)
+
+
+def percentile(values: list, pct: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--email", required=True)
+    parser.add_argument("--password", required=True)
+    parser.add_argument("--domain-id", type=int, default=None)
+    parser.add_argument("--uploaders", type=int, default=4)
+    parser.add_argument("--duration", type=float, default=20.0)
+    parser.add_argument("--size", default="4000x3000", help="WIDTHxHEIGHT of the generated photo")
+    parser.add_argument("--cleanup", action="store_true", help="delete uploaded media afterwards")
+    args = parser.parse_args()
+
+    width, height = (int(v) for v in args.size.lower().split("x"))
+    photo = make_photo(width, height)
+
+    async with httpx.AsyncClient(base_url=args.base_url, timeout=120) as client:
+        res = await client.post("/api/auth", json={"email": args.email, "password": args.password})
+        res.raise_for_status()
+        # The auth cookie is marked Secure, so copy it over by hand for plain http
+        client.cookies.set("access_token", res.cookies["access_token"])
+
+        idle = []
+        stop = asyncio.Event()
+        poller = asyncio.create_task(poll_me(client, idle, stop, 0.02))
+        await asyncio.sleep(3)
+        stop.set()
+        await poller
+
+        busy, uploaded = [], []
+        stop = asyncio.Event()
+        tasks = [asyncio.create_task(uploader(client, photo, args.domain_id, stop, uploaded)) for _ in range(args.uploaders)]
+        poller = asyncio.create_task(poll_me(client, busy, stop, 0.02))
+        await asyncio.sleep(args.duration)
+        stop.set()
+        await asyncio.gather(poller, *tasks)
+
+        print(f"photo: {width}x{height}, {len(photo) / 1024:.0f} KiB, {args.uploaders} uploaders, {len(uploaded)} uploads")
+        for label, samples in (("idle", idle), ("uploading", busy)):
+            print(
+                f"/api/me {label:>9}: n={len(samples)} "
+                f"p50={statistics.median(samples):.1f}ms p99={percentile(samples, 99):.1f}ms max={max(samples):.1f}ms"
+            )
+
+        if args.cleanup:
+            for media_id in uploaded:
+                await client.delete(f"/api/media/{media_id}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
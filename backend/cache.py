@@ -0,0 +1,262 @@
+"""
+In-process caching.
+
+`LRUTTLCache` is the default backend; anything with the same get/set/delete/
+clear methods can be swapped in with `set_public_backend`.
+
+Public project responses are invalidated through per-domain version numbers
+instead of explicit deletes: every write in crud that touches projects, project
+fields or media calls `bump_domain`, and a cached entry is only served while
+the version it was built under is still current. Each uvicorn worker keeps its
+own cache, so the TTL bounds how long another worker can serve a stale copy.
+ETags name the version a response was built from (see `version_etag`), so a
+streamed response has one before its body exists.
+
+Authenticated users are cached by id for `get_current_user` and dropped by
+every crud/route write to the user row. That only reaches the worker that
+handled the write, so elsewhere a deleted or changed user is seen for up to
+USER_CACHE_TTL; `require_admin` therefore reads the role from the database.
+
+`ownership_cache` maps (entity kind, id) to the owning user id for
+`ownership.py`. It is off by default: a domain reassignment or deletion only
+clears it in the worker that handled it, so with several workers the old
+owner would keep access elsewhere until the TTL ran out. Enable it only with
+a single worker.
+
+Settings (environment):
+- OWNERSHIP_CACHE_TTL: seconds an owner lookup is reused, 0 disables (default: 0)
+- OWNERSHIP_CACHE_MAX_ENTRIES: owners kept before LRU eviction (default: 16384)
+- USER_CACHE_TTL: seconds a user lookup is reused, 0 disables (default: 5)
+- USER_CACHE_MAX_ENTRIES: users kept before LRU eviction (default: 4096)
+- PUBLIC_CACHE_TTL: seconds a public response may be served (default: 60)
+- PUBLIC_CACHE_MAX_ENTRIES: entries kept before LRU eviction (default: 1024)
+"""
+import hashlib
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+
+PUBLIC_CACHE_TTL = float(os.getenv("PUBLIC_CACHE_TTL", "60"))
+PUBLIC_CACHE_MAX_ENTRIES = int(os.getenv("PUBLIC_CACHE_MAX_ENTRIES", "1024"))
+
+
+class CacheBackend:
+    """Interface for cache backends."""
+
+    def get(self, key):
+        raise NotImplementedError
+
+    def set(self, key, value):
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+
+class LRUTTLCache(CacheBackend):
+    """Thread-safe LRU cache whose entries also expire after `ttl` seconds."""
+
+    def __init__(self, max_entries: int = 1024, ttl: float = 60):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            expires_at, value = item
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._data),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+# -- DOMAIN VERSIONS --
+_versions_lock = threading.Lock()
+_domain_versions: dict[int, int] = {}
+_global_version = 0
+
+
+def bump_domain(domain_id: int | None):
+    """Invalidate every cached public response that depends on `domain_id`."""
+    global _global_version
+    with _versions_lock:
+        if domain_id is not None:
+            _domain_versions[domain_id] = _domain_versions.get(domain_id, 0) + 1
+        # Cross-domain responses and lookups by a not-yet-known name follow the global version
+        _global_version += 1
+
+
+def snapshot() -> int:
+    """Version token to take before querying; pass it to `set_public`."""
+    return _global_version
+
+
+# -- PUBLIC RESPONSES --
+@dataclass(frozen=True)
+class CachedResponse:
+    body: bytes
+    etag: str
+    domain_id: int | None  # None: validated against the global version
+    version: int
+
+
+public_cache: CacheBackend = LRUTTLCache(PUBLIC_CACHE_MAX_ENTRIES, PUBLIC_CACHE_TTL)
+
+
+def set_public_backend(backend: CacheBackend):
+    global public_cache
+    public_cache = backend
+
+
+# Versions count per process: tags of another worker must never match here
+_etag_salt = secrets.token_bytes(8)
+
+
+def version_etag(key, version: int) -> str:
+    """ETag for the response to `key` built from data read at `version` (a snapshot)."""
+    digest = hashlib.blake2b(repr((key, version)).encode(), digest_size=16, key=_etag_salt)
+    return '"' + digest.hexdigest() + '"'
+
+
+def get_public(key) -> CachedResponse | None:
+    entry = public_cache.get(key)
+    if entry is None:
+        return None
+    if entry.domain_id is None:
+        current = _global_version
+    else:
+        current = _domain_versions.get(entry.domain_id, 0)
+    if entry.version != current:
+        public_cache.delete(key)
+        return None
+    return entry
+
+
+def set_public(key, body: bytes, domain_id: int | None, taken: int) -> CachedResponse:
+    """
+    Store a serialized response built from data read after `snapshot()`
+    returned `taken`. If anything was written since, the entry is stored
+    already stale rather than under a version it may not match. Its ETag is
+    the one the response was sent with, `version_etag(key, taken)`.
+    """
+    with _versions_lock:
+        if domain_id is not None and _global_version == taken:
+            version = _domain_versions.get(domain_id, 0)
+        else:
+            domain_id, version = None, taken
+    entry = CachedResponse(body=body, etag=version_etag(key, taken), domain_id=domain_id, version=version)
+    public_cache.set(key, entry)
+    return entry
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    candidates = (tag.strip() for tag in if_none_match.split(","))
+    return any(tag.removeprefix("W/") == etag for tag in candidates)
+
+
+# -- AUTHENTICATED USERS --
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "5"))
+USER_CACHE_MAX_ENTRIES = int(os.getenv("USER_CACHE_MAX_ENTRIES", "4096"))
+
+
+@dataclass(frozen=True)
+class CachedUser:
+    """What auth decisions need from a user row, without the password hash."""
+    id: int
+    name: str | None
+    email: str
+    role: str
+
+
+user_cache = LRUTTLCache(USER_CACHE_MAX_ENTRIES, USER_CACHE_TTL)
+
+
+def get_user(user_id: int) -> CachedUser | None:
+    return user_cache.get(user_id)
+
+
+def set_user(user) -> CachedUser:
+    cached = CachedUser(id=user.id, name=user.name, email=user.email, role=user.role)
+    user_cache.set(user.id, cached)
+    return cached
+
+
+def invalidate_user(user_id: int):
+    user_cache.delete(user_id)
+
+
+# -- OWNERSHIP --
+OWNERSHIP_CACHE_TTL = float(os.getenv("OWNERSHIP_CACHE_TTL", "0"))
+OWNERSHIP_CACHE_MAX_ENTRIES = int(os.getenv("OWNERSHIP_CACHE_MAX_ENTRIES", "16384"))
+
+
+class NullCache(CacheBackend):
+    """Backend that stores nothing, for switching a cache off."""
+
+    def get(self, key):
+        return None
+
+    def set(self, key, value):
+        pass
+
+    def delete(self, key):
+        pass
+
+    def clear(self):
+        pass
+
+
+# Owners only change when a domain is reassigned or deleted; crud clears it
+# then, in this process only
+ownership_cache: CacheBackend = (
+    LRUTTLCache(OWNERSHIP_CACHE_MAX_ENTRIES, OWNERSHIP_CACHE_TTL) if OWNERSHIP_CACHE_TTL > 0 else NullCache()
+)
+
+
+def clear_ownership():
+    ownership_cache.clear()
@@ -1,10 +1,19 @@
 from sqlalchemy.orm import Session
 from fastapi import HTTPException, status
-from sqlalchemy import func
-from sqlalchemy.orm import joinedload
+from sqlalchemy import case, delete, func, insert, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload, selectinload
 import models
 import schemas
 import bcrypt
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+import zlib
+import cache
+import ownership
+import jobs
+import mailer
 
 
 #password hashing
@@ -58,6 +67,7 @@ def change_password(db: Session, user: models.User, old_password: str, new_passw
     user.password = hash_password(new_password)
     db.commit()
     db.refresh(user)
+    cache.invalidate_user(user.id)
     return user
 
 
@@ -68,6 +78,7 @@ def create_domain(db: Session, domain: schemas.DomainCreate):
     db.add(db_domain)
     db.commit()
     db.refresh(db_domain)
+    cache.bump_domain(db_domain.id)
     return db_domain
 
 def get_domains(db: Session):
@@ -99,24 +110,23 @@ def get_pages(db: Session):
 def get_page(db: Session, page_id: int):
     return db.query(models.Page).filter(models.Page.id == page_id).first()
 
-def get_pages_by_user_id(db: Session, user_id: int):
-    domains = db.query(models.Domain).filter(models.Domain.user_id == user_id).all()
-    domain_ids = [domain.id for domain in domains]
-    # Join pages and sections, count sections per page
-    results = (
-        db.query(
+def _pages_with_section_count(user_id: int):
+    # Join pages and sections, count sections per page of the user's domains
+    return (
+        select(
             models.Page.id,
             models.Page.title,
             models.Page.hierarchy,
             func.count(models.Section.id).label("sections")
         )
+        .join(models.Domain, models.Page.domain_id == models.Domain.id)
         .outerjoin(models.Section, models.Page.id == models.Section.page_id)
-        .filter(models.Page.domain_id.in_(domain_ids))
+        .where(models.Domain.user_id == user_id)
         .group_by(models.Page.id)
         .order_by(models.Page.hierarchy.asc())
-        .all()
     )
-    # Convert to list of dicts
+
+def _page_rows_to_dicts(results):
     return [
         {
             "id": str(row.id),
@@ -127,6 +137,9 @@ def get_pages_by_user_id(db: Session, user_id: int):
         for row in results
     ]
 
+def get_pages_by_user_id(db: Session, user_id: int):
+    return _page_rows_to_dicts(db.execute(_pages_with_section_count(user_id)).all())
+
 
 
 # SECTIONS
@@ -146,17 +159,69 @@ def create_section(db: Session, section: schemas.SectionCreate, page_id: int = N
     return db_section
 
 def get_sections_by_page_and_user(db: Session, page_id: int, user_id: int):
-    # Get all domains for the user
-    domains = db.query(models.Domain).filter(models.Domain.user_id == user_id).all()
-    domain_ids = [domain.id for domain in domains]
-    # Get the page and check if it belongs to one of the user's domains
-    page = db.query(models.Page).filter(models.Page.id == page_id, models.Page.domain_id.in_(domain_ids)).first()
-    if not page:
+    # Check that the page belongs to one of the user's domains
+    if not ownership.is_owner(db, "page", page_id, user_id):
         return []
     # Return all sections for this page
     return db.query(models.Section).filter(
         (models.Section.page_id == page_id) & (models.Section.title != "is")
     ).all()
+
+def reorder_sections(db: Session, page_id: int, section_ids: list[int], user_id: int):
+    """
+    Put the page's sections in the order of `section_ids` (positions 0..n-1).
+    Listed sections of the user's other pages on the same domain are moved to
+    this page. Two SELECTs check all ids and the page's domain, then one
+    UPDATE sets every position and page_id.
+
+    Raises:
+        HTTPException: 400 for duplicate ids, a section of the page missing
+            from the list or a section of another domain (its media would
+            stay on the old domain), 404 for ids that are not the user's
+            sections.
+
+    Returns:
+        list[models.Section]: The page's sections in their new order.
+    """
+    if len(set(section_ids)) != len(section_ids):
+        raise HTTPException(status_code=400, detail="section_ids contains duplicates")
+
+    rows = db.execute(
+        select(models.Section.id, models.Section.page_id, models.Page.domain_id, models.Domain.user_id)
+        .join(models.Page, models.Section.page_id == models.Page.id)
+        .join(models.Domain, models.Page.domain_id == models.Domain.id)
+        .where((models.Section.id.in_(section_ids)) | (models.Section.page_id == page_id))
+    ).all()
+    # Someone else's sections are reported like missing ones
+    found = {row.id for row in rows if row.user_id == user_id}
+    unknown = set(section_ids) - found
+    if unknown:
+        raise HTTPException(status_code=404, detail=f"Sections not found: {sorted(unknown)}")
+    missing = {row.id for row in rows if row.page_id == page_id} - set(section_ids)
+    if missing:
+        raise HTTPException(status_code=400, detail=f"section_ids must list every section of the page, missing: {sorted(missing)}")
+    domain_id = db.execute(select(models.Page.domain_id).where(models.Page.id == page_id)).scalar_one()
+    other_domain = sorted(row.id for row in rows if row.domain_id != domain_id)
+    if other_domain:
+        raise HTTPException(status_code=400, detail=f"Sections of another domain cannot be moved here: {other_domain}")
+
+    if section_ids:
+        db.execute(
+            update(models.Section)
+            .where(models.Section.id.in_(section_ids))
+            .values(
+                position=case({section_id: i for i, section_id in enumerate(section_ids)}, value=models.Section.id),
+                page_id=page_id,
+            )
+            .execution_options(synchronize_session=False)
+        )
+        db.commit()
+    return (
+        db.query(models.Section)
+        .filter(models.Section.page_id == page_id)
+        .order_by(models.Section.position, models.Section.id)
+        .all()
+    )
 # SEO
 def create_seo(db: Session, seo: schemas.SEOCreate):
     db_seo = models.SEO(**seo.dict())
@@ -177,6 +242,7 @@ def create_project(db: Session, project: schemas.ProjectCreate):
     db_project = models.Project(**project.dict())
     db.add(db_project)
     db.commit()
+    cache.bump_domain(db_project.domain_id)
     return get_project(db, db_project.id)
 
 
@@ -202,36 +268,69 @@ def get_projects_by_domain(db: Session, domain_id: int):
     )
 
 
-def get_all_projects_with_data(db: Session):
+PUBLIC_PROJECTS_BATCH_SIZE = 100
+
+
+def _projects_with_data(domain_name: str | None, after_id: int | None, size: int):
+    # selectinload runs one IN (...) query per collection instead of joining
+    # fields and media together, which returned fields x media rows per project
+    stmt = select(models.Project).options(
+        selectinload(models.Project.fields),
+        selectinload(models.Project.media_items.and_(models.Media.status == "ready")),
+    )
+    if domain_name is not None:
+        stmt = stmt.join(models.Domain, models.Project.domain_id == models.Domain.id).where(
+            models.Domain.name == domain_name
+        )
+    if after_id is not None:
+        stmt = stmt.where(models.Project.id > after_id)
+    return stmt.order_by(models.Project.id.asc()).limit(size)
+
+
+def get_all_projects_with_data(db: Session, limit: int | None = None, after_id: int | None = None):
     """
     Get all projects with all their related data (fields and media).
     This is a public endpoint that returns comprehensive project information.
     """
-    return (
-        db.query(models.Project)
-        .options(
-            joinedload(models.Project.fields),
-            joinedload(models.Project.media_items)
-        )
-        .all()
-    )
+    return [project for batch in iter_projects_with_data(db, None, limit, after_id) for project in batch]
 
 
-def get_projects_by_domain_name(db: Session, domain_name: str):
+def get_projects_by_domain_name(db: Session, domain_name: str, limit: int | None = None, after_id: int | None = None):
     """
     Get all projects for a specific domain by domain name.
     Includes all related data (fields and media).
     """
-    return (
-        db.query(models.Project)
-        .join(models.Domain, models.Project.domain_id == models.Domain.id)
-        .options(
-            joinedload(models.Project.fields),
-            joinedload(models.Project.media_items)
-        )
-        .filter(models.Domain.name == domain_name)
-        .all()
-    )
+    return [project for batch in iter_projects_with_data(db, domain_name, limit, after_id) for project in batch]
+
+
+def iter_projects_with_data(
+    db: Session,
+    domain_name: str | None = None,
+    limit: int | None = None,
+    after_id: int | None = None,
+    batch_size: int = PUBLIC_PROJECTS_BATCH_SIZE,
+):
+    """
+    Yield projects (with fields and media) in id order, one keyset page at a
+    time, so callers can stream large portfolios without holding them all.
+
+    Args:
+        domain_name (str | None): Only projects of this domain when given.
+        limit (int | None): Stop after this many projects.
+        after_id (int | None): Keyset cursor; only projects with a larger id.
+    """
+    remaining = limit
+    while remaining is None or remaining > 0:
+        size = batch_size if remaining is None else min(batch_size, remaining)
+        batch = db.execute(_projects_with_data(domain_name, after_id, size)).scalars().all()
+        if not batch:
+            return
+        yield batch
+        after_id = batch[-1].id
+        if remaining is not None:
+            remaining -= len(batch)
+        if len(batch) < size:
+            return
 
 
 def update_project(db: Session, project_id: int, project_update: schemas.ProjectUpdate):
@@ -244,6 +343,7 @@ def update_project(db: Session, project_id: int, project_update: schemas.Project
         setattr(db_project, key, value)
 
     db.commit()
+    cache.bump_domain(db_project.domain_id)
     return get_project(db, project_id)
 
 
@@ -252,8 +352,10 @@ def delete_project(db: Session, project_id: int):
     if not db_project:
         raise HTTPException(status_code=404, detail="Project not found")
 
+    domain_id = db_project.domain_id
     db.delete(db_project)
     db.commit()
+    cache.bump_domain(domain_id)
     return db_project
 
 
@@ -273,11 +375,16 @@ def get_project_field(db: Session, field_id: int):
     return db.query(models.ProjectField).filter(models.ProjectField.id == field_id).first()
 
 
+def get_project_domain_id(db: Session, project_id: int):
+    return db.query(models.Project.domain_id).filter(models.Project.id == project_id).scalar()
+
+
 def create_project_field(db: Session, project_field: schemas.ProjectFieldCreate):
     db_field = models.ProjectField(**project_field.dict())
     db.add(db_field)
     db.commit()
     db.refresh(db_field)
+    cache.bump_domain(get_project_domain_id(db, db_field.project_id))
     return db_field
 
 
@@ -292,6 +399,7 @@ def update_project_field(db: Session, field_id: int, field_update: schemas.Proje
 
     db.commit()
     db.refresh(db_field)
+    cache.bump_domain(get_project_domain_id(db, db_field.project_id))
     return db_field
 
 
@@ -300,20 +408,125 @@ def delete_project_field(db: Session, field_id: int):
     if not db_field:
         raise HTTPException(status_code=404, detail="Project field not found")
 
+    project_id = db_field.project_id
     db.delete(db_field)
     db.commit()
+    cache.bump_domain(get_project_domain_id(db, project_id))
     return db_field
 
 
+PROJECT_FIELD_COLUMNS = ("field_key", "field_value", "field_type", "field_definition_id")
+# May be omitted from an upsert, but not set to null: field_key is NOT NULL and
+# ProjectFieldRead needs a field_type
+PROJECT_FIELD_REQUIRED = ("field_key", "field_type")
+
+
+def apply_project_field_batch(db: Session, project_id: int, batch: schemas.ProjectFieldBatch):
+    """
+    Upsert and delete fields of one project in a single transaction: one
+    SELECT of the current fields, then one UPDATE batch, one INSERT and one
+    DELETE, and one cache bump.
+
+    Raises:
+        HTTPException: 404 for field ids not in this project, 400 for a new
+            field without field_key, a null field_key or field_type, or an
+            id both upserted and deleted. Nothing is written then.
+
+    Returns:
+        models.Project: The project with its fields.
+    """
+    existing = {
+        row.id: row
+        for row in db.execute(
+            select(models.ProjectField.id, *(getattr(models.ProjectField, c) for c in PROJECT_FIELD_COLUMNS))
+            .where(models.ProjectField.project_id == project_id)
+        )
+    }
+    by_key = {row.field_key: field_id for field_id, row in existing.items()}
+
+    delete_ids = set(batch.delete)
+    unknown = delete_ids - existing.keys()
+    if unknown:
+        raise HTTPException(status_code=404, detail=f"Project fields not found: {sorted(unknown)}")
+
+    updates: dict[int, dict] = {}
+    inserts: dict[str, dict] = {}
+    for item in batch.upsert:
+        values = item.dict(exclude_unset=True, exclude={"id"})
+        nulls = [column for column in PROJECT_FIELD_REQUIRED if column in values and values[column] is None]
+        if nulls:
+            raise HTTPException(status_code=400, detail=f"{', '.join(nulls)} cannot be null")
+        field_id = item.id if item.id is not None else by_key.get(item.field_key)
+        if item.id is not None and item.id not in existing:
+            raise HTTPException(status_code=404, detail=f"Project field {item.id} not found")
+        if field_id is None:
+            if not item.field_key:
+                raise HTTPException(status_code=400, detail="field_key is required for new fields")
+            inserts.setdefault(item.field_key, {"project_id": project_id, "field_type": "text"}).update(values)
+            continue
+        if field_id in delete_ids:
+            raise HTTPException(status_code=400, detail=f"Project field {field_id} is both updated and deleted")
+        # Full rows, so the whole batch is one executemany of the same statement
+        current = updates.get(field_id) or {"id": field_id, **existing[field_id]._asdict()}
+        updates[field_id] = {**current, **values}
+
+    if updates:
+        db.execute(update(models.ProjectField), list(updates.values()))
+    if inserts:
+        db.execute(insert(models.ProjectField), list(inserts.values()))
+    if delete_ids:
+        db.execute(delete(models.ProjectField).where(models.ProjectField.id.in_(delete_ids)))
+    db.commit()
+    cache.bump_domain(get_project_domain_id(db, project_id))
+    return get_project(db, project_id)
+
+
 # MEDIA
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".gif", ".webp", ".bmp", ".svg", ".avif")
+VIDEO_EXTENSIONS = (".mp4", ".webm", ".mov", ".avi", ".mkv", ".m4v")
+
+def media_kind(media_type: str | None, file_url: str | None) -> str:
+    """Classify media as image, video or other from its type and file extension."""
+    file_url = (file_url or "").lower()
+    if media_type == "image" or file_url.endswith(IMAGE_EXTENSIONS):
+        return "image"
+    if media_type == "video" or file_url.endswith(VIDEO_EXTENSIONS):
+        return "video"
+    return "other"
+
 def create_media(db: Session, media: schemas.MediaCreate):
     # Ensure title is provided since it's required in the database
     if not media.title:
         raise HTTPException(status_code=400, detail="Media title is required")
         
     db_media = models.Media(**media.dict())
+    db_media.kind = media_kind(media.type, media.file_url)
+
+    db.add(db_media)
+    db.commit()
+    db.refresh(db_media)
+    cache.bump_domain(db_media.domain_id)
+    return db_media
+
+def create_processing_media(db: Session, media: schemas.MediaCreate, job_kind: str, job_payload: dict):
+    """
+    Create a media row in the 'processing' state together with the job that
+    will produce its files, in one transaction. The job payload gets `media_id`.
+    """
+    if not media.title:
+        raise HTTPException(status_code=400, detail="Media title is required")
 
+    db_media = models.Media(**media.dict())
+    db_media.kind = media_kind(media.type, media.file_url)
+    db_media.status = "processing"
     db.add(db_media)
+    db.flush()
+
+    job = jobs.enqueue(
+        db, job_kind, {**job_payload, "media_id": db_media.id},
+        priority=jobs.PRIORITY_HIGH, created_by=media.uploaded_by,
+    )
+    db_media.job_id = job.id
     db.commit()
     db.refresh(db_media)
     return db_media
@@ -339,36 +552,387 @@ def get_media_by_domain(db: Session, domain_id: int):
 def get_media_by_project(db: Session, project_id: int):
     return db.query(models.Media).filter(models.Media.project_id == project_id).all()
 
-def get_all_media_by_domain(db: Session, domain_id: int):
-    return db.query(
+def _gallery_columns():
+    return select(
         models.Media.id,
         models.Media.title,
         models.Media.file_url,
         models.Media.type,
+        models.Media.kind,
+        models.Media.variants,
+        models.Media.placeholder,
+        models.Media.dominant_color,
         models.Media.domain_id,
         models.Media.section_id,
         models.Media.project_id,
         models.Media.text
-    ).filter(models.Media.domain_id == domain_id).all()
+    )
+
+def _gallery_media(domain_id, limit: int | None, after_id: int | None):
+    # Images and videos not linked to a project; served by ix_media_gallery
+    stmt = _gallery_columns().where(
+        models.Media.domain_id == domain_id,
+        models.Media.project_id.is_(None),
+        models.Media.kind.in_(("image", "video")),
+        models.Media.status == "ready",
+    )
+    if after_id is not None:
+        stmt = stmt.where(models.Media.id > after_id)
+    stmt = stmt.order_by(models.Media.id.asc())
+    if limit is not None:
+        stmt = stmt.limit(limit)
+    return stmt
+
+def get_all_media_by_domain(db: Session, domain_id: int):
+    return db.execute(_gallery_columns().where(models.Media.domain_id == domain_id)).all()
 def delete_media(db: Session, media_id: int):
     """
-    Delete a media item from the database by its ID.
+    Delete a media item from the database by its ID, releasing its blob.
 
     Args:
         db (Session): The database session.
         media_id (int): The ID of the media item to delete.
 
     Returns:
-        models.Media: The deleted media item.
+        tuple[models.Media, list[str]]: The deleted media item and the URLs of
+        files nothing references any more, for the caller to remove.
     """
     media_item = db.query(models.Media).filter(models.Media.id == media_id).first()
     if not media_item:
         raise HTTPException(status_code=404, detail="Media item not found")
-    
+
+    if media_item.blob_id is None:
+        # Stored before dedup: the media row owns its files
+        orphaned = [media_item.file_url, *(v["url"] for v in media_item.variants or [])]
+    else:
+        orphaned = _release_blob(db, media_item.blob_id)
+
     db.delete(media_item)
     db.commit()
+    cache.bump_domain(media_item.domain_id)
+    return media_item, [url for url in orphaned if url]
+
+# MEDIA BLOBS
+def _blob_urls(blob: models.MediaBlob) -> list[str]:
+    return [blob.file_url, *(v["url"] for v in blob.variants or [])]
+
+def get_blob_by_sha256(db: Session, sha256: str):
+    return db.query(models.MediaBlob).filter(models.MediaBlob.sha256 == sha256).first()
+
+def _discard_stored(db: Session, stored: dict):
+    # Files written for a blob that another upload of the same content created
+    # first; their own names (see storage) make them safe to remove
+    urls = [stored["file_url"], *(v["url"] for v in stored["variants"] or [])]
+    jobs.enqueue(db, "delete_files", {"urls": urls}, priority=jobs.PRIORITY_LOW)
+
+def create_media_for_blob(db: Session, media: schemas.MediaCreate, sha256: str):
+    """
+    Create a ready media item sharing the stored files of this content. The
+    blob reference is taken in the transaction that inserts the item, so a
+    failed insert cannot leak it.
+
+    Returns:
+        models.Media | None: The item, or None if the content is new.
+    """
+    if not media.title:
+        raise HTTPException(status_code=400, detail="Media title is required")
+
+    # Increment in SQL so concurrent uploads of the same file do not lose counts
+    updated = db.execute(
+        update(models.MediaBlob)
+        .where(models.MediaBlob.sha256 == sha256)
+        .values(ref_count=models.MediaBlob.ref_count + 1)
+    ).rowcount
+    if not updated:
+        db.rollback()
+        return None
+
+    blob = get_blob_by_sha256(db, sha256)
+    db_media = models.Media(
+        **media.dict(exclude={"file_url", "aspect_ratio"}),
+        blob_id=blob.id,
+        file_url=blob.file_url,
+        variants=blob.variants,
+        aspect_ratio=blob.aspect_ratio,
+        placeholder=blob.placeholder,
+        dominant_color=blob.dominant_color,
+    )
+    db_media.kind = media_kind(media.type, blob.file_url)
+    db.add(db_media)
+    db.commit()
+    db.refresh(db_media)
+    cache.bump_domain(db_media.domain_id)
+    return db_media
+
+def attach_blob(db: Session, media_id: int, sha256: str, stored: dict | None = None):
+    """
+    Point a processing media item at the blob with this hash, taking a
+    reference, and mark it ready; one transaction, so a retried job cannot
+    count a reference twice.
+
+    Args:
+        stored (dict, optional): file_url, variants, aspect_ratio, placeholder,
+            dominant_color and size_bytes of freshly written files, to create
+            the blob if it does not exist.
+
+    Returns:
+        models.Media | None: The media item, or None when it was deleted (the
+        `stored` files are then queued for removal) or there is no blob for
+        the hash yet and `stored` was not given.
+    """
+    # Locked and read fresh, so a concurrent delete either waits for this
+    # transaction or is seen here
+    media_item = db.get(models.Media, media_id, with_for_update=True, populate_existing=True)
+    if media_item is None and stored is not None:
+        # Deleted while its files were being written: nothing will own them
+        _discard_stored(db, stored)
+        db.commit()
+        return None
+    if media_item is None or media_item.blob_id is not None:
+        # Deleted meanwhile, or finished by an earlier attempt
+        return media_item
+
+    updated = db.execute(
+        update(models.MediaBlob)
+        .where(models.MediaBlob.sha256 == sha256)
+        .values(ref_count=models.MediaBlob.ref_count + 1)
+    ).rowcount
+    if not updated:
+        if stored is None:
+            db.rollback()
+            return None
+        try:
+            with db.begin_nested():
+                db.add(models.MediaBlob(sha256=sha256, ref_count=1, **stored))
+        except IntegrityError:
+            # Stored concurrently by another upload of the same content
+            db.execute(
+                update(models.MediaBlob)
+                .where(models.MediaBlob.sha256 == sha256)
+                .values(ref_count=models.MediaBlob.ref_count + 1)
+            )
+            _discard_stored(db, stored)
+    elif stored is not None:
+        _discard_stored(db, stored)
+
+    blob = get_blob_by_sha256(db, sha256)
+    media_item.blob_id = blob.id
+    media_item.file_url = blob.file_url
+    media_item.variants = blob.variants
+    media_item.aspect_ratio = blob.aspect_ratio
+    media_item.placeholder = blob.placeholder
+    media_item.dominant_color = blob.dominant_color
+    media_item.kind = media_kind(media_item.type, blob.file_url)
+    media_item.status = "ready"
+    db.commit()
+    cache.bump_domain(media_item.domain_id)
     return media_item
 
+def create_media_batch(db: Session, items: list[tuple[schemas.MediaCreate, str]], stored: dict[str, dict]):
+    """
+    Create media items for already stored content in one transaction: one
+    reference count update (or insert) per distinct hash, one INSERT batch for
+    the media rows and one cache bump per domain.
+
+    Args:
+        items: (media, sha256) per item; file fields come from the blob.
+        stored: what storage.store_files returned for the hashes whose files
+            were just written, to create their blobs.
+
+    Returns:
+        list[models.Media]: The created items, in the order of `items`.
+    """
+    for media, _ in items:
+        if not media.title:
+            raise HTTPException(status_code=400, detail="Media title is required")
+
+    counts = Counter(sha for _, sha in items)
+
+    # Known content: one UPDATE per distinct count (usually just one)
+    by_count: dict[int, list[str]] = {}
+    for sha256, count in counts.items():
+        if sha256 not in stored:
+            by_count.setdefault(count, []).append(sha256)
+    for count, hashes in by_count.items():
+        updated = db.execute(
+            update(models.MediaBlob)
+            .where(models.MediaBlob.sha256.in_(hashes))
+            .values(ref_count=models.MediaBlob.ref_count + count)
+        ).rowcount
+        if updated != len(hashes):
+            # Existed when the upload started, deleted since
+            db.rollback()
+            raise HTTPException(status_code=409, detail="Media changed during upload, please retry")
+
+    # New content: one multi-row INSERT, per row only if someone stored the
+    # same content concurrently
+    new_blobs = [{"sha256": sha256, "ref_count": counts[sha256], **stored[sha256]} for sha256 in counts if sha256 in stored]
+    if new_blobs:
+        try:
+            with db.begin_nested():
+                db.execute(insert(models.MediaBlob), new_blobs)
+        except IntegrityError:
+            for blob in new_blobs:
+                try:
+                    with db.begin_nested():
+                        db.execute(insert(models.MediaBlob), [blob])
+                except IntegrityError:
+                    db.execute(
+                        update(models.MediaBlob)
+                        .where(models.MediaBlob.sha256 == blob["sha256"])
+                        .values(ref_count=models.MediaBlob.ref_count + blob["ref_count"])
+                    )
+                    _discard_stored(db, stored[blob["sha256"]])
+
+    blobs = {
+        blob.sha256: blob
+        for blob in db.query(models.MediaBlob).filter(models.MediaBlob.sha256.in_(counts))
+    }
+    rows = []
+    for media, sha256 in items:
+        blob = blobs[sha256]
+        row = media.dict(exclude={"file_url", "aspect_ratio"})
+        row.update(
+            blob_id=blob.id,
+            file_url=blob.file_url,
+            variants=blob.variants,
+            aspect_ratio=blob.aspect_ratio,
+            placeholder=blob.placeholder,
+            dominant_color=blob.dominant_color,
+            kind=media_kind(media.type, blob.file_url),
+            status="ready",
+        )
+        rows.append(row)
+
+    # Multi-row INSERT ... RETURNING where the database has it (MariaDB 10.5+,
+    # PostgreSQL, SQLite); MySQL gets one INSERT per row with its lastrowid.
+    # Returned ids are not ordered like `rows`; rows with the same title and
+    # blob are interchangeable, so match on those.
+    if db.get_bind().dialect.insert_executemany_returning:
+        ids = db.execute(insert(models.Media).returning(models.Media.id), rows).scalars().all()
+    else:
+        ids = [db.execute(insert(models.Media).values(**row)).inserted_primary_key[0] for row in rows]
+    db.commit()
+    for domain_id in {row["domain_id"] for row in rows}:
+        cache.bump_domain(domain_id)
+
+    # One SELECT instead of a refresh per row
+    created: dict[tuple, list] = {}
+    for item in db.query(models.Media).filter(models.Media.id.in_(ids)).order_by(models.Media.id):
+        created.setdefault((item.title, item.blob_id), []).append(item)
+    return [created[(row["title"], row["blob_id"])].pop(0) for row in rows]
+
+def get_existing_blob_hashes(db: Session, hashes) -> set[str]:
+    return set(db.execute(select(models.MediaBlob.sha256).where(models.MediaBlob.sha256.in_(set(hashes)))).scalars())
+
+def set_media_status(db: Session, media_id: int, status: str):
+    db.execute(update(models.Media).where(models.Media.id == media_id).values(status=status))
+    db.commit()
+
+def _release_blob(db: Session, blob_id: int) -> list[str]:
+    # Part of the caller's transaction; returns the files to remove once the
+    # last reference is gone
+    blob = db.get(models.MediaBlob, blob_id)
+    if blob is None:
+        return []
+    urls = _blob_urls(blob)
+    db.execute(
+        update(models.MediaBlob)
+        .where(models.MediaBlob.id == blob_id)
+        .values(ref_count=models.MediaBlob.ref_count - 1)
+    )
+    db.flush()
+    removed = db.execute(
+        delete(models.MediaBlob).where(models.MediaBlob.id == blob_id, models.MediaBlob.ref_count <= 0)
+    ).rowcount
+    db.expunge(blob)
+    return urls if removed else []
+
+def get_storage_report(db: Session) -> dict:
+    """Disk usage of deduplicated uploads and the space deduplication saved."""
+    blobs, references, stored, logical = db.execute(
+        select(
+            func.count(models.MediaBlob.id),
+            func.coalesce(func.sum(models.MediaBlob.ref_count), 0),
+            func.coalesce(func.sum(models.MediaBlob.size_bytes), 0),
+            func.coalesce(func.sum(models.MediaBlob.size_bytes * models.MediaBlob.ref_count), 0),
+        )
+    ).one()
+    legacy = db.execute(
+        select(func.count(models.Media.id)).where(models.Media.blob_id.is_(None), models.Media.file_url.is_not(None))
+    ).scalar()
+    return {
+        "blobs": blobs,
+        "references": int(references),
+        "duplicates_skipped": int(references) - blobs,
+        "stored_bytes": int(stored),
+        "logical_bytes": int(logical),
+        "saved_bytes": int(logical) - int(stored),
+        "media_without_blob": legacy,
+    }
+
+# RESUMABLE UPLOADS
+def create_upload_session(
+    db: Session,
+    session_id: str,
+    user_id: int,
+    domain_id: int,
+    section_id: int | None,
+    upload: schemas.ResumableUploadCreate,
+    ttl: float,
+):
+    """
+    Record a new resumable upload together with the job that removes it once
+    abandoned, in one transaction.
+    """
+    db_session = models.UploadSession(
+        id=session_id,
+        user_id=user_id,
+        domain_id=domain_id,
+        section_id=section_id,
+        filename=upload.filename,
+        content_type=upload.content_type,
+        upload_length=upload.length,
+        upload_offset=0,
+        expires_at=datetime.utcnow() + timedelta(seconds=ttl),
+    )
+    db.add(db_session)
+    jobs.enqueue(db, "expire_upload_session", {"session_id": session_id}, priority=jobs.PRIORITY_LOW, delay=ttl, created_by=user_id)
+    db.commit()
+    db.refresh(db_session)
+    return db_session
+
+def get_upload_session(db: Session, session_id: str, user_id: int):
+    return db.query(models.UploadSession).filter(
+        models.UploadSession.id == session_id,
+        models.UploadSession.user_id == user_id,
+    ).first()
+
+def count_upload_sessions(db: Session, user_id: int) -> int:
+    return db.scalar(select(func.count()).where(models.UploadSession.user_id == user_id))
+
+def advance_upload_session(db: Session, session_id: str, from_offset: int, to_offset: int, ttl: float) -> bool:
+    """
+    Move the offset forward and extend the expiry, unless another request
+    moved it first. Returns whether this call did.
+
+    Part of the caller's transaction: the row stays locked until the caller
+    commits, so a concurrent call for the same offset waits and then fails.
+    """
+    updated = db.execute(
+        update(models.UploadSession)
+        .where(models.UploadSession.id == session_id, models.UploadSession.upload_offset == from_offset)
+        .values(upload_offset=to_offset, expires_at=datetime.utcnow() + timedelta(seconds=ttl))
+    ).rowcount
+    return bool(updated)
+
+def delete_upload_session(db: Session, session_id: str) -> bool:
+    """Remove a session row; only one caller (complete, cancel, expiry) gets True."""
+    deleted = db.execute(delete(models.UploadSession).where(models.UploadSession.id == session_id)).rowcount
+    db.commit()
+    return bool(deleted)
+
+
 # ADMIN — USERS
 def get_users_filtered(db: Session, email: str | None = None):
     q = db.query(models.User)
@@ -383,6 +947,7 @@ def delete_user(db: Session, user_id: int):
         raise HTTPException(status_code=404, detail="User not found")
     db.delete(user)
     db.commit()
+    cache.invalidate_user(user_id)
     return user
 
 
@@ -394,6 +959,7 @@ def update_user_admin(db: Session, user_id: int, data: schemas.AdminUserUpdate):
         setattr(user, field, value)
     db.commit()
     db.refresh(user)
+    cache.invalidate_user(user_id)
     return user
 
 
@@ -403,6 +969,7 @@ def create_domain(db: Session, domain: schemas.DomainCreate):
     db.add(db_domain)
     db.commit()
     db.refresh(db_domain)
+    cache.bump_domain(db_domain.id)
     return db_domain
 
 
@@ -414,6 +981,8 @@ def update_domain(db: Session, domain_id: int, data: schemas.DomainUpdate):
         setattr(domain, field, value)
     db.commit()
     db.refresh(domain)
+    cache.bump_domain(domain_id)
+    cache.clear_ownership()
     return domain
 
 
@@ -423,6 +992,8 @@ def delete_domain(db: Session, domain_id: int):
         raise HTTPException(status_code=404, detail="Domain not found")
     db.delete(domain)
     db.commit()
+    cache.bump_domain(domain_id)
+    cache.clear_ownership()
     return domain
 
 
@@ -461,8 +1032,207 @@ def create_email_log(db: Session, to_email: str, subject: str, body: str, sent_b
     return log
 
 
-def get_email_logs(db: Session, limit: int = 100):
-    return db.query(models.EmailLog).order_by(models.EmailLog.sent_at.desc()).limit(limit).all()
+def queue_email(db: Session, to_email: str, subject: str, body: str, sent_by: int):
+    """
+    Record an email as 'queued' together with the job that delivers it (see
+    mailer.py), in one transaction.
+    """
+    log = models.EmailLog(to_email=to_email, subject=subject, body=body, sent_by=sent_by, status="queued")
+    db.add(log)
+    db.flush()
+    job = jobs.enqueue(db, "send_email", {"email_log_id": log.id}, created_by=sent_by)
+    log.job_id = job.id
+    db.commit()
+    db.refresh(log)
+    return log
+
+
+def set_emails_status(db: Session, log_ids: list[int], status: str, error: str | None = None):
+    if not log_ids:
+        return
+    values = {"status": status, "error": error}
+    if status == "sent":
+        values["sent_at"] = func.now()
+    db.execute(update(models.EmailLog).where(models.EmailLog.id.in_(log_ids)).values(**values))
+    db.commit()
+
+
+def get_campaign_recipients(
+    db: Session,
+    emails: list[str] | None = None,
+    role: str | None = None,
+    domain_ids: list[int] | None = None,
+) -> list[dict]:
+    """
+    Distinct recipients with their template values (email, name, domains):
+    the given addresses, names filled in where they belong to a user, or else
+    the users with `role` and/or owning one of `domain_ids`.
+    """
+    query = select(models.User.id, models.User.email, models.User.name)
+    if emails is not None:
+        query = query.where(models.User.email.in_(emails))
+    else:
+        if role is not None:
+            query = query.where(models.User.role == role)
+        if domain_ids:
+            query = query.where(models.User.id.in_(select(models.Domain.user_id).where(models.Domain.id.in_(domain_ids))))
+    users = db.execute(query.order_by(models.User.id)).all()
+
+    domain_query = select(models.Domain.user_id, models.Domain.name).where(models.Domain.user_id.in_([u.id for u in users]))
+    if domain_ids:
+        domain_query = domain_query.where(models.Domain.id.in_(domain_ids))
+    domains = defaultdict(list)
+    for user_id, name in db.execute(domain_query.order_by(models.Domain.name)):
+        domains[user_id].append(name)
+
+    known = {
+        user.email.lower(): {"email": user.email, "name": user.name or "", "domains": ", ".join(domains[user.id])}
+        for user in users
+    }
+    if emails is None:
+        return list(known.values())
+    recipients = {}
+    for email in emails:
+        recipients.setdefault(email.lower(), known.get(email.lower(), {"email": email, "name": "", "domains": ""}))
+    return list(recipients.values())
+
+
+def create_email_campaign(db: Session, subject: str, body: str, recipients: list[dict], created_by: int):
+    """
+    Create a campaign, one rendered 'queued' EmailLog per recipient (a single
+    multi-row INSERT) and the job that sends them, in one transaction.
+    """
+    campaign = models.EmailCampaign(subject=subject, body=body, created_by=created_by, recipient_count=len(recipients))
+    db.add(campaign)
+    db.flush()
+
+    escape = mailer.is_html(body)
+    db.execute(insert(models.EmailLog), [
+        {
+            "to_email": recipient["email"],
+            "subject": mailer.render(subject, recipient),
+            "body": mailer.render(body, recipient, escape=escape),
+            "sent_by": created_by,
+            "status": "queued",
+            "campaign_id": campaign.id,
+        }
+        for recipient in recipients
+    ])
+    job = jobs.enqueue(db, "send_campaign", {"campaign_id": campaign.id}, priority=jobs.PRIORITY_LOW, created_by=created_by)
+    campaign.job_id = job.id
+    db.commit()
+    db.refresh(campaign)
+    return campaign
+
+
+def get_email_campaign(db: Session, campaign_id: int):
+    return db.get(models.EmailCampaign, campaign_id)
+
+
+def get_email_campaigns(db: Session, limit: int = 50):
+    return db.query(models.EmailCampaign).order_by(models.EmailCampaign.id.desc()).limit(limit).all()
+
+
+def get_email_campaign_counts(db: Session, campaign_ids: list[int]) -> dict[int, dict[str, int]]:
+    """Messages per status of each campaign, in one GROUP BY."""
+    counts = defaultdict(dict)
+    rows = db.execute(
+        select(models.EmailLog.campaign_id, models.EmailLog.status, func.count())
+        .where(models.EmailLog.campaign_id.in_(campaign_ids))
+        .group_by(models.EmailLog.campaign_id, models.EmailLog.status)
+    )
+    for campaign_id, status, count in rows:
+        counts[campaign_id][status] = count
+    return counts
+
+
+def get_queued_campaign_emails(db: Session, campaign_id: int, after_id: int, limit: int):
+    return db.query(models.EmailLog).filter(
+        models.EmailLog.campaign_id == campaign_id,
+        models.EmailLog.status == "queued",
+        models.EmailLog.id > after_id,
+    ).order_by(models.EmailLog.id).limit(limit).all()
+
+
+def fail_queued_campaign_emails(db: Session, campaign_id: int, error: str):
+    db.execute(
+        update(models.EmailLog)
+        .where(models.EmailLog.campaign_id == campaign_id, models.EmailLog.status == "queued")
+        .values(status="failed", error=error)
+    )
+    db.commit()
+
+
+def get_email_logs(
+    db: Session,
+    limit: int = 100,
+    before: int | None = None,
+    status: str | None = None,
+    to_email: str | None = None,
+    sent_by: int | None = None,
+    campaign_id: int | None = None,
+    sent_after: datetime | None = None,
+    sent_before: datetime | None = None,
+):
+    """
+    Email logs, newest first, with keyset pagination.
+
+    Pages are keyed on id, not sent_at: delivery rewrites sent_at, which would
+    move a log across the cursor and skip or repeat it between pages.
+
+    Args:
+        before (int, optional): id of the last log of the previous page; each
+            page is a range scan on the primary key or one of the
+            ix_email_logs_*_id indexes, however deep.
+        status, to_email, sent_by, campaign_id: Exact-match filters.
+        sent_after, sent_before (datetime, optional): sent_at range, inclusive / exclusive.
+
+    Returns:
+        List[models.EmailLog]: At most `limit` logs.
+    """
+    query = db.query(models.EmailLog)
+    if status is not None:
+        query = query.filter(models.EmailLog.status == status)
+    if to_email is not None:
+        query = query.filter(models.EmailLog.to_email == to_email)
+    if sent_by is not None:
+        query = query.filter(models.EmailLog.sent_by == sent_by)
+    if campaign_id is not None:
+        query = query.filter(models.EmailLog.campaign_id == campaign_id)
+    if sent_after is not None:
+        query = query.filter(models.EmailLog.sent_at >= sent_after)
+    if sent_before is not None:
+        query = query.filter(models.EmailLog.sent_at < sent_before)
+    if before is not None:
+        query = query.filter(models.EmailLog.id < before)
+    return query.order_by(models.EmailLog.id.desc()).limit(limit).all()
+
+
+def archive_email_logs(db: Session, cutoff: datetime, limit: int) -> int:
+    """
+    Move up to `limit` delivered or failed logs from before `cutoff` to
+    email_log_archive, bodies zlib-compressed, in one transaction.
+
+    Returns:
+        int: The number of logs moved; 0 once nothing is left to archive.
+    """
+    columns = models.EmailLog.__table__.c
+    rows = db.execute(
+        select(columns.id, columns.to_email, columns.subject, columns.body, columns.sent_by,
+               columns.status, columns.error, columns.campaign_id, columns.sent_at)
+        .where(columns.sent_at < cutoff, columns.status != "queued")
+        .order_by(columns.sent_at, columns.id)
+        .limit(limit)
+    ).mappings().all()
+    if not rows:
+        return 0
+    db.execute(insert(models.EmailLogArchive), [
+        {**{key: value for key, value in row.items() if key != "body"}, "body_gz": zlib.compress(row["body"].encode())}
+        for row in rows
+    ])
+    db.execute(delete(models.EmailLog).where(models.EmailLog.id.in_([row["id"] for row in rows])))
+    db.commit()
+    return len(rows)
 
 
 def update_media(db: Session, media_id: int, title: str, text: str, section_id: int, project_id: int | None):
@@ -487,4 +1257,76 @@ def update_media(db: Session, media_id: int, title: str, text: str, section_id:
     media_item.project_id = project_id
     db.commit()
     db.refresh(media_item)
-    return media_item
\ No newline at end of file
+    cache.bump_domain(media_item.domain_id)
+    return media_item
+
+
+# ASYNC READS
+# Used by the read-heavy routes so they do not pin a threadpool thread while
+# waiting on the database. Same queries as their sync counterparts above.
+async def get_user_async(db: AsyncSession, user_id: int):
+    return await db.get(models.User, user_id)
+
+
+async def get_all_domains_by_user_id_async(db: AsyncSession, user_id: int):
+    result = await db.execute(select(models.Domain).where(models.Domain.user_id == user_id))
+    return result.scalars().all()
+
+
+async def get_pages_by_user_id_async(db: AsyncSession, user_id: int):
+    result = await db.execute(_pages_with_section_count(user_id))
+    return _page_rows_to_dicts(result.all())
+
+
+async def get_media_by_domain_async(db: AsyncSession, domain_id: int):
+    result = await db.execute(select(models.Media).where(models.Media.domain_id == domain_id))
+    return result.scalars().all()
+
+
+async def get_all_media_by_domain_async(db: AsyncSession, domain_id: int):
+    result = await db.execute(_gallery_columns().where(models.Media.domain_id == domain_id))
+    return result.all()
+
+
+async def get_media_rendition_async(db: AsyncSession, media_id: int):
+    # Only what the image serving paths need to pick or render a rendition
+    result = await db.execute(
+        select(
+            models.Media.file_url,
+            models.Media.kind,
+            models.Media.variants,
+            models.Media.domain_id,
+            models.MediaBlob.sha256,
+        )
+        .outerjoin(models.MediaBlob, models.Media.blob_id == models.MediaBlob.id)
+        .where(models.Media.id == media_id)
+    )
+    return result.first()
+
+
+async def get_gallery_media_async(db: AsyncSession, domain_id, limit: int | None = None, after_id: int | None = None):
+    result = await db.execute(_gallery_media(domain_id, limit, after_id))
+    return result.all()
+
+
+async def iter_projects_with_data_async(
+    db: AsyncSession,
+    domain_name: str | None = None,
+    limit: int | None = None,
+    after_id: int | None = None,
+    batch_size: int = PUBLIC_PROJECTS_BATCH_SIZE,
+):
+    """Async version of `iter_projects_with_data`."""
+    remaining = limit
+    while remaining is None or remaining > 0:
+        size = batch_size if remaining is None else min(batch_size, remaining)
+        result = await db.execute(_projects_with_data(domain_name, after_id, size))
+        batch = result.scalars().all()
+        if not batch:
+            return
+        yield batch
+        after_id = batch[-1].id
+        if remaining is not None:
+            remaining -= len(batch)
+        if len(batch) < size:
+            return
@@ -0,0 +1,277 @@
+"""
+Durable background jobs, stored in the `jobs` table of the main database.
+
+Routes enqueue work in their own transaction (`enqueue` only adds the row), so
+a job exists exactly when the change that needs it was committed. Workers
+claim the highest-priority due job with a conditional UPDATE, which is safe
+with any number of worker threads and processes, run the handler registered
+for its kind, and retry failures with exponential backoff. A job left
+'running' by a worker that died is queued again after JOB_LOCK_TIMEOUT.
+
+Workers run as threads inside the API process (JOB_WORKER_EMBEDDED) and/or
+as a separate process (`python worker.py`). Both need the same uploads
+directory as the API.
+
+Settings (environment):
+- JOB_WORKER_EMBEDDED: run workers inside the API process (default: true)
+- JOB_WORKER_CONCURRENCY: worker threads per process (default: 2)
+- JOB_POLL_INTERVAL: seconds between polls of an idle worker (default: 1)
+- JOB_RETRY_BASE_DELAY: backoff after the first failure, doubled per attempt (default: 5)
+- JOB_RETRY_MAX_DELAY: upper bound of the backoff (default: 600)
+- JOB_LOCK_TIMEOUT: seconds after which a running job is considered abandoned (default: 900)
+- JOB_RETENTION_DAYS: age at which done and failed jobs are deleted, 0 to keep them (default: 7)
+- JOB_PURGE_INTERVAL: seconds between runs of the "purge_jobs" job (default: 3600)
+"""
+import logging
+import os
+import random
+import socket
+import threading
+import traceback
+from datetime import datetime, timedelta
+from sqlalchemy import delete, event, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+import database
+import models
+
+JOB_WORKER_EMBEDDED = os.getenv("JOB_WORKER_EMBEDDED", "true").lower() == "true"
+JOB_WORKER_CONCURRENCY = int(os.getenv("JOB_WORKER_CONCURRENCY", "2"))
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "1"))
+JOB_RETRY_BASE_DELAY = float(os.getenv("JOB_RETRY_BASE_DELAY", "5"))
+JOB_RETRY_MAX_DELAY = float(os.getenv("JOB_RETRY_MAX_DELAY", "600"))
+JOB_LOCK_TIMEOUT = float(os.getenv("JOB_LOCK_TIMEOUT", "900"))
+JOB_RETENTION_DAYS = float(os.getenv("JOB_RETENTION_DAYS", "7"))
+JOB_PURGE_INTERVAL = float(os.getenv("JOB_PURGE_INTERVAL", "3600"))
+
+# Priorities; higher runs first
+PRIORITY_HIGH = 10
+PRIORITY_NORMAL = 0
+PRIORITY_LOW = -10
+
+logger = logging.getLogger("jobs")
+
+_handlers: dict[str, tuple] = {}
+_wakeup = threading.Event()
+
+
+class PermanentError(Exception):
+    """Raise from a handler to fail the job without further retries."""
+
+
+def handler(kind: str, on_failure=None):
+    """
+    Register `fn(db, payload) -> result` for jobs of `kind`. The result must be
+    JSON serialisable. `on_failure(db, payload, error)` runs once the job has
+    failed for good.
+    """
+    def register(fn):
+        _handlers[kind] = (fn, on_failure)
+        return fn
+    return register
+
+
+def enqueue(
+    db: Session,
+    kind: str,
+    payload: dict,
+    priority: int = PRIORITY_NORMAL,
+    max_attempts: int = 5,
+    delay: float = 0,
+    created_by: int | None = None,
+    schedule_key: str | None = None,
+) -> models.Job:
+    """
+    Add a job to the session; it is queued when the caller commits.
+    """
+    job = models.Job(
+        kind=kind,
+        payload=payload,
+        priority=priority,
+        max_attempts=max_attempts,
+        run_after=datetime.utcnow() + timedelta(seconds=delay),
+        created_by=created_by,
+        schedule_key=schedule_key,
+    )
+    db.add(job)
+    db.flush()
+    # Wake local workers as soon as the job is visible to them; one listener
+    # per session however many jobs it adds
+    db.info["jobs_wakeup"] = True
+    if not event.contains(db, "after_commit", _wake_workers):
+        event.listen(db, "after_commit", _wake_workers)
+    return job
+
+
+def _wake_workers(session: Session):
+    if session.info.pop("jobs_wakeup", False):
+        _wakeup.set()
+
+
+def schedule_once(db: Session, kind: str, payload: dict, delay: float = 0, priority: int = PRIORITY_LOW) -> models.Job | None:
+    """
+    Enqueue a job of `kind` unless one is already waiting. Periodic jobs call
+    this for their next run, and startup calls it to seed them, so there is
+    one pending run however many processes start: the waiting run holds the
+    unique `schedule_key` until a worker claims it.
+    """
+    waiting = db.scalar(
+        select(models.Job.id).where(models.Job.kind == kind, models.Job.status == "queued").limit(1)
+    )
+    if waiting is not None:
+        return None
+    try:
+        with db.begin_nested():
+            return enqueue(db, kind, payload, priority=priority, delay=delay, schedule_key=kind)
+    except IntegrityError:
+        # Another process scheduled it between the SELECT and the INSERT
+        return None
+
+
+def get_job(db: Session, job_id: int):
+    return db.get(models.Job, job_id)
+
+
+def purge_finished(db: Session, cutoff: datetime, limit: int) -> int:
+    """
+    Delete up to `limit` done or failed jobs last updated before `cutoff`, in
+    one transaction; rows still pointing at them get job_id NULL.
+
+    Returns:
+        int: The number of jobs deleted.
+    """
+    job_ids = db.execute(
+        select(models.Job.id)
+        .where(models.Job.status.in_(("done", "failed")), models.Job.updated_at < cutoff)
+        .order_by(models.Job.updated_at)
+        .limit(limit)
+    ).scalars().all()
+    if not job_ids:
+        return 0
+    for model in (models.Media, models.EmailLog, models.EmailCampaign):
+        db.execute(update(model).where(model.job_id.in_(job_ids)).values(job_id=None))
+    db.execute(delete(models.Job).where(models.Job.id.in_(job_ids)))
+    db.commit()
+    return len(job_ids)
+
+
+def _backoff(attempts: int) -> float:
+    delay = min(JOB_RETRY_MAX_DELAY, JOB_RETRY_BASE_DELAY * 2 ** (attempts - 1))
+    # Jitter so jobs that failed together do not retry together
+    return delay * random.uniform(0.8, 1.2)
+
+
+def _requeue_abandoned(db: Session):
+    cutoff = datetime.utcnow() - timedelta(seconds=JOB_LOCK_TIMEOUT)
+    requeued = db.execute(
+        update(models.Job)
+        .where(models.Job.status == "running", models.Job.locked_at < cutoff)
+        .values(status="queued", locked_by=None, locked_at=None)
+    ).rowcount
+    db.commit()
+    if requeued:
+        logger.warning("requeued %d abandoned jobs", requeued)
+
+
+def claim(db: Session, worker_id: str) -> models.Job | None:
+    """Take the next due job, or None when there is nothing to do."""
+    now = datetime.utcnow()
+    candidates = db.execute(
+        select(models.Job.id)
+        .where(models.Job.status == "queued", models.Job.run_after <= now)
+        .order_by(models.Job.priority.desc(), models.Job.id.asc())
+        .limit(5)
+    ).scalars().all()
+    for job_id in candidates:
+        # Only one worker's UPDATE can match while the job is still queued
+        claimed = db.execute(
+            update(models.Job)
+            .where(models.Job.id == job_id, models.Job.status == "queued")
+            .values(
+                status="running", locked_by=worker_id, locked_at=now, attempts=models.Job.attempts + 1,
+                schedule_key=None,  # the next run may be scheduled now
+            )
+        ).rowcount
+        db.commit()
+        if claimed:
+            return db.get(models.Job, job_id)
+    return None
+
+
+def run_job(db: Session, job: models.Job):
+    fn, on_failure = _handlers.get(job.kind, (None, None))
+    try:
+        if fn is None:
+            raise PermanentError(f"No handler for job kind {job.kind!r}")
+        result = fn(db, job.payload)
+    except Exception as exc:
+        db.rollback()
+        permanent = isinstance(exc, PermanentError) or job.attempts >= job.max_attempts
+        job.last_error = "".join(traceback.format_exception_only(exc)).strip()
+        job.locked_by = None
+        job.locked_at = None
+        if permanent:
+            job.status = "failed"
+            logger.error("job %d (%s) failed: %s", job.id, job.kind, job.last_error)
+        else:
+            job.status = "queued"
+            job.run_after = datetime.utcnow() + timedelta(seconds=_backoff(job.attempts))
+            logger.warning("job %d (%s) attempt %d failed, retrying: %s", job.id, job.kind, job.attempts, job.last_error)
+        db.commit()
+        if permanent and on_failure is not None:
+            try:
+                on_failure(db, job.payload, job.last_error)
+            except Exception:
+                db.rollback()
+                logger.exception("failure handler of job %d (%s) raised", job.id, job.kind)
+        return
+
+    job.status = "done"
+    job.result = result
+    job.last_error = None
+    job.locked_by = None
+    job.locked_at = None
+    db.commit()
+
+
+class Worker:
+    """Threads that claim and run jobs until `stop()`."""
+
+    def __init__(self, concurrency: int = JOB_WORKER_CONCURRENCY):
+        self.concurrency = concurrency
+        self._stopping = threading.Event()
+        self._threads: list[threading.Thread] = []
+        self._id = f"{socket.gethostname()}:{os.getpid()}"
+
+    def start(self):
+        for n in range(self.concurrency):
+            thread = threading.Thread(target=self._run, args=(f"{self._id}:{n}",), name=f"job-worker-{n}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout: float = 10):
+        self._stopping.set()
+        _wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads.clear()
+
+    def _run(self, worker_id: str):
+        next_requeue = 0.0
+        while not self._stopping.is_set():
+            db = database.SessionLocal()
+            try:
+                now = datetime.utcnow().timestamp()
+                if now >= next_requeue:
+                    _requeue_abandoned(db)
+                    next_requeue = now + JOB_LOCK_TIMEOUT / 10
+                job = claim(db, worker_id)
+                if job is not None:
+                    run_job(db, job)
+                    continue
+            except Exception:
+                logger.exception("job worker %s", worker_id)
+            finally:
+                db.close()
+            _wakeup.wait(JOB_POLL_INTERVAL)
+            _wakeup.clear()
@@ -0,0 +1,240 @@
+"""
+Outgoing email.
+
+Messages are not sent inside requests: `crud.queue_email` records an
+EmailLog row with status 'queued' plus a "send_email" job (see tasks.py), and
+the job workers deliver it through `pool`, retrying temporary failures with
+the job backoff. The pool keeps up to SMTP_POOL_SIZE connections open and
+logged in, so consecutive messages skip the TCP/TLS/AUTH handshake; idle
+connections are closed after SMTP_IDLE_TIMEOUT and one the server dropped is
+replaced transparently.
+
+Campaigns (`crud.create_email_campaign`) queue one rendered log row per
+recipient and a single "send_campaign" job that delivers them in batches with
+`send_many`: up to EMAIL_CAMPAIGN_CONCURRENCY sends at once over the same
+pool, started no faster than EMAIL_CAMPAIGN_RATE per second.
+
+Any SMTP server works for development, e.g. `python -m aiosmtpd -n -l
+localhost:8025` with SMTP_PORT=8025 SMTP_USE_TLS=false (aiosmtpd is in
+requirements-dev.txt, which tests/test_mailer.py also needs).
+
+Settings (environment):
+- SMTP_HOST, SMTP_PORT (465 means implicit TLS), SMTP_USER, SMTP_PASS, SMTP_FROM
+- SMTP_USE_TLS: STARTTLS on ports other than 465 (default: true)
+- SMTP_POOL_SIZE: connections open at once, per process (default: 4)
+- SMTP_IDLE_TIMEOUT: seconds an unused connection is kept (default: 60)
+- SMTP_TIMEOUT: socket timeout in seconds (default: 30)
+- EMAIL_CAMPAIGN_RATE: campaign messages per second, per process (default: 10)
+- EMAIL_CAMPAIGN_CONCURRENCY: campaign messages in flight at once (default: SMTP_POOL_SIZE)
+- EMAIL_CAMPAIGN_MAX_RECIPIENTS: recipients per campaign (default: 10000)
+- EMAIL_LOG_RETENTION_DAYS: age at which logs move to email_log_archive, 0 to keep them (default: 90)
+- EMAIL_LOG_ARCHIVE_INTERVAL: seconds between archive runs (default: 86400)
+"""
+import html
+import os
+import smtplib
+import string
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from email.utils import formatdate
+
+SMTP_HOST = os.getenv("SMTP_HOST", "localhost")
+SMTP_PORT = int(os.getenv("SMTP_PORT", "587"))
+SMTP_USER = os.getenv("SMTP_USER", "")
+SMTP_PASS = os.getenv("SMTP_PASS", "")
+SMTP_FROM = os.getenv("SMTP_FROM", "noreply@kirin-cms.nl")
+SMTP_USE_TLS = os.getenv("SMTP_USE_TLS", "true").lower() == "true"
+SMTP_POOL_SIZE = int(os.getenv("SMTP_POOL_SIZE", "4"))
+SMTP_IDLE_TIMEOUT = float(os.getenv("SMTP_IDLE_TIMEOUT", "60"))
+SMTP_TIMEOUT = float(os.getenv("SMTP_TIMEOUT", "30"))
+EMAIL_CAMPAIGN_RATE = float(os.getenv("EMAIL_CAMPAIGN_RATE", "10"))
+EMAIL_CAMPAIGN_CONCURRENCY = int(os.getenv("EMAIL_CAMPAIGN_CONCURRENCY", str(SMTP_POOL_SIZE)))
+EMAIL_CAMPAIGN_MAX_RECIPIENTS = int(os.getenv("EMAIL_CAMPAIGN_MAX_RECIPIENTS", "10000"))
+EMAIL_LOG_RETENTION_DAYS = float(os.getenv("EMAIL_LOG_RETENTION_DAYS", "90"))
+EMAIL_LOG_ARCHIVE_INTERVAL = float(os.getenv("EMAIL_LOG_ARCHIVE_INTERVAL", "86400"))
+
+# After these the server has reset the transaction and the connection is fine
+_CONNECTION_USABLE = (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused, smtplib.SMTPDataError)
+# How a connection the server closed while idle fails on its next use
+_CONNECTION_DROPPED = (smtplib.SMTPServerDisconnected, ConnectionResetError, BrokenPipeError)
+
+
+def build_message(to_email: str, subject: str, body: str, message_id: str | None = None) -> MIMEMultipart:
+    msg = MIMEMultipart("alternative")
+    msg["Subject"] = subject
+    msg["From"] = SMTP_FROM
+    msg["To"] = to_email
+    msg["Date"] = formatdate(localtime=True)
+    if message_id:
+        msg["Message-ID"] = message_id
+    msg.attach(MIMEText(body, "html" if is_html(body) else "plain"))
+    return msg
+
+
+def is_html(body: str) -> bool:
+    return "<" in body
+
+
+def render(template: str, values: dict, escape: bool = False) -> str:
+    """
+    Fill `$name`-style placeholders; unknown ones are left as they are. With
+    `escape` the values are HTML-escaped, for HTML bodies.
+    """
+    if escape:
+        values = {key: html.escape(str(value)) for key, value in values.items()}
+    return string.Template(template).safe_substitute(values)
+
+
+def stable_message_id(key: str) -> str:
+    """A Message-ID that stays the same across retries of the same email."""
+    return f"<{key}@{SMTP_FROM.rpartition('@')[2] or 'localhost'}>"
+
+
+def is_permanent(exc: Exception) -> bool:
+    """Whether retrying cannot help: the server answered with a 5xx code."""
+    if isinstance(exc, smtplib.SMTPRecipientsRefused):
+        return all(code >= 500 for code, _ in exc.recipients.values())
+    if isinstance(exc, smtplib.SMTPResponseException):
+        return exc.smtp_code >= 500
+    return False
+
+
+def _close(server: smtplib.SMTP):
+    try:
+        server.quit()
+    except (smtplib.SMTPException, OSError):
+        server.close()
+
+
+class SMTPPool:
+    """Logged-in SMTP connections shared by the sending threads."""
+
+    def __init__(self, size: int = SMTP_POOL_SIZE, idle_timeout: float = SMTP_IDLE_TIMEOUT):
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+        self._idle: list[tuple[smtplib.SMTP, float]] = []  # (connection, last used), most recent last
+        self.connects = 0
+        self.sent = 0
+
+    def _connect(self) -> smtplib.SMTP:
+        if SMTP_PORT == 465:
+            server = smtplib.SMTP_SSL(SMTP_HOST, SMTP_PORT, timeout=SMTP_TIMEOUT)
+        else:
+            server = smtplib.SMTP(SMTP_HOST, SMTP_PORT, timeout=SMTP_TIMEOUT)
+            if SMTP_USE_TLS:
+                server.ehlo()
+                server.starttls()
+        try:
+            if SMTP_USER and SMTP_PASS:
+                server.login(SMTP_USER, SMTP_PASS)
+        except BaseException:
+            _close(server)
+            raise
+        with self._lock:
+            self.connects += 1
+        return server
+
+    def _checkout(self) -> smtplib.SMTP:
+        now = time.monotonic()
+        with self._lock:
+            stale = [server for server, last_used in self._idle if now - last_used >= self.idle_timeout]
+            self._idle = [(server, last_used) for server, last_used in self._idle if now - last_used < self.idle_timeout]
+            server = self._idle.pop()[0] if self._idle else None
+        for old in stale:
+            _close(old)
+        return server if server is not None else self._connect()
+
+    @contextmanager
+    def connection(self):
+        """A connection for the duration of the block; at most `size` are out at once."""
+        with self._slots:
+            server = self._checkout()
+            try:
+                yield server
+            except _CONNECTION_USABLE:
+                self._checkin(server)
+                raise
+            except BaseException:
+                _close(server)
+                raise
+            self._checkin(server)
+
+    def _checkin(self, server: smtplib.SMTP):
+        with self._lock:
+            self._idle.append((server, time.monotonic()))
+
+    def send(self, msg: MIMEMultipart):
+        # A pooled connection may have been dropped by the server while idle;
+        # that only shows on use, so try once more on a fresh one
+        for attempt in (1, 2):
+            try:
+                with self.connection() as server:
+                    server.send_message(msg)
+                with self._lock:
+                    self.sent += 1
+                return
+            except _CONNECTION_DROPPED:
+                if attempt == 2:
+                    raise
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for server, _ in idle:
+            _close(server)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"size": self.size, "idle": len(self._idle), "connects": self.connects, "sent": self.sent}
+
+
+class RateLimiter:
+    """Spaces calls to `wait` at least 1/rate seconds apart, across threads."""
+
+    def __init__(self, rate: float):
+        self.interval = 1 / rate if rate > 0 else 0
+        self._lock = threading.Lock()
+        self._next = time.monotonic()
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+
+pool = SMTPPool()
+campaign_rate = RateLimiter(EMAIL_CAMPAIGN_RATE)
+
+
+def send(to_email: str, subject: str, body: str, message_id: str | None = None):
+    """Deliver one message now, over a pooled connection. Raises smtplib/OS errors."""
+    pool.send(build_message(to_email, subject, body, message_id))
+
+
+def send_many(messages: dict, concurrency: int = EMAIL_CAMPAIGN_CONCURRENCY, limiter: RateLimiter = campaign_rate) -> dict:
+    """
+    Send {key: message} concurrently over the pool, throttled by `limiter`.
+
+    Returns:
+        dict: key -> None when sent, or the exception that stopped it.
+    """
+    def deliver(item):
+        key, msg = item
+        limiter.wait()
+        try:
+            pool.send(msg)
+            return key, None
+        except (smtplib.SMTPException, OSError) as exc:
+            return key, exc
+
+    with ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix="smtp") as executor:
+        return dict(executor.map(deliver, messages.items()))
@@ -1,50 +1,37 @@
-from typing import List
-from fastapi import FastAPI, Depends, HTTPException, Response, Request, File, UploadFile
-from fastapi.responses import JSONResponse
+from typing import List, Literal
+import asyncio
+import calendar
+import hashlib
+import mimetypes
+import zipfile
+from datetime import datetime
+from email.utils import formatdate
+from fastapi import FastAPI, Depends, HTTPException, Response, Request, File, UploadFile, Query
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, RedirectResponse, StreamingResponse
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+from pydantic import TypeAdapter
 import models
 import database
 import schemas
 import crud
+import cache
+import ownership
+import query_stats
 from auth import create_access_token, decode_access_token, delete_access_token
 from fastapi.middleware.cors import CORSMiddleware
 import shutil
 import os
-from fastapi.staticfiles import StaticFiles
-import io
-from PIL import Image
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-
-SMTP_HOST = os.getenv("SMTP_HOST", "localhost")
-SMTP_PORT = int(os.getenv("SMTP_PORT", "587"))
-SMTP_USER = os.getenv("SMTP_USER", "")
-SMTP_PASS = os.getenv("SMTP_PASS", "")
-SMTP_FROM = os.getenv("SMTP_FROM", "noreply@kirin-cms.nl")
-SMTP_USE_TLS = os.getenv("SMTP_USE_TLS", "true").lower() == "true"
-
-
-def _send_smtp(to_email: str, subject: str, body: str):
-    msg = MIMEMultipart("alternative")
-    msg["Subject"] = subject
-    msg["From"] = SMTP_FROM
-    msg["To"] = to_email
-    msg.attach(MIMEText(body, "html" if "<" in body else "plain"))
-
-    if SMTP_PORT == 465:
-        with smtplib.SMTP_SSL(SMTP_HOST, SMTP_PORT) as server:
-            if SMTP_USER and SMTP_PASS:
-                server.login(SMTP_USER, SMTP_PASS)
-            server.sendmail(SMTP_FROM, to_email, msg.as_string())
-    else:
-        with smtplib.SMTP(SMTP_HOST, SMTP_PORT) as server:
-            if SMTP_USE_TLS:
-                server.ehlo()
-                server.starttls()
-            if SMTP_USER and SMTP_PASS:
-                server.login(SMTP_USER, SMTP_PASS)
-            server.sendmail(SMTP_FROM, to_email, msg.as_string())
+import jobs
+import tasks
+import media_processing
+import media_serving
+import resize_cache
+import resumable_uploads
+import storage
+import upload_files
+import mailer
 
 app = FastAPI()
 UPLOAD_DIR = "./uploads"
@@ -60,6 +47,10 @@ origins = [
     "https://api.kirin-cms.nl",
 ]
 
+query_stats.install(database.engine)
+query_stats.install(database.async_engine.sync_engine)
+app.add_middleware(query_stats.QueryStatsMiddleware)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=origins,  # Your frontend origin
@@ -68,8 +59,40 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Mount the static files directory
-app.mount("/uploads", StaticFiles(directory="uploads"), name="uploads")
+job_worker = jobs.Worker() if jobs.JOB_WORKER_EMBEDDED else None
+
+@app.on_event("startup")
+def start_job_worker():
+    if job_worker is not None:
+        job_worker.start()
+
+@app.on_event("startup")
+def schedule_periodic_jobs():
+    db = database.SessionLocal()
+    try:
+        tasks.schedule_periodic(db)
+    finally:
+        db.close()
+
+@app.on_event("shutdown")
+def stop_job_worker():
+    if job_worker is not None:
+        job_worker.stop()
+
+@app.on_event("shutdown")
+def shutdown_media_pool():
+    media_processing.shutdown()
+
+@app.on_event("shutdown")
+def close_smtp_connections():
+    mailer.pool.close()
+
+@app.on_event("shutdown")
+async def shutdown_async_engine():
+    await database.async_engine.dispose()
+
+# Uploaded files, with range requests and long-lived caching (see upload_files)
+app.mount("/uploads", upload_files.UploadFiles(directory="uploads"), name="uploads")
 
 # Dependency to get the database session
 def get_db():
@@ -79,8 +102,13 @@ def get_db():
     finally:
         db.close()
 
+# Async session for the read-heavy routes
+async def get_async_db():
+    async with database.AsyncSessionLocal() as db:
+        yield db
+
 # -- USERS --
-def get_current_user(request: Request, db: Session = Depends(get_db)) -> models.User:
+def _user_id_from_cookie(request: Request) -> int:
     token = request.cookies.get("access_token")
     if not token:
         raise HTTPException(status_code=401, detail="Not authenticated")
@@ -89,28 +117,39 @@ def get_current_user(request: Request, db: Session = Depends(get_db)) -> models.
     if not payload:
         raise HTTPException(status_code=401, detail="Invalid token")
 
-    user_id = payload.get("user_id")
-    user = db.query(models.User).filter(models.User.id == user_id).first()
+    return payload.get("user_id")
+
+def get_current_user(request: Request, db: Session = Depends(get_db)) -> cache.CachedUser:
+    """
+    Resolve the user from the access_token cookie. The user row is cached by
+    id, so most requests skip the database; routes that write to the user
+    row load it themselves with crud.get_user.
+    """
+    user_id = _user_id_from_cookie(request)
+    cached = cache.get_user(user_id)
+    if cached:
+        return cached
+
+    user = crud.get_user(db, user_id)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
-    
-    return user
+    return cache.set_user(user)
 
-@app.get("/api/me", response_model=schemas.UserRead)
-def get_logged_in_user(request: Request, db: Session = Depends(get_db)):
-    token = request.cookies.get("access_token")
-    if not token:
-        raise HTTPException(status_code=401, detail="Not authenticated")
+async def get_current_user_async(request: Request, db: AsyncSession = Depends(get_async_db)) -> cache.CachedUser:
+    """Same as get_current_user, for routes on the async session."""
+    user_id = _user_id_from_cookie(request)
+    cached = cache.get_user(user_id)
+    if cached:
+        return cached
 
-    payload = decode_access_token(token)
-    if not payload:
-        raise HTTPException(status_code=401, detail="Invalid token")
-
-    user_id = payload.get("user_id")
-    user = db.query(models.User).filter(models.User.id == user_id).first()
+    user = await crud.get_user_async(db, user_id)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
-    return user
+    return cache.set_user(user)
+
+@app.get("/api/me", response_model=schemas.UserRead)
+async def get_logged_in_user(current_user: cache.CachedUser = Depends(get_current_user_async)):
+    return current_user
 
 @app.post("/api/logout")
 def logout(request: Request, response: Response):
@@ -118,8 +157,9 @@ def logout(request: Request, response: Response):
     Logout the user by deleting the access token cookie and blacklisting the token.
     """
     token = request.cookies.get("access_token")  # Corrected line
-    if token:
-        delete_access_token(token)
+    payload = decode_access_token(token) if token else None
+    if payload:
+        delete_access_token(token, payload)
     
     response = JSONResponse(content={"message": "Logged out"})
     response.delete_cookie(key="access_token")
@@ -180,25 +220,30 @@ def get_users(db: Session = Depends(get_db)):
 @app.put("/api/users/update")
 def update_user(
     user_update: schemas.UserUpdate,
-    current_user: models.User = Depends(get_current_user),
+    current_user: cache.CachedUser = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
+    user = crud.get_user(db, current_user.id)
+    if not user:
+        cache.invalidate_user(current_user.id)
+        raise HTTPException(status_code=404, detail="User not found")
     if user_update.name:
-        current_user.name = user_update.name
+        user.name = user_update.name
     if user_update.email:
-        current_user.email = user_update.email
+        user.email = user_update.email
     db.commit()
-    db.refresh(current_user)
-    return current_user
+    db.refresh(user)
+    cache.invalidate_user(user.id)
+    return user
 
 @app.put("/api/users/change-password")
 def change_password_endpoint(
     password_data: schemas.ChangePassword,
     db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user)
+    current_user: cache.CachedUser = Depends(get_current_user)
 ):
     updated_user = crud.change_password(
-        db, current_user, password_data.old_password, password_data.new_password
+        db, crud.get_user(db, current_user.id), password_data.old_password, password_data.new_password
     )
     return {"message": "Password changed successfully"}
 
@@ -217,11 +262,11 @@ def create_page(page: schemas.PageCreate, db: Session = Depends(get_db)):
     return crud.create_page(db, page)
 
 @app.get("/api/pages/", response_model=List[schemas.PageWithSectionCount])
-def get_my_pages(
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user)
+async def get_my_pages(
+    db: AsyncSession = Depends(get_async_db),
+    current_user: cache.CachedUser = Depends(get_current_user_async)
 ):
-    return crud.get_pages_by_user_id(db, current_user.id)
+    return await crud.get_pages_by_user_id_async(db, current_user.id)
 
 
 # -- PROJECTS --
@@ -229,10 +274,9 @@ def get_my_pages(
 def create_project(
     project: schemas.ProjectCreate,
     db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user)
+    current_user: cache.CachedUser = Depends(get_current_user)
 ):
-    domain = crud.get_domain(db, project.domain_id)
-    if not domain or domain.user_id != current_user.id:
+    if not ownership.is_owner(db, "domain", project.domain_id, current_user.id):
         raise HTTPException(status_code=403, detail="You are not allowed to create projects for this domain")
     return crud.create_project(db, project)
 
@@ -240,7 +284,7 @@ def create_project(
 @app.get("/api/projects/", response_model=List[schemas.ProjectRead])
 def get_my_projects(
     db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user)
+    current_user: cache.CachedUser = Depends(get_current_user)
 ):
     domain = crud.get_domains_by_user_id(db, current_user.id)
     if not domain:
@@ -252,10 +296,9 @@ def get_my_projects(
 def get_projects_by_domain(
     domain_id: int,
     db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user)
+    current_user: cache.CachedUser = Depends(get_current_user)
 ):
-    domain = crud.get_domain(db, domain_id)
-    if not domain or domain.user_id != current_user.id:
+    if not ownership.is_owner(db, "domain", domain_id, current_user.id):
         raise HTTPException(status_code=403, detail="You are not allowed to view projects for this domain")
     return crud.get_projects_by_domain(db, domain_id)
 
@@ -264,10 +307,9 @@ def get_projects_by_domain(
 def get_domain_projects(
     domain_id: int,
     db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user)
+    current_user: cache.CachedUser = Depends(get_current_user)
 ):
-    domain = crud.get_domain(db, domain_id)
-    if not domain or domain.user_id != current_user.id:
+    if not ownership.is_owner(db, "domain", domain_id, current_user.id):
         raise HTTPException(status_code=403, detail="You are not allowed to view projects for this domain")
     return crud.get_projects_by_domain(db, domain_id)
 
@@ -276,16 +318,12 @@ def get_domain_projects(
 def get_project_by_id(
     project_id: int,
     db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user)
+    current_user: cache.CachedUser = Depends(get_current_user)
 ):
+    ownership.require_owner(db, "project", project_id, current_user.id, "You are not allowed to view this project")
     project = crud.get_project(db, project_id)
     if not project:
         raise HTTPException(status_code=404, detail="Project not found")
-
-    domain = crud.get_domain(db, project.domain_id)
-    if not domain or domain.user_id != current_user.id:
-        raise HTTPException(status_code=403, detail="You are not allowed to view this project")
-
     return project
 
 
@@ -294,16 +332,9 @@ def update_project(
     project_id: int,
     project_update: schemas.ProjectUpdate,
     db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user)
+    current_user: cache.CachedUser = Depends(get_current_user)
 ):
-    project = crud.get_project(db, project_id)
-    if not project:
-        raise HTTPException(status_code=404, detail="Project not found")
-
-    domain = crud.get_domain(db, project.domain_id)
-    if not domain or domain.user_id != current_user.id:
-        raise HTTPException(status_code=403, detail="You are not allowed to update this project")
-
+    ownership.require_owner(db, "project", project_id, current_user.id, "You are not allowed to update this project")
     return crud.update_project(db, project_id, project_update)
 
 
@@ -311,22 +342,83 @@ def update_project(
 def delete_project(
     project_id: int,
     db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user)
+    current_user: cache.CachedUser = Depends(get_current_user)
 ):
-    project = crud.get_project(db, project_id)
-    if not project:
-        raise HTTPException(status_code=404, detail="Project not found")
-
-    domain = crud.get_domain(db, project.domain_id)
-    if not domain or domain.user_id != current_user.id:
-        raise HTTPException(status_code=403, detail="You are not allowed to delete this project")
-
+    ownership.require_owner(db, "project", project_id, current_user.id, "You are not allowed to delete this project")
     crud.delete_project(db, project_id)
     return {"message": f"Project with ID {project_id} has been deleted successfully"}
 
 
+_project_adapter = TypeAdapter(schemas.ProjectWithAllData)
+# Larger bodies are streamed but not kept in the response cache
+PUBLIC_CACHE_MAX_BODY = 2 * 1024 * 1024
+
+
+async def _stream_projects(key, domain_name: str | None, limit: int | None, after_id: int | None, taken: int):
+    """
+    Serialize projects as a JSON array one keyset page at a time and, if the
+    body stays small enough, store it in the response cache once complete.
+    Uses its own session because it runs after the request handler returns.
+    """
+    async with database.AsyncSessionLocal() as db:
+        parts, size, domain_id = [], 0, None
+        first = True
+        yield b"["
+        async for batch in crud.iter_projects_with_data_async(db, domain_name, limit, after_id):
+            chunk = b",".join(
+                _project_adapter.dump_json(_project_adapter.validate_python(project, from_attributes=True))
+                for project in batch
+            )
+            if domain_name is not None:
+                domain_id = batch[0].domain_id
+            db.expunge_all()  # release the page before loading the next one
+            if not first:
+                chunk = b"," + chunk
+            first = False
+            if parts is not None:
+                parts.append(chunk)
+                size += len(chunk)
+                if size > PUBLIC_CACHE_MAX_BODY:
+                    parts = None
+            yield chunk
+        yield b"]"
+        if parts is not None:
+            cache.set_public(key, b"[" + b"".join(parts) + b"]", domain_id, taken)
+
+
+def _public_projects_response(request: Request, domain_name: str | None, limit: int | None, after_id: int | None):
+    """
+    Serve a public project list from the response cache, or stream it from the
+    database on a miss. Both carry an ETag for the data version they show and
+    answer a matching If-None-Match with 304.
+    """
+    key = ("projects", domain_name, limit, after_id)
+    if_none_match = request.headers.get("if-none-match")
+    entry = cache.get_public(key)
+    if entry is None:
+        taken = cache.snapshot()
+        headers = {"ETag": cache.version_etag(key, taken), "Cache-Control": "no-cache"}
+        # Nothing was written since the client's copy was built
+        if cache.etag_matches(if_none_match, headers["ETag"]):
+            return Response(status_code=304, headers=headers)
+        return StreamingResponse(
+            _stream_projects(key, domain_name, limit, after_id, taken),
+            media_type="application/json",
+            headers=headers,
+        )
+
+    headers = {"ETag": entry.etag, "Cache-Control": "no-cache"}
+    if cache.etag_matches(if_none_match, entry.etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=entry.body, media_type="application/json", headers=headers)
+
+
 @app.get("/api/public/projects", response_model=List[schemas.ProjectWithAllData])
-def get_all_projects_public(db: Session = Depends(get_db)):
+async def get_all_projects_public(
+    request: Request,
+    limit: int | None = Query(None, ge=1, le=500),
+    after_id: int | None = None,
+):
     """
     PUBLIC ENDPOINT: Get all projects with complete data.
     
@@ -337,6 +429,13 @@ def get_all_projects_public(db: Session = Depends(get_db)):
     
     This endpoint is public and does not require authentication.
     Perfect for embedding project data in other websites or applications.
+    Query params (optional, keyset pagination ordered by id):
+    - limit: maximum number of projects to return (1-500)
+    - after_id: only return projects with an id greater than this; pass the
+      id of the last project of the previous page
+
+    Responses are cached per worker and carry an ETag; send it back in
+    If-None-Match to get a 304 when nothing changed.
     
     Example response:
     [
@@ -350,16 +449,15 @@ def get_all_projects_public(db: Session = Depends(get_db)):
         }
     ]
     """
-    projects = crud.get_all_projects_with_data(db)
-    if not projects:
-        return []
-    return projects
+    return _public_projects_response(request, None, limit, after_id)
 
 
 @app.get("/api/public/projects/{domain_name}", response_model=List[schemas.ProjectWithAllData])
-def get_projects_by_domain_name(
+async def get_projects_by_domain_name(
     domain_name: str,
-    db: Session = Depends(get_db)
+    request: Request,
+    limit: int | None = Query(None, ge=1, le=500),
+    after_id: int | None = None,
 ):
     """
     PUBLIC ENDPOINT: Get all projects for a specific domain by domain name.
@@ -374,6 +472,8 @@ def get_projects_by_domain_name(
     
     This endpoint is public and does not require authentication.
     Perfect for embedding domain-specific project data in other websites or applications.
+    Supports the same limit/after_id pagination as /api/public/projects and
+    is cached and ETag-validated the same way.
     
     Example:
     GET /api/public/projects/kirin-cms.nl
@@ -412,16 +512,13 @@ def get_projects_by_domain_name(
         }
     ]
     """
-    projects = crud.get_projects_by_domain_name(db, domain_name)
-    if not projects:
-        return []
-    return projects
+    return _public_projects_response(request, domain_name, limit, after_id)
 
 
 @app.get("/api/project-field-definitions", response_model=List[schemas.ProjectFieldDefinitionRead])
 def get_project_field_definitions(
     db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user)
+    current_user: cache.CachedUser = Depends(get_current_user)
 ):
     domain = crud.get_domains_by_user_id(db, current_user.id)
     if not domain:
@@ -433,16 +530,11 @@ def get_project_field_definitions(
 def create_project_field(
     project_field: schemas.ProjectFieldCreate,
     db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user)
+    current_user: cache.CachedUser = Depends(get_current_user)
 ):
-    project = crud.get_project(db, project_field.project_id)
-    if not project:
-        raise HTTPException(status_code=404, detail="Project not found")
-
-    domain = crud.get_domain(db, project.domain_id)
-    if not domain or domain.user_id != current_user.id:
-        raise HTTPException(status_code=403, detail="You are not allowed to add fields to this project")
-
+    ownership.require_owner(
+        db, "project", project_field.project_id, current_user.id, "You are not allowed to add fields to this project"
+    )
     return crud.create_project_field(db, project_field)
 
 
@@ -451,41 +543,46 @@ def update_project_field(
     field_id: int,
     field_update: schemas.ProjectFieldUpdate,
     db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user)
+    current_user: cache.CachedUser = Depends(get_current_user)
 ):
-    db_field = crud.get_project_field(db, field_id)
-    if not db_field:
-        raise HTTPException(status_code=404, detail="Project field not found")
+    ownership.require_owner(
+        db, "project_field", field_id, current_user.id, "You are not allowed to update fields for this project"
+    )
+    return crud.update_project_field(db, field_id, field_update)
 
-    project = crud.get_project(db, db_field.project_id)
-    if not project:
-        raise HTTPException(status_code=404, detail="Project not found")
 
-    domain = crud.get_domain(db, project.domain_id)
-    if not domain or domain.user_id != current_user.id:
-        raise HTTPException(status_code=403, detail="You are not allowed to update fields for this project")
+@app.put("/api/projects/{project_id}/fields", response_model=schemas.ProjectRead)
+def batch_project_fields(
+    project_id: int,
+    batch: schemas.ProjectFieldBatch,
+    db: Session = Depends(get_db),
+    current_user: cache.CachedUser = Depends(get_current_user)
+):
+    """
+    Create, update and delete any number of fields of a project at once, in
+    one transaction; nothing is applied if any item is rejected.
 
-    return crud.update_project_field(db, field_id, field_update)
+    Args:
+        batch (schemas.ProjectFieldBatch): `upsert` items match an existing
+            field by id, then by field_key, and otherwise create one; `delete`
+            holds field ids.
+
+    Returns:
+        schemas.ProjectRead: The project with its fields after the change.
+    """
+    ownership.require_owner(db, "project", project_id, current_user.id, "You are not allowed to update fields for this project")
+    return crud.apply_project_field_batch(db, project_id, batch)
 
 
 @app.delete("/api/project-fields/{field_id}", response_model=dict)
 def delete_project_field(
     field_id: int,
     db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user)
+    current_user: cache.CachedUser = Depends(get_current_user)
 ):
-    db_field = crud.get_project_field(db, field_id)
-    if not db_field:
-        raise HTTPException(status_code=404, detail="Project field not found")
-
-    project = crud.get_project(db, db_field.project_id)
-    if not project:
-        raise HTTPException(status_code=404, detail="Project not found")
-
-    domain = crud.get_domain(db, project.domain_id)
-    if not domain or domain.user_id != current_user.id:
-        raise HTTPException(status_code=403, detail="You are not allowed to delete fields for this project")
-
+    ownership.require_owner(
+        db, "project_field", field_id, current_user.id, "You are not allowed to delete fields for this project"
+    )
     crud.delete_project_field(db, field_id)
     return {"message": f"Project field with ID {field_id} deleted successfully"}
 
@@ -507,13 +604,34 @@ def create_section(page_id: int, section: schemas.SectionCreate, db: Session = D
 def get_sections_by_page_id(
     page_id: int,
     db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user)
+    current_user: cache.CachedUser = Depends(get_current_user)
 ):
     """
     Get all sections for a specific page, only if the page belongs to the current user.
     """
     return crud.get_sections_by_page_and_user(db, page_id, current_user.id)
 
+@app.put("/api/pages/{page_id}/sections/order", response_model=List[schemas.SectionRead])
+def reorder_sections(
+    page_id: int,
+    order: schemas.SectionOrder,
+    db: Session = Depends(get_db),
+    current_user: cache.CachedUser = Depends(get_current_user)
+):
+    """
+    Reorder the sections of a page in one transaction. Sections of the user's
+    other pages on the same domain that are listed are moved to this page.
+
+    Body:
+    {
+        "section_ids": [3, 1, 2]
+    }
+
+    Returns the page's sections in their new order.
+    """
+    ownership.require_owner(db, "page", page_id, current_user.id, "You are not allowed to edit this page")
+    return crud.reorder_sections(db, page_id, order.section_ids, current_user.id)
+
 # -- DOMAINS --
 
 @app.get("/api/domains/{user_id}", response_model=schemas.DomainRead)
@@ -557,10 +675,10 @@ def create_seo(seo: schemas.SEOCreate, db: Session = Depends(get_db)):
 
 # -- MEDIA --
 @app.get("/api/media/domain", response_model=List[schemas.MediaRead])
-def get_media_by_domain(
+async def get_media_by_domain(
     domain_id: int | None = None,
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user)
+    db: AsyncSession = Depends(get_async_db),
+    current_user: cache.CachedUser = Depends(get_current_user_async)
 ):
     """
     Get media items for a selected domain owned by the current user.
@@ -568,24 +686,22 @@ def get_media_by_domain(
     Query param:
     - domain_id: required when the user has multiple domains.
     """
-    user_domains = crud.get_all_domains_by_user_id(db, current_user.id)
-    if not user_domains:
-        raise HTTPException(status_code=404, detail="No domains found for the current user")
-
-    selected_domain = None
     if domain_id is None:
+        user_domains = await crud.get_all_domains_by_user_id_async(db, current_user.id)
+        if not user_domains:
+            raise HTTPException(status_code=404, detail="No domains found for the current user")
         if len(user_domains) == 1:
-            selected_domain = user_domains[0]
+            domain_id = user_domains[0].id
         else:
             raise HTTPException(status_code=400, detail="domain_id is required when user has multiple domains")
     else:
-        selected_domain = crud.get_domain(db, domain_id)
-        if not selected_domain:
+        owner_id = await ownership.get_owner_id_async(db, "domain", domain_id)
+        if owner_id is None:
             raise HTTPException(status_code=404, detail="Selected domain not found")
-        if selected_domain.user_id != current_user.id:
+        if owner_id != current_user.id:
             raise HTTPException(status_code=403, detail="You are not allowed to view media for this domain")
 
-    media_items = crud.get_media_by_domain(db, selected_domain.id)
+    media_items = await crud.get_media_by_domain_async(db, domain_id)
     return media_items
 
 @app.post("/api/media/", response_model=schemas.MediaRead)
@@ -604,7 +720,7 @@ def create_media(media: schemas.MediaCreate, db: Session = Depends(get_db)):
 def get_media_by_section_id(
     section_id: int,
     db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user)
+    current_user: cache.CachedUser = Depends(get_current_user)
 ):
     """
     Get all media items for a specific section, only if the section belongs to the current user's domain.
@@ -616,33 +732,15 @@ def get_media_by_section_id(
 def get_media_by_project_id(
     project_id: int,
     db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user)
+    current_user: cache.CachedUser = Depends(get_current_user)
 ):
-    project = crud.get_project(db, project_id)
-    if not project:
-        raise HTTPException(status_code=404, detail="Project not found")
-
-    domain = crud.get_domain(db, project.domain_id)
-    if not domain or domain.user_id != current_user.id:
-        raise HTTPException(status_code=403, detail="You are not allowed to view media for this project")
-
+    ownership.require_owner(
+        db, "project", project_id, current_user.id, "You are not allowed to view media for this project"
+    )
     return crud.get_media_by_project(db, project_id)
 
 
-@app.post("/api/upload", response_model=schemas.MediaRead)
-async def upload_file(
-    file: UploadFile = File(...),
-    domain_id: int = None,
-    section_id: int = None,
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user)
-):
-    MAX_FILE_SIZE_MB = 20
-    contents = await file.read()
-
-    if len(contents) > MAX_FILE_SIZE_MB * 1024 * 1024:
-        raise HTTPException(status_code=413, detail="File too large")
-
+def _resolve_upload_domain(db: Session, current_user: cache.CachedUser, domain_id: int | None):
     user_domains = crud.get_all_domains_by_user_id(db, current_user.id)
     if not user_domains:
         raise HTTPException(status_code=404, detail="Domain not found for the current user")
@@ -659,61 +757,386 @@ async def upload_file(
             raise HTTPException(status_code=404, detail="Selected domain not found")
         if domain.user_id != current_user.id:
             raise HTTPException(status_code=403, detail="You are not allowed to upload to this domain")
+    return domain
 
-    upload_dir = f"./uploads/{current_user.id}{domain.name}"
-    os.makedirs(upload_dir, exist_ok=True)
 
-    is_image = file.content_type.startswith("image/")
-    is_video = file.content_type.startswith("video/")
-    stem = os.path.splitext(file.filename)[0]
-    aspect_ratio = None
+@app.post("/api/upload", response_model=schemas.MediaRead)
+async def upload_file(
+    file: UploadFile = File(...),
+    domain_id: int = None,
+    section_id: int = None,
+    db: Session = Depends(get_db),
+    current_user: cache.CachedUser = Depends(get_current_user)
+):
+    # The session is synchronous: database calls go to the threadpool
+    domain = await run_in_threadpool(_resolve_upload_domain, db, current_user, domain_id)
+
+    # Stream to disk and hash; aborts with 413 once the size budget is exceeded
+    upload = await storage.save_upload(file, storage.BLOB_DIR, storage.MAX_FILE_BYTES)
+    return await run_in_threadpool(
+        _create_uploaded_media, db, upload, file.filename, file.content_type, domain.id, section_id, current_user.id
+    )
 
-    if is_image:
-        try:
-            img = Image.open(io.BytesIO(contents))
-            width, height = img.size
-            aspect_ratio = round(height / width, 4)
-
-            # Normalise mode for WebP (handles palette, transparency, etc.)
-            if img.mode not in ("RGB", "RGBA"):
-                img = img.convert("RGBA" if img.mode in ("P", "LA") else "RGB")
-
-            webp_buf = io.BytesIO()
-            img.save(webp_buf, format="WEBP", quality=85, method=6)
-
-            save_filename = f"{stem}.webp"
-            with open(os.path.join(upload_dir, save_filename), "wb") as f:
-                f.write(webp_buf.getvalue())
-        except Exception:
-            # Fallback: store original if conversion fails
-            save_filename = file.filename
-            with open(os.path.join(upload_dir, save_filename), "wb") as f:
-                f.write(contents)
-    else:
-        save_filename = file.filename
-        with open(os.path.join(upload_dir, save_filename), "wb") as f:
-            f.write(contents)
+def _create_uploaded_media(
+    db: Session,
+    upload: storage.SavedUpload,
+    filename: str,
+    content_type: str,
+    domain_id: int,
+    section_id: int | None,
+    user_id: int,
+):
+    """Create the media item for a file saved to a temp path; takes ownership of the file."""
+    is_image = content_type.startswith("image/")
+    is_video = content_type.startswith("video/")
+    stem = os.path.splitext(filename)[0]
 
     media_type = "image" if is_image else ("video" if is_video else "text")
-
-    media_data = schemas.MediaCreate(
+    media_fields = dict(
         title=stem,
-        file_url=f"/uploads/{current_user.id}{domain.name}/{save_filename}",
         type=media_type,
-        domain_id=domain.id,
-        uploaded_by=current_user.id,
+        domain_id=domain_id,
+        uploaded_by=user_id,
         section_id=section_id,
         text="",
-        aspect_ratio=aspect_ratio,
     )
 
-    return crud.create_media(db, media_data)
+    try:
+        # Byte-identical upload stored before: share its files, skip transcoding
+        media_item = crud.create_media_for_blob(db, schemas.MediaCreate(**media_fields), upload.sha256)
+        if media_item is None:
+            # New content: hand the raw file to a background job and return
+            # right away with status "processing"
+            return crud.create_processing_media(db, schemas.MediaCreate(**media_fields), "process_upload", {
+                "path": upload.path,
+                "sha256": upload.sha256,
+                "stem": storage.new_blob_stem(upload.sha256),
+                "filename": filename,
+                "is_image": is_image,
+            })
+    except BaseException:
+        os.remove(upload.path)
+        raise
+
+    os.remove(upload.path)
+    return media_item
+
+# -- RESUMABLE UPLOADS --
+# tus-style: create a session, PATCH the bytes in any number of requests, then
+# complete it. See resumable_uploads.py.
+def _upload_session_headers(session: models.UploadSession) -> dict:
+    return {
+        "Upload-Offset": str(session.upload_offset),
+        "Upload-Length": str(session.upload_length),
+        "Upload-Expires": formatdate(calendar.timegm(session.expires_at.timetuple()), usegmt=True),
+        "Cache-Control": "no-store",
+    }
+
+def _get_upload_session(db: Session, session_id: str, current_user: cache.CachedUser) -> models.UploadSession:
+    session = crud.get_upload_session(db, session_id, current_user.id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    if session.expires_at <= datetime.utcnow():
+        raise HTTPException(status_code=410, detail="Upload expired")
+    return session
+
+def _commit_upload_chunk(db: Session, session: models.UploadSession, offset: int, written: int, chunk_path: str):
+    # The conditional UPDATE keeps the session row locked until the commit, so
+    # of two requests for the same offset only the first writes into the file
+    if not crud.advance_upload_session(
+        db, session.id, offset, offset + written, resumable_uploads.RESUMABLE_UPLOAD_TTL
+    ):
+        db.rollback()
+        raise HTTPException(status_code=409, detail="Upload-Offset does not match")
+    try:
+        resumable_uploads.append_chunk(session.id, chunk_path, offset)
+    except BaseException:
+        db.rollback()
+        raise
+    db.commit()
+    db.refresh(session)
+
+@app.post("/api/upload/resumable", response_model=schemas.ResumableUploadRead, status_code=201)
+def create_resumable_upload(
+    upload: schemas.ResumableUploadCreate,
+    response: Response,
+    domain_id: int = None,
+    section_id: int = None,
+    db: Session = Depends(get_db),
+    current_user: cache.CachedUser = Depends(get_current_user)
+):
+    """
+    Start a resumable upload of `upload.length` bytes (up to
+    RESUMABLE_UPLOAD_MAX_BYTES). Send the bytes with PATCH to the URL in the
+    `Location` header, then POST to its /complete.
+
+    Returns:
+        schemas.ResumableUploadRead: The new session, at offset 0.
+    """
+    domain = _resolve_upload_domain(db, current_user, domain_id)
+    if not upload.filename:
+        raise HTTPException(status_code=400, detail="filename is required")
+    if upload.length <= 0:
+        raise HTTPException(status_code=400, detail="length must be positive")
+    if upload.length > resumable_uploads.RESUMABLE_UPLOAD_MAX_BYTES:
+        raise HTTPException(status_code=413, detail="File too large")
+    if crud.count_upload_sessions(db, current_user.id) >= resumable_uploads.RESUMABLE_UPLOAD_MAX_SESSIONS:
+        raise HTTPException(status_code=429, detail="Too many unfinished uploads")
+
+    session_id = resumable_uploads.new_session_id()
+    resumable_uploads.create_file(session_id)
+    try:
+        session = crud.create_upload_session(
+            db, session_id, current_user.id, domain.id, section_id, upload, resumable_uploads.RESUMABLE_UPLOAD_TTL
+        )
+    except BaseException:
+        resumable_uploads.remove_file(session_id)
+        raise
+    response.headers.update(_upload_session_headers(session))
+    response.headers["Location"] = f"/api/upload/resumable/{session_id}"
+    return session
+
+@app.head("/api/upload/resumable/{session_id}")
+@app.get("/api/upload/resumable/{session_id}", response_model=schemas.ResumableUploadRead)
+def get_resumable_upload(
+    session_id: str,
+    response: Response,
+    db: Session = Depends(get_db),
+    current_user: cache.CachedUser = Depends(get_current_user)
+):
+    """Where to resume: the `Upload-Offset` header (and `upload_offset` in the body)."""
+    session = _get_upload_session(db, session_id, current_user)
+    response.headers.update(_upload_session_headers(session))
+    return session
+
+@app.patch("/api/upload/resumable/{session_id}", status_code=204)
+async def append_resumable_upload(
+    session_id: str,
+    request: Request,
+    db: Session = Depends(get_db),
+    current_user: cache.CachedUser = Depends(get_current_user)
+):
+    """
+    Write the request body (Content-Type: application/offset+octet-stream) at
+    the `Upload-Offset` header, which must equal the bytes received so far.
+
+    Returns:
+        Response: 204 with the new `Upload-Offset`. 409 when the offset does
+        not match; HEAD the session and continue from its offset.
+    """
+    # The session is synchronous: database calls go to the threadpool
+    session = await run_in_threadpool(_get_upload_session, db, session_id, current_user)
+    if request.headers.get("content-type") != resumable_uploads.CHUNK_CONTENT_TYPE:
+        raise HTTPException(status_code=415, detail=f"Content-Type must be {resumable_uploads.CHUNK_CONTENT_TYPE}")
+    try:
+        offset = int(request.headers["upload-offset"])
+    except (KeyError, ValueError):
+        raise HTTPException(status_code=400, detail="Upload-Offset header is required")
+    if offset != session.upload_offset:
+        raise HTTPException(status_code=409, detail="Upload-Offset does not match", headers=_upload_session_headers(session))
+
+    chunk_path = resumable_uploads.chunk_path(session_id)
+    try:
+        written = await resumable_uploads.receive_chunk(request, chunk_path, session.upload_length - offset)
+        if written:
+            await run_in_threadpool(_commit_upload_chunk, db, session, offset, written, chunk_path)
+    finally:
+        if os.path.exists(chunk_path):
+            os.remove(chunk_path)
+    return Response(status_code=204, headers=_upload_session_headers(session))
+
+@app.post("/api/upload/resumable/{session_id}/complete", response_model=schemas.MediaRead)
+def complete_resumable_upload(
+    session_id: str,
+    db: Session = Depends(get_db),
+    current_user: cache.CachedUser = Depends(get_current_user)
+):
+    """
+    Turn a fully received upload into a media item, like /api/upload.
+
+    Returns:
+        schemas.MediaRead: The media item, usually with status "processing".
+    """
+    session = _get_upload_session(db, session_id, current_user)
+    if session.upload_offset != session.upload_length:
+        raise HTTPException(status_code=409, detail="Upload is incomplete", headers=_upload_session_headers(session))
+    # Ownership may have changed since the upload started
+    domain = _resolve_upload_domain(db, current_user, session.domain_id)
+    filename, content_type, section_id = session.filename, session.content_type, session.section_id
+
+    # Removing the row claims the file, so a repeated request cannot create it twice
+    if not crud.delete_upload_session(db, session_id):
+        raise HTTPException(status_code=404, detail="Upload not found")
+    path = resumable_uploads.session_path(session_id)
+    try:
+        upload = resumable_uploads.hash_file(path)
+    except BaseException:
+        resumable_uploads.remove_file(session_id)
+        raise
+    return _create_uploaded_media(db, upload, filename, content_type, domain.id, section_id, current_user.id)
+
+@app.delete("/api/upload/resumable/{session_id}", status_code=204)
+def cancel_resumable_upload(
+    session_id: str,
+    db: Session = Depends(get_db),
+    current_user: cache.CachedUser = Depends(get_current_user)
+):
+    """Abandon an upload and remove what was received."""
+    session = crud.get_upload_session(db, session_id, current_user.id)
+    if session is None or not crud.delete_upload_session(db, session_id):
+        raise HTTPException(status_code=404, detail="Upload not found")
+    resumable_uploads.remove_file(session_id)
+    return Response(status_code=204)
+
+ZIP_CONTENT_TYPES = ("application/zip", "application/x-zip-compressed")
+
+
+@app.post("/api/upload/bulk", response_model=schemas.BulkUploadResult)
+async def bulk_upload(
+    files: List[UploadFile] = File(...),
+    domain_id: int = None,
+    project_id: int = None,
+    section_id: int = None,
+    db: Session = Depends(get_db),
+    current_user: cache.CachedUser = Depends(get_current_user)
+):
+    """
+    Upload many files at once, as separate files and/or zip archives.
+
+    Each distinct file is processed once, in parallel across the image pool;
+    all media items are then created in one transaction, optionally attached
+    to a project or section. Unlike /api/upload the items are ready when the
+    response arrives.
+
+    Returns:
+        schemas.BulkUploadResult: One result per file (archive entries included).
+    """
+    # The session is synchronous: database calls go to the threadpool
+    domain = await run_in_threadpool(_resolve_upload_domain, db, current_user, domain_id)
+    if project_id is not None:
+        await run_in_threadpool(
+            ownership.require_owner, db, "project", project_id, current_user.id,
+            "You are not allowed to add media to this project",
+        )
+    if section_id is not None:
+        await run_in_threadpool(
+            ownership.require_owner, db, "section", section_id, current_user.id,
+            "You are not allowed to add media to this section",
+        )
+
+    # (filename, content type, temp file or None, error)
+    entries: list[tuple[str, str, storage.SavedUpload | None, str | None]] = []
+    total_bytes = 0
+
+    def check_budget():
+        if len(entries) > storage.BULK_UPLOAD_MAX_FILES:
+            raise HTTPException(status_code=413, detail=f"Too many files, at most {storage.BULK_UPLOAD_MAX_FILES} per upload")
+        if total_bytes > storage.BULK_UPLOAD_MAX_BYTES:
+            raise HTTPException(status_code=413, detail="Upload too large")
+
+    try:
+        for file in files:
+            if file.content_type in ZIP_CONTENT_TYPES or file.filename.lower().endswith(".zip"):
+                archive = await storage.save_upload(file, storage.BLOB_DIR, storage.BULK_UPLOAD_MAX_BYTES - total_bytes)
+                try:
+                    extracted = await run_in_threadpool(
+                        storage.extract_zip, archive.path, storage.BLOB_DIR, storage.MAX_FILE_BYTES,
+                        storage.BULK_UPLOAD_MAX_FILES - len(entries), storage.BULK_UPLOAD_MAX_BYTES - total_bytes,
+                    )
+                except zipfile.BadZipFile:
+                    entries.append((file.filename, file.content_type, None, "Not a valid zip archive"))
+                    continue
+                finally:
+                    os.remove(archive.path)
+                for name, saved, error in extracted:
+                    entries.append((name, mimetypes.guess_type(name)[0] or "", saved, error))
+                    total_bytes += saved.size if saved else 0
+            else:
+                try:
+                    saved = await storage.save_upload(file, storage.BLOB_DIR, storage.MAX_FILE_BYTES)
+                except HTTPException as exc:
+                    if exc.status_code != 413:
+                        raise
+                    entries.append((file.filename, file.content_type, None, "File too large"))
+                    continue
+                entries.append((file.filename, file.content_type or "", saved, None))
+                total_bytes += saved.size
+            check_budget()
+
+        # Process each distinct new content once; known content is only referenced
+        existing = await run_in_threadpool(
+            crud.get_existing_blob_hashes, db, [saved.sha256 for _, _, saved, _ in entries if saved]
+        )
+        new_content = {}
+        for name, content_type, saved, _ in entries:
+            if saved and saved.sha256 not in existing and saved.sha256 not in new_content:
+                new_content[saved.sha256] = (saved.path, name, content_type.startswith("image/"))
+        processed = await asyncio.gather(
+            *(
+                storage.store_files_async(
+                    ("bulk", current_user.id), path, storage.new_blob_stem(sha256), name, is_image,
+                    per_user_limit=media_processing.MAX_BULK_TRANSCODES_PER_USER,
+                )
+                for sha256, (path, name, is_image) in new_content.items()
+            ),
+            return_exceptions=True,
+        )
+        stored = {sha256: result for sha256, result in zip(new_content, processed) if not isinstance(result, Exception)}
+        errors = {sha256: result for sha256, result in zip(new_content, processed) if isinstance(result, Exception)}
+
+        items = []
+        for index, (name, content_type, saved, error) in enumerate(entries):
+            if saved is None:
+                continue
+            if saved.sha256 not in existing and saved.sha256 not in stored:
+                too_large = isinstance(errors.get(saved.sha256), media_processing.ImageTooLarge)
+                entries[index] = (name, content_type, None, str(errors[saved.sha256]) if too_large else "Processing failed")
+                continue
+            media_type = "image" if content_type.startswith("image/") else ("video" if content_type.startswith("video/") else "text")
+            items.append((schemas.MediaCreate(
+                title=os.path.splitext(name)[0],
+                type=media_type,
+                domain_id=domain.id,
+                uploaded_by=current_user.id,
+                section_id=section_id,
+                project_id=project_id,
+                text="",
+            ), saved.sha256))
+        try:
+            created = iter(await run_in_threadpool(crud.create_media_batch, db, items, stored) if items else [])
+        except BaseException:
+            # No blob was created, so nothing references the files just stored
+            await run_in_threadpool(
+                storage.remove_files, [url for files in stored.values() for url in storage.stored_urls(files)]
+            )
+            raise
+    finally:
+        for _, _, saved, _ in entries:
+            if saved is not None and os.path.exists(saved.path):
+                os.remove(saved.path)
+
+    results = []
+    seen = set(existing)
+    for name, _, saved, error in entries:
+        if saved is None:
+            results.append(schemas.BulkUploadItem(filename=name, status="failed", error=error))
+            continue
+        results.append(schemas.BulkUploadItem(
+            filename=name,
+            status="created",
+            deduplicated=saved.sha256 in seen,
+            media=schemas.MediaRead.model_validate(next(created)),
+        ))
+        seen.add(saved.sha256)
+
+    succeeded = sum(1 for result in results if result.status == "created")
+    return schemas.BulkUploadResult(created=succeeded, failed=len(results) - succeeded, results=results)
 
 @app.delete("/api/media/{media_id}", response_model=dict)
 def delete_media(
     media_id: int,
     db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user)
+    current_user: cache.CachedUser = Depends(get_current_user)
 ):
     """
     Delete a media item by its ID.
@@ -724,22 +1147,127 @@ def delete_media(
     Returns:
         dict: A success message.
     """
-    # Fetch the media item from the database
-    media_item = crud.delete_media(db, media_id)
+    ownership.require_owner(db, "media", media_id, current_user.id, "You are not allowed to delete this media item")
 
-    # file_url is "/uploads/..." — prepend "." to get a relative path
-    file_path = "." + media_item.file_url
-    if os.path.exists(file_path):
-        os.remove(file_path)
+    # Files are shared between identical uploads; only the last reference removes them
+    _, orphaned = crud.delete_media(db, media_id)
+    if orphaned:
+        jobs.enqueue(db, "delete_files", {"urls": orphaned}, priority=jobs.PRIORITY_LOW, created_by=current_user.id)
+        db.commit()
 
     return {"message": f"Media item with ID {media_id} has been deleted successfully"}
 
+@app.get("/api/media/{media_id}/image")
+async def serve_media_image(
+    media_id: int,
+    request: Request,
+    w: int | None = Query(None, ge=1, le=4096),
+    db: AsyncSession = Depends(get_async_db),
+):
+    """
+    Serve an image in the best format the client accepts (AVIF, WebP, JPEG),
+    at the smallest stored width of at least `w` pixels.
+
+    Args:
+        media_id (int): The ID of the media item.
+        w (int, optional): Rendered width in CSS pixels times device pixel ratio.
+
+    Returns:
+        FileResponse: The chosen rendition, with `Vary: Accept`, or a redirect to
+            a converted copy when the client cannot decode any stored one.
+    """
+    row = await crud.get_media_rendition_async(db, media_id)
+    if row is None or row.kind != "image" or not row.file_url:
+        raise HTTPException(status_code=404, detail="Media item not found")
+
+    url, fmt = media_serving.choose_rendition(row.file_url, row.variants, request.headers.get("accept"), w)
+    if url is None:
+        # No stored rendition this client decodes; the resize endpoint converts and caches it
+        return RedirectResponse(
+            f"/api/media/{media_id}/resize?fmt={fmt}", status_code=307, headers={"Vary": "Accept"}
+        )
+    file_path = storage.local_path(url)
+    if not os.path.isfile(file_path):
+        raise HTTPException(status_code=404, detail="Media file not found")
+
+    return upload_files.UploadFileResponse(
+        file_path,
+        media_type=schemas.VARIANT_MIME_TYPES.get(fmt),
+        headers={"Vary": "Accept", "Cache-Control": "public, max-age=86400"},
+    )
+
+@app.get("/api/media/{media_id}/resize")
+async def resize_media_image(
+    media_id: int,
+    request: Request,
+    w: int | None = Query(None, ge=1, le=4096),
+    h: int | None = Query(None, ge=1, le=4096),
+    fit: Literal["inside", "cover", "contain", "fill"] = "inside",
+    fmt: Literal["auto", "avif", "webp", "jpeg"] = "auto",
+    db: AsyncSession = Depends(get_async_db),
+):
+    """
+    Render an image at an arbitrary size (cards, heroes, OpenGraph images).
+
+    Renditions are made in the image process pool and kept in a disk cache
+    keyed by source content and parameters, so the URL is safe to cache forever.
+
+    Args:
+        media_id (int): The ID of the media item.
+        w (int, optional): Target width in pixels.
+        h (int, optional): Target height in pixels.
+        fit (str): inside, cover, contain or fill; see media_processing.resize_image.
+        fmt (str): Output format; "auto" picks the best one from the Accept header.
+
+    Returns:
+        FileResponse: The rendition.
+    """
+    row = await crud.get_media_rendition_async(db, media_id)
+    if row is None or row.kind != "image" or not row.file_url:
+        raise HTTPException(status_code=404, detail="Media item not found")
+    src_path = storage.local_path(row.file_url)
+    if not os.path.isfile(src_path):
+        raise HTTPException(status_code=404, detail="Media file not found")
+
+    available = [f for f in media_serving.FORMAT_PREFERENCE if f != "avif" or media_processing.AVIF_SUPPORTED]
+    if fmt == "auto":
+        out_fmt = media_serving.best_format(request.headers.get("accept"), available)
+    elif fmt in available:
+        out_fmt = fmt
+    else:
+        raise HTTPException(status_code=400, detail=f"Format {fmt} is not supported")
+
+    # Media stored before dedup has no content hash; its path and mtime stand in
+    source = row.sha256 or f"{row.file_url}:{os.stat(src_path).st_mtime_ns}"
+    key = hashlib.blake2b(f"{source}:{w}:{h}:{fit}:{out_fmt}".encode(), digest_size=16).hexdigest()
+    name = f"{key}.{media_processing.VARIANT_ENCODERS[out_fmt][1]}"
+
+    headers = {"Cache-Control": "public, max-age=31536000, immutable", "ETag": f'"{key}"'}
+    if fmt == "auto":
+        headers["Vary"] = "Accept"
+    # The key covers everything the output depends on, so no need to render for a 304
+    if cache.etag_matches(request.headers.get("if-none-match"), headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+
+    try:
+        path = await resize_cache.renditions.get_or_render(
+            name,
+            lambda dest_path: media_processing.render_resized(row.domain_id, src_path, dest_path, w, h, fit, out_fmt),
+        )
+    except media_processing.ImageTooLarge:
+        raise HTTPException(status_code=422, detail="Image is too large to resize")
+    except media_processing.UnreadableImage:
+        raise HTTPException(status_code=422, detail="Image cannot be decoded")
+    return resize_cache.CachedFileResponse(
+        resize_cache.renditions, name, path, media_type=schemas.VARIANT_MIME_TYPES[out_fmt], headers=headers
+    )
+
 @app.put("/api/media/{media_id}", response_model=schemas.MediaRead)
 def update_media(
     media_id: int,
     update_data: schemas.MediaUpdate,
     db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user)
+    current_user: cache.CachedUser = Depends(get_current_user)
 ):
     """
     Update the title and alt text of a media item.
@@ -751,6 +1279,7 @@ def update_media(
     Returns:
         schemas.MediaRead: The updated media item.
     """
+    ownership.require_owner(db, "media", media_id, current_user.id, "You are not allowed to update this media item")
     updated_media = crud.update_media(
         db,
         media_id,
@@ -762,17 +1291,68 @@ def update_media(
 
     return updated_media
 
+@app.get("/api/jobs/{job_id}", response_model=schemas.JobRead)
+def get_job_status(
+    job_id: int,
+    db: Session = Depends(get_db),
+    current_user: cache.CachedUser = Depends(get_current_user)
+):
+    """
+    Status of a background job, e.g. the `job_id` of an upload that is still
+    processing. Visible to the user who started it and to admins.
+    """
+    job = jobs.get_job(db, job_id)
+    if job is None or (job.created_by != current_user.id and current_user.role != "admin"):
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
 # -- ADMIN --
-def require_admin(current_user: models.User = Depends(get_current_user)):
+def require_admin(request: Request, db: Session = Depends(get_db)) -> cache.CachedUser:
+    """
+    Like get_current_user, but always reads the role from the database: the
+    user cache is per worker, and a demotion or deletion handled by another
+    worker has to take effect immediately for admin routes.
+    """
+    user = crud.get_user(db, _user_id_from_cookie(request))
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    current_user = cache.set_user(user)
     if current_user.role != "admin":
         raise HTTPException(status_code=403, detail="Admin access required")
     return current_user
 
 
+@app.get("/api/admin/storage", response_model=dict)
+def admin_storage(db: Session = Depends(get_db), _: cache.CachedUser = Depends(require_admin)):
+    """
+    Upload storage usage, and the disk space saved by storing identical
+    uploads once.
+    """
+    return crud.get_storage_report(db)
+
+
+@app.get("/api/admin/metrics", response_model=dict)
+def admin_metrics(_: cache.CachedUser = Depends(require_admin)):
+    """
+    Runtime counters for this worker process.
+    """
+    def stats(backend):
+        return backend.stats() if hasattr(backend, "stats") else None
+
+    return {
+        "user_cache": stats(cache.user_cache),
+        "public_cache": stats(cache.public_cache),
+        "resize_cache": resize_cache.renditions.stats(),
+        "smtp_pool": mailer.pool.stats(),
+        "ownership_cache": stats(cache.ownership_cache),
+        "db_pool": database.pool_metrics(),
+    }
+
+
 @app.get("/api/admin/users", response_model=List[schemas.UserRead])
 def admin_list_users(
     email: str | None = None,
-    _: models.User = Depends(require_admin),
+    _: cache.CachedUser = Depends(require_admin),
     db: Session = Depends(get_db),
 ):
     return crud.get_users_filtered(db, email)
@@ -782,7 +1362,7 @@ def admin_list_users(
 def admin_update_user(
     user_id: int,
     data: schemas.AdminUserUpdate,
-    current_user: models.User = Depends(require_admin),
+    current_user: cache.CachedUser = Depends(require_admin),
     db: Session = Depends(get_db),
 ):
     if user_id == current_user.id:
@@ -793,7 +1373,7 @@ def admin_update_user(
 @app.delete("/api/admin/users/{user_id}")
 def admin_delete_user(
     user_id: int,
-    current_user: models.User = Depends(require_admin),
+    current_user: cache.CachedUser = Depends(require_admin),
     db: Session = Depends(get_db),
 ):
     if user_id == current_user.id:
@@ -804,7 +1384,7 @@ def admin_delete_user(
 
 @app.get("/api/admin/domains", response_model=List[schemas.DomainWithOwner])
 def admin_list_domains(
-    _: models.User = Depends(require_admin),
+    _: cache.CachedUser = Depends(require_admin),
     db: Session = Depends(get_db),
 ):
     return crud.get_domains_with_owners(db)
@@ -813,7 +1393,7 @@ def admin_list_domains(
 @app.post("/api/admin/domains", response_model=schemas.DomainRead)
 def admin_create_domain(
     data: schemas.DomainCreate,
-    _: models.User = Depends(require_admin),
+    _: cache.CachedUser = Depends(require_admin),
     db: Session = Depends(get_db),
 ):
     return crud.create_domain(db, data)
@@ -823,7 +1403,7 @@ def admin_create_domain(
 def admin_update_domain(
     domain_id: int,
     data: schemas.DomainUpdate,
-    _: models.User = Depends(require_admin),
+    _: cache.CachedUser = Depends(require_admin),
     db: Session = Depends(get_db),
 ):
     return crud.update_domain(db, domain_id, data)
@@ -832,68 +1412,149 @@ def admin_update_domain(
 @app.delete("/api/admin/domains/{domain_id}")
 def admin_delete_domain(
     domain_id: int,
-    _: models.User = Depends(require_admin),
+    _: cache.CachedUser = Depends(require_admin),
     db: Session = Depends(get_db),
 ):
     crud.delete_domain(db, domain_id)
     return {"message": f"Domain {domain_id} deleted"}
 
 
-@app.post("/api/admin/email/send", response_model=schemas.EmailLogRead)
+@app.post("/api/admin/email/send", response_model=schemas.EmailLogRead, status_code=202)
 def admin_send_email(
     payload: schemas.EmailSend,
-    current_user: models.User = Depends(require_admin),
+    current_user: cache.CachedUser = Depends(require_admin),
     db: Session = Depends(get_db),
 ):
-    try:
-        _send_smtp(payload.to_email, payload.subject, payload.body)
-        return crud.create_email_log(db, payload.to_email, payload.subject, payload.body, current_user.id, "sent")
-    except Exception as e:
-        log = crud.create_email_log(db, payload.to_email, payload.subject, payload.body, current_user.id, "failed", str(e))
-        raise HTTPException(status_code=502, detail=f"SMTP error: {e}")
+    """
+    Queue an email for delivery by the job workers (see mailer.py).
+
+    Returns:
+        schemas.EmailLogRead: The log entry, status "queued"; it becomes "sent"
+        or, once retries are exhausted, "failed" with the SMTP error.
+    """
+    return crud.queue_email(db, payload.to_email, payload.subject, payload.body, current_user.id)
+
+
+def _campaigns_with_progress(db: Session, campaigns: list) -> list[schemas.EmailCampaignRead]:
+    counts = crud.get_email_campaign_counts(db, [c.id for c in campaigns])
+    return [
+        schemas.EmailCampaignRead.model_validate(campaign).model_copy(update=counts.get(campaign.id, {}))
+        for campaign in campaigns
+    ]
+
+
+@app.post("/api/admin/email/campaigns", response_model=schemas.EmailCampaignRead, status_code=202)
+def admin_create_email_campaign(
+    payload: schemas.EmailCampaignCreate,
+    current_user: cache.CachedUser = Depends(require_admin),
+    db: Session = Depends(get_db),
+):
+    """
+    Send one email to many recipients in the background.
+
+    Recipients are `recipients`, or else the users matching `role` and/or
+    owning one of `domain_ids`. `$name`, `$email` and `$domains` in the subject
+    and body are filled in per recipient. Delivery is throttled (see
+    mailer.py); poll GET /api/admin/email/campaigns/{id} for progress.
+
+    Returns:
+        schemas.EmailCampaignRead: The campaign with all messages queued.
+    """
+    if not payload.subject or not payload.body:
+        raise HTTPException(status_code=400, detail="subject and body are required")
+    if payload.recipients is None and payload.role is None and not payload.domain_ids:
+        raise HTTPException(status_code=400, detail="Give recipients, role or domain_ids")
+
+    recipients = crud.get_campaign_recipients(db, payload.recipients, payload.role, payload.domain_ids)
+    if not recipients:
+        raise HTTPException(status_code=400, detail="No recipients")
+    if len(recipients) > mailer.EMAIL_CAMPAIGN_MAX_RECIPIENTS:
+        raise HTTPException(status_code=400, detail=f"Too many recipients, at most {mailer.EMAIL_CAMPAIGN_MAX_RECIPIENTS}")
+
+    campaign = crud.create_email_campaign(db, payload.subject, payload.body, recipients, current_user.id)
+    return _campaigns_with_progress(db, [campaign])[0]
+
+
+@app.get("/api/admin/email/campaigns", response_model=List[schemas.EmailCampaignRead])
+def admin_email_campaigns(
+    _: cache.CachedUser = Depends(require_admin),
+    db: Session = Depends(get_db),
+):
+    return _campaigns_with_progress(db, crud.get_email_campaigns(db))
+
+
+@app.get("/api/admin/email/campaigns/{campaign_id}", response_model=schemas.EmailCampaignRead)
+def admin_email_campaign(
+    campaign_id: int,
+    _: cache.CachedUser = Depends(require_admin),
+    db: Session = Depends(get_db),
+):
+    """Progress of a campaign: messages queued, sent and failed."""
+    campaign = crud.get_email_campaign(db, campaign_id)
+    if campaign is None:
+        raise HTTPException(status_code=404, detail="Campaign not found")
+    return _campaigns_with_progress(db, [campaign])[0]
 
 
 @app.get("/api/admin/email/logs", response_model=List[schemas.EmailLogRead])
 def admin_email_logs(
-    _: models.User = Depends(require_admin),
+    response: Response,
+    limit: int = Query(100, ge=1, le=500),
+    before: int | None = None,
+    status: Literal["queued", "sent", "failed"] | None = None,
+    to_email: str | None = None,
+    sent_by: int | None = None,
+    campaign_id: int | None = None,
+    sent_after: datetime | None = None,
+    sent_before: datetime | None = None,
+    _: cache.CachedUser = Depends(require_admin),
     db: Session = Depends(get_db),
 ):
-    return crud.get_email_logs(db)
+    """
+    Browse email logs, newest first.
+
+    Args:
+        limit (int): Page size.
+        before (int, optional): Cursor from the X-Next-Before header of the previous page.
+        status, to_email, sent_by, campaign_id: Exact-match filters.
+        sent_after, sent_before (datetime, optional): sent_at range.
+
+    Returns:
+        List[schemas.EmailLogRead]: One page. When more follow, the
+        X-Next-Before header holds the cursor for the next page. Logs older
+        than EMAIL_LOG_RETENTION_DAYS are in the archive, not listed here.
+    """
+    logs = crud.get_email_logs(db, limit, before, status, to_email, sent_by, campaign_id, sent_after, sent_before)
+    if len(logs) == limit:
+        response.headers["X-Next-Before"] = str(logs[-1].id)
+    return logs
 
 
 @app.get("/api/fill-gallery/{domain_id}", response_model=List[schemas.MediaNoUploadedBy])
-def fill_gallery(domain_id: str, db: Session = Depends(get_db)):
+async def fill_gallery(
+    domain_id: str,
+    response: Response,
+    limit: int | None = Query(None, ge=1, le=500),
+    after_id: int | None = None,
+    db: AsyncSession = Depends(get_async_db),
+):
     """
-    Get all images for a domain using an encrypted domain ID.
+    Get the gallery (images and videos not linked to a project) for a domain.
     Args:
         encrypted_id (str): The encrypted domain ID.
+        limit (int, optional): Page size; all items when omitted.
+        after_id (int, optional): Cursor, the id of the last item of the previous page.
 
     Returns:
-        List[schemas.MediaRead]: List of media items for the domain.
+        List[schemas.MediaRead]: List of media items for the domain. When more
+        items follow, the X-Next-After-Id header holds the cursor for the next page.
     """
 
-    # Fetch media items for the domain
-    media_items = crud.get_all_media_by_domain(db, domain_id)
-    if not media_items:
-        raise HTTPException(status_code=404, detail="No media found for the domain")
-
-    image_extensions = (".jpg", ".jpeg", ".png", ".gif", ".webp", ".bmp", ".svg", ".avif")
-    video_extensions = (".mp4", ".webm", ".mov", ".avi", ".mkv", ".m4v")
-
-    # Keep only media not linked to projects and include photos/videos.
-    gallery_items = []
-    for item in media_items:
-        if item.project_id is not None:
-            continue
-
-        file_url = (item.file_url or "").lower()
-        is_image = item.type == "image" or file_url.endswith(image_extensions)
-        is_video = file_url.endswith(video_extensions)
-
-        if is_image or is_video:
-            gallery_items.append(item)
-
-    if not gallery_items:
+    # Filtering by project and kind happens in SQL on ix_media_gallery
+    gallery_items = await crud.get_gallery_media_async(db, domain_id, limit, after_id)
+    if not gallery_items and after_id is None:
         raise HTTPException(status_code=404, detail="No gallery media found for this domain")
 
-    return gallery_items
\ No newline at end of file
+    if limit is not None and len(gallery_items) == limit:
+        response.headers["X-Next-After-Id"] = str(gallery_items[-1].id)
+    return gallery_items
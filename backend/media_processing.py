@@ -0,0 +1,433 @@
+"""
+Image processing for uploads.
+
+Decoding and WebP encoding are CPU bound, so they run in a process pool
+instead of on the event loop. Concurrency is capped per process and per user
+so one editor uploading a batch cannot starve everybody else; the caps are
+shared by requests (`run_in_pool`) and job worker threads (`run_blocking`).
+
+Settings (environment):
+- IMAGE_WORKERS: processes in the pool (default: CPU count)
+- MAX_CONCURRENT_TRANSCODES: jobs in flight per process (default: IMAGE_WORKERS)
+- MAX_TRANSCODES_PER_USER: jobs in flight per user (default: 2)
+- MAX_BULK_TRANSCODES_PER_USER: jobs in flight per user for bulk uploads (default:
+  MAX_CONCURRENT_TRANSCODES, i.e. a batch may use the whole pool)
+- IMAGE_VARIANT_WIDTHS: widths of the responsive variants (default: 320,640,960,1280,1920)
+- IMAGE_VARIANT_FORMATS: formats of each variant, best first (default: avif,webp,jpeg;
+  avif is skipped when Pillow lacks support)
+- IMAGE_MAX_PIXELS: larger images are rejected before decoding (default: 80 megapixels)
+- IMAGE_MAX_DIMENSION: longest edge of the stored full-size WebP; larger JPEGs are
+  decoded at a reduced scale (default: 4096, 0 keeps the original size)
+- IMAGE_DECODE_MEMORY_MB: estimated decode memory of all jobs in flight in this
+  process (default: 1024)
+"""
+import asyncio
+import base64
+import io
+import math
+import multiprocessing
+import os
+import threading
+import warnings
+from contextlib import asynccontextmanager, contextmanager
+from collections.abc import Hashable
+from concurrent.futures import ProcessPoolExecutor
+from PIL import Image, ImageOps, UnidentifiedImageError, features
+
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", str(os.cpu_count() or 1)))
+MAX_CONCURRENT_TRANSCODES = int(os.getenv("MAX_CONCURRENT_TRANSCODES", str(IMAGE_WORKERS)))
+MAX_TRANSCODES_PER_USER = int(os.getenv("MAX_TRANSCODES_PER_USER", "2"))
+MAX_BULK_TRANSCODES_PER_USER = int(os.getenv("MAX_BULK_TRANSCODES_PER_USER", str(MAX_CONCURRENT_TRANSCODES)))
+
+IMAGE_MAX_PIXELS = int(os.getenv("IMAGE_MAX_PIXELS", str(80_000_000)))
+IMAGE_MAX_DIMENSION = int(os.getenv("IMAGE_MAX_DIMENSION", "4096"))
+IMAGE_DECODE_MEMORY_BYTES = int(os.getenv("IMAGE_DECODE_MEMORY_MB", "1024")) * 1024 * 1024
+
+# Pillow's own decompression bomb guard, in this process and the pool children.
+# Its warning below the hard limit is redundant with the explicit checks here.
+Image.MAX_IMAGE_PIXELS = IMAGE_MAX_PIXELS
+warnings.simplefilter("ignore", Image.DecompressionBombWarning)
+
+# Inline placeholder: a tiny blurred WebP, small enough for a data: URI
+PLACEHOLDER_WIDTH = 16
+PLACEHOLDER_QUALITY = 30
+
+WEBP_QUALITY = 85
+WEBP_METHOD = 6
+
+IMAGE_VARIANT_WIDTHS = sorted(
+    int(width) for width in os.getenv("IMAGE_VARIANT_WIDTHS", "320,640,960,1280,1920").split(",") if width.strip()
+)
+AVIF_SUPPORTED = features.check("avif")
+
+IMAGE_VARIANT_FORMATS = [
+    fmt.strip().lower()
+    for fmt in os.getenv("IMAGE_VARIANT_FORMATS", "avif,webp,jpeg").split(",")
+    if fmt.strip() and (fmt.strip().lower() != "avif" or AVIF_SUPPORTED)
+]
+
+# Pillow format name, file extension and encoder options per variant format
+VARIANT_ENCODERS = {
+    "avif": ("AVIF", "avif", {"quality": 60, "speed": 8}),
+    "webp": ("WEBP", "webp", {"quality": 80, "method": 4}),
+    "jpeg": ("JPEG", "jpg", {"quality": 82, "optimize": True, "progressive": True}),
+}
+
+_executor: ProcessPoolExecutor | None = None
+
+
+class ImageTooLarge(ValueError):
+    pass
+
+
+class UnreadableImage(ValueError):
+    """The file is not an image Pillow can decode (e.g. SVG, or corrupt)."""
+
+
+class Budget:
+    """
+    Units (bytes of decode memory, transcode slots) shared by all jobs in
+    flight, from worker threads (`acquire`) and event loops (`acquire_async`).
+    A job larger than the whole budget is allowed alone, so it waits instead
+    of failing.
+    """
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.in_use = 0
+        self._cond = threading.Condition()
+        self._async_waiters: list[tuple[asyncio.AbstractEventLoop, asyncio.Future]] = []
+
+    def acquire(self, amount: int) -> int:
+        amount = min(amount, self.limit)
+        with self._cond:
+            self._cond.wait_for(lambda: self.in_use + amount <= self.limit)
+            self.in_use += amount
+        return amount
+
+    async def acquire_async(self, amount: int) -> int:
+        """
+        `acquire` without a thread. The budget is taken in the same step that
+        returns, so a caller cancelled while waiting holds nothing.
+        """
+        amount = min(amount, self.limit)
+        loop = asyncio.get_running_loop()
+        while True:
+            with self._cond:
+                if self.in_use + amount <= self.limit:
+                    self.in_use += amount
+                    return amount
+                waiter = loop.create_future()
+                self._async_waiters.append((loop, waiter))
+            try:
+                await waiter
+            finally:
+                with self._cond:
+                    if (loop, waiter) in self._async_waiters:
+                        self._async_waiters.remove((loop, waiter))
+
+    def release(self, amount: int):
+        with self._cond:
+            self.in_use -= amount
+            self._cond.notify_all()
+            waiters, self._async_waiters = self._async_waiters, []
+        for loop, waiter in waiters:
+            try:
+                loop.call_soon_threadsafe(_wake, waiter)
+            except RuntimeError:
+                pass  # Loop closed
+
+    @contextmanager
+    def reserve(self, amount: int):
+        granted = self.acquire(amount)
+        try:
+            yield
+        finally:
+            self.release(granted)
+
+    @asynccontextmanager
+    async def reserve_async(self, amount: int):
+        granted = await self.acquire_async(amount)
+        try:
+            yield
+        finally:
+            self.release(granted)
+
+
+def _wake(waiter: asyncio.Future):
+    if not waiter.done():
+        waiter.set_result(None)
+
+
+decode_budget = Budget(IMAGE_DECODE_MEMORY_BYTES)
+_worker_slots = Budget(MAX_CONCURRENT_TRANSCODES)
+_user_slots: dict[Hashable, Budget] = {}
+_user_waiters: dict[Hashable, int] = {}
+_user_slots_lock = threading.Lock()
+
+
+@contextmanager
+def _user_slot(user_id: Hashable, per_user_limit: int | None):
+    with _user_slots_lock:
+        slot = _user_slots.get(user_id)
+        if slot is None:
+            slot = _user_slots[user_id] = Budget(per_user_limit or MAX_TRANSCODES_PER_USER)
+        _user_waiters[user_id] = _user_waiters.get(user_id, 0) + 1
+    try:
+        yield slot
+    finally:
+        with _user_slots_lock:
+            _user_waiters[user_id] -= 1
+            if not _user_waiters[user_id]:
+                # Drop idle users so the table does not grow with every uploader
+                del _user_waiters[user_id]
+                del _user_slots[user_id]
+
+
+def _fit_within(width: int, height: int, max_dimension: int) -> tuple[int, int]:
+    if not max_dimension or max(width, height) <= max_dimension:
+        return width, height
+    scale = max_dimension / max(width, height)
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def _open_image(src_path: str, target: tuple[int, int] | None = None) -> Image.Image:
+    """
+    Open an image, rejecting it from its header if it exceeds the pixel budget.
+    With `target`, JPEGs are decoded at the smallest 1/2, 1/4 or 1/8 scale that
+    is still at least that large, which needs a fraction of the memory.
+    """
+    try:
+        img = Image.open(src_path)
+    except Image.DecompressionBombError as exc:
+        raise ImageTooLarge(str(exc)) from exc
+    except UnidentifiedImageError as exc:
+        raise UnreadableImage(str(exc)) from exc
+    width, height = img.size
+    if width * height > IMAGE_MAX_PIXELS:
+        img.close()
+        raise ImageTooLarge(f"Image is {width}x{height}, more than {IMAGE_MAX_PIXELS} pixels")
+    if target is not None and (target[0] < width or target[1] < height):
+        # No-op for formats without reduced decoding
+        img.draft(img.mode, target)
+    return img
+
+
+def _decode(img: Image.Image):
+    """Decode the pixel data now, so a corrupt file fails as UnreadableImage."""
+    try:
+        img.load()
+    except (OSError, SyntaxError, EOFError) as exc:
+        # Pillow reports truncated and undecodable data as OSError without an
+        # errno; one with an errno is a real I/O failure
+        if isinstance(exc, OSError) and exc.errno is not None:
+            raise
+        img.close()
+        raise UnreadableImage(str(exc)) from exc
+
+
+def decode_cost(src_path: str) -> int:
+    """
+    Estimate the peak memory of processing an image, from its header only.
+    Raises ImageTooLarge; unreadable files cost nothing (they fail fast).
+    """
+    try:
+        with Image.open(src_path) as img:
+            width, height = img.size
+            jpeg = img.format == "JPEG"
+    except Image.DecompressionBombError as exc:
+        raise ImageTooLarge(str(exc)) from exc
+    except Exception:
+        return 0
+    if width * height > IMAGE_MAX_PIXELS:
+        raise ImageTooLarge(f"Image is {width}x{height}, more than {IMAGE_MAX_PIXELS} pixels")
+
+    target_width, target_height = _fit_within(width, height, IMAGE_MAX_DIMENSION)
+    decoded = width * height
+    if jpeg:
+        scale = max(s for s in (1, 2, 4, 8) if width / s >= target_width and height / s >= target_height)
+        decoded = math.ceil(width / scale) * math.ceil(height / scale)
+    # Decoded bitmap, its mode-converted copy and the resized image, 4 bytes per pixel
+    return (2 * decoded + target_width * target_height) * 4
+
+
+def _for_format(img: Image.Image, fmt: str) -> Image.Image:
+    # JPEG has no alpha channel: flatten onto white
+    if fmt == "jpeg" and img.mode == "RGBA":
+        flat = Image.new("RGB", img.size, (255, 255, 255))
+        flat.paste(img, mask=img.getchannel("A"))
+        return flat
+    return img
+
+
+def _placeholder(img: Image.Image) -> tuple[str, str]:
+    """A data: URI LQIP and the dominant colour (#rrggbb) of an image."""
+    width, height = img.size
+    small = img.resize(
+        (PLACEHOLDER_WIDTH, max(1, round(PLACEHOLDER_WIDTH * height / width))), Image.BILINEAR, reducing_gap=2.0
+    )
+    buf = io.BytesIO()
+    small.save(buf, format="WEBP", quality=PLACEHOLDER_QUALITY)
+    lqip = "data:image/webp;base64," + base64.b64encode(buf.getvalue()).decode("ascii")
+
+    # Most common colour of a small median-cut palette, ignoring transparency
+    rgb = _for_format(small, "jpeg").convert("RGB")
+    palette = rgb.quantize(colors=5, method=Image.Quantize.MEDIANCUT)
+    _, index = max(palette.getcolors())
+    r, g, b = palette.getpalette()[index * 3:index * 3 + 3]
+    return lqip, f"#{r:02x}{g:02x}{b:02x}"
+
+
+def process_image(src_path: str, dest_dir: str, stem: str) -> dict:
+    """
+    Transcode an image to a full-size WebP plus downscaled variants in every
+    configured width and format. Runs inside a pool process.
+
+    Returns:
+        dict: aspect_ratio, file (the full-size WebP), placeholder (data: URI),
+        dominant_color and variants, a list of {width, height, format, file}.
+        File names are relative to dest_dir.
+    """
+    file = f"{stem}.webp"
+    with _open_image(src_path) as probe:
+        width, height = probe.size
+    aspect_ratio = round(height / width, 4)
+    full_size = _fit_within(width, height, IMAGE_MAX_DIMENSION)
+
+    with _open_image(src_path, full_size) as img:
+        _decode(img)
+        # Normalise mode for WebP (handles palette, transparency, etc.)
+        if img.mode not in ("RGB", "RGBA"):
+            img = img.convert("RGBA" if img.mode in ("P", "LA") else "RGB")
+        if img.size != full_size:
+            img = img.resize(full_size, Image.LANCZOS, reducing_gap=3.0)
+
+        img.save(os.path.join(dest_dir, file), format="WEBP", quality=WEBP_QUALITY, method=WEBP_METHOD)
+        placeholder, dominant_color = _placeholder(img)
+
+        variants = []
+        # Never upscale: only widths below the source width
+        for variant_width in (w for w in IMAGE_VARIANT_WIDTHS if w < width):
+            variant_height = max(1, round(variant_width * height / width))
+            resized = img.resize((variant_width, variant_height), Image.LANCZOS, reducing_gap=3.0)
+            for fmt in IMAGE_VARIANT_FORMATS:
+                pil_format, ext, options = VARIANT_ENCODERS[fmt]
+                variant_file = f"{stem}-{variant_width}w.{ext}"
+                _for_format(resized, fmt).save(os.path.join(dest_dir, variant_file), format=pil_format, **options)
+                variants.append({"width": variant_width, "height": variant_height, "format": fmt, "file": variant_file})
+
+    return {
+        "aspect_ratio": aspect_ratio,
+        "file": file,
+        "placeholder": placeholder,
+        "dominant_color": dominant_color,
+        "variants": variants,
+    }
+
+
+def variant_files(stem: str) -> list[str]:
+    """Every variant file name `process_image` may write for `stem`."""
+    return [
+        f"{stem}-{width}w.{VARIANT_ENCODERS[fmt][1]}"
+        for width in IMAGE_VARIANT_WIDTHS
+        for fmt in IMAGE_VARIANT_FORMATS
+    ]
+
+
+RESIZE_FITS = ("inside", "cover", "contain", "fill")
+
+
+def resize_image(src_path: str, dest_path: str, width: int | None, height: int | None, fit: str, fmt: str):
+    """
+    Render one on-demand rendition. Runs inside a pool process.
+
+    fit (when both width and height are given):
+        inside   scale to fit within the box, keeping the aspect ratio (default)
+        cover    scale and centre-crop to fill the box exactly
+        contain  scale to fit, then pad to the box (transparent, white for JPEG)
+        fill     stretch to the box
+    With only one dimension the other follows the aspect ratio. Images are
+    never upscaled, except by `fill`, `cover` and `contain` to reach the box.
+    """
+    with _open_image(src_path) as probe:
+        src_width, src_height = probe.size
+    if width and height:
+        scale = (max if fit in ("cover", "fill") else min)(width / src_width, height / src_height)
+    else:
+        scale = width / src_width if width else (height / src_height if height else 1.0)
+    target = (math.ceil(src_width * scale), math.ceil(src_height * scale))
+
+    with _open_image(src_path, target) as img:
+        _decode(img)
+        if img.mode not in ("RGB", "RGBA"):
+            img = img.convert("RGBA" if img.mode in ("P", "LA") else "RGB")
+        src_width, src_height = img.size
+
+        if width and height and fit == "cover":
+            img = ImageOps.fit(img, (width, height), Image.LANCZOS)
+        elif width and height and fit == "fill":
+            img = img.resize((width, height), Image.LANCZOS)
+        elif width and height and fit == "contain":
+            pad_color = (255, 255, 255) if fmt == "jpeg" else (0, 0, 0, 0)
+            img = ImageOps.pad(img if fmt == "jpeg" else img.convert("RGBA"), (width, height), Image.LANCZOS, color=pad_color)
+        else:
+            scale = min(width / src_width if width else 1.0, height / src_height if height else 1.0, 1.0)
+            if scale < 1.0:
+                size = (max(1, round(src_width * scale)), max(1, round(src_height * scale)))
+                img = img.resize(size, Image.LANCZOS, reducing_gap=3.0)
+
+        pil_format, _, options = VARIANT_ENCODERS[fmt]
+        _for_format(img, fmt).save(dest_path, format=pil_format, **options)
+
+
+def get_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        # spawn keeps the children free of the parent's threads and DB connections
+        _executor = ProcessPoolExecutor(
+            max_workers=IMAGE_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _executor
+
+
+def shutdown():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+def run_blocking(user_id: Hashable, fn, *args, per_user_limit: int | None = None, memory: int = 0):
+    """
+    Run `fn(*args)` in the process pool from a worker thread, within the same
+    per-process, per-user and memory limits as `run_in_pool`.
+    """
+    with (
+        _user_slot(user_id, per_user_limit) as user_slot,
+        user_slot.reserve(1),
+        _worker_slots.reserve(1),
+        decode_budget.reserve(memory),
+    ):
+        return get_executor().submit(fn, *args).result()
+
+
+async def run_in_pool(user_id: Hashable, fn, *args, per_user_limit: int | None = None, memory: int = 0):
+    """
+    Run `fn(*args)` in the process pool and await the result without blocking
+    the event loop. Waits for a free per-process and per-user slot first, then
+    for `memory` bytes of the decode budget; work without a user passes
+    another fairness key as `user_id`. `per_user_limit` overrides
+    MAX_TRANSCODES_PER_USER for a key's first job.
+    """
+    with _user_slot(user_id, per_user_limit) as user_slot:
+        async with user_slot.reserve_async(1), _worker_slots.reserve_async(1), decode_budget.reserve_async(memory):
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(get_executor(), fn, *args)
+
+
+async def render_resized(domain_id: int, src_path: str, dest_path: str, width, height, fit: str, fmt: str):
+    # Public requests have no user: share the per-user limit per domain instead,
+    # so one busy site cannot take every worker
+    memory = await asyncio.to_thread(decode_cost, src_path)
+    await run_in_pool(("domain", domain_id), resize_image, src_path, dest_path, width, height, fit, fmt, memory=memory)
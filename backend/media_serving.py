@@ -0,0 +1,69 @@
+"""
+Pick the rendition of an image to send to a given client.
+
+Uploads are stored as a full-size WebP plus responsive variants (see
+`media_processing.process_image`). `choose_rendition` returns the smallest
+variant at least as wide as requested, in the best format the client's
+Accept header allows (avif, then webp, then jpeg). Browsers that only send
+`*/*` still get WebP, which every current browser decodes.
+"""
+# Best first; jpeg is always acceptable as the fallback
+FORMAT_PREFERENCE = ("avif", "webp", "jpeg")
+
+
+def _quality(params: list[str]) -> float:
+    for param in params:
+        name, _, value = param.partition("=")
+        if name.strip().lower() == "q":
+            try:
+                return float(value)
+            except ValueError:
+                return 0.0
+    return 1.0
+
+
+def accepted_formats(accept: str | None) -> set[str]:
+    """Image formats the Accept header allows (q=0 entries excluded)."""
+    formats = {"jpeg"}
+    for part in (accept or "").split(","):
+        mime, *params = [item.strip() for item in part.split(";")]
+        if _quality(params) == 0:
+            continue
+        mime = mime.lower()
+        if mime == "image/avif":
+            formats.add("avif")
+        elif mime in ("image/webp", "image/*", "*/*"):
+            formats.add("webp")
+    return formats
+
+
+def best_format(accept: str | None, available=FORMAT_PREFERENCE) -> str:
+    """The preferred format among `available` that the client accepts (jpeg if none)."""
+    accepted = accepted_formats(accept)
+    return next((f for f in FORMAT_PREFERENCE if f in accepted and f in available), "jpeg")
+
+
+def choose_rendition(file_url: str, variants: list[dict] | None, accept: str | None, width: int | None = None) -> tuple[str, str | None]:
+    """
+    Return (url, format) of the rendition to serve. `format` is None when the
+    original file is served because no variant fits. `url` is None when the
+    only candidate is a WebP original the client does not accept; it has to
+    be converted to `format` first.
+    """
+    accepted = accepted_formats(accept)
+    fmt = best_format(accept, {v["format"] for v in variants or []} or FORMAT_PREFERENCE)
+    candidates = sorted((v for v in variants or [] if v["format"] == fmt), key=lambda v: v["width"])
+
+    if width is not None:
+        for variant in candidates:
+            if variant["width"] >= width:
+                return variant["url"], fmt
+
+    # Nothing wide enough: the full-size WebP, if the client takes it
+    if "webp" in accepted and file_url.endswith(".webp"):
+        return file_url, "webp"
+    if candidates:
+        return candidates[-1]["url"], fmt
+    if file_url.endswith(".webp"):
+        return None, "jpeg"
+    return file_url, None
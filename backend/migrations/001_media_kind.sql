@@ -0,0 +1,20 @@
+-- Persist the gallery classification of media (image/video/other) and index
+-- the gallery lookup. Existing rows are classified the same way as
+-- crud.media_kind does on write. Also allows the 'video' type that
+-- /api/upload already writes for video files.
+
+ALTER TABLE `media`
+  MODIFY `type` enum('image','video','text') DEFAULT 'image',
+  ADD COLUMN `kind` enum('image','video','other') NOT NULL DEFAULT 'other' AFTER `title`;
+
+UPDATE `media`
+SET `kind` = CASE
+  WHEN `type` = 'image'
+    OR LOWER(`file_url`) REGEXP '\\.(jpg|jpeg|png|gif|webp|bmp|svg|avif)$' THEN 'image'
+  WHEN `type` = 'video'
+    OR LOWER(`file_url`) REGEXP '\\.(mp4|webm|mov|avi|mkv|m4v)$' THEN 'video'
+  ELSE 'other'
+END;
+
+ALTER TABLE `media`
+  ADD KEY `ix_media_gallery` (`domain_id`, `project_id`, `kind`, `id`);
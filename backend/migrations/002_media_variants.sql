@@ -0,0 +1,6 @@
+-- Responsive renditions of uploaded images (see media_processing.process_image).
+-- A JSON list of {width, height, format, url}; NULL for media uploaded before
+-- variants existed, which keep being served from file_url alone.
+
+ALTER TABLE `media`
+  ADD COLUMN `variants` json DEFAULT NULL AFTER `kind`;
@@ -0,0 +1,20 @@
+-- Content-addressed upload storage (see storage.py). Media rows point at a
+-- shared blob; media uploaded before this keeps blob_id NULL and owns its
+-- files directly.
+
+CREATE TABLE `media_blobs` (
+  `id` int(11) NOT NULL AUTO_INCREMENT,
+  `sha256` varchar(64) NOT NULL,
+  `file_url` text NOT NULL,
+  `variants` json DEFAULT NULL,
+  `aspect_ratio` float DEFAULT NULL,
+  `size_bytes` int(11) NOT NULL DEFAULT 0,
+  `ref_count` int(11) NOT NULL DEFAULT 1,
+  `created_at` datetime NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  PRIMARY KEY (`id`),
+  UNIQUE KEY `sha256` (`sha256`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+ALTER TABLE `media`
+  ADD COLUMN `blob_id` int(11) DEFAULT NULL AFTER `variants`,
+  ADD CONSTRAINT `media_blob_fk` FOREIGN KEY (`blob_id`) REFERENCES `media_blobs` (`id`);
@@ -0,0 +1,27 @@
+-- Background job queue (see jobs.py) and the processing state of media whose
+-- files are still being produced by a job. Existing media is 'ready'.
+
+CREATE TABLE `jobs` (
+  `id` int(11) NOT NULL AUTO_INCREMENT,
+  `kind` varchar(64) NOT NULL,
+  `payload` json NOT NULL,
+  `status` enum('queued','running','done','failed') NOT NULL DEFAULT 'queued',
+  `priority` int(11) NOT NULL DEFAULT 0,
+  `attempts` int(11) NOT NULL DEFAULT 0,
+  `max_attempts` int(11) NOT NULL DEFAULT 5,
+  `run_after` datetime NOT NULL,
+  `locked_by` varchar(64) DEFAULT NULL,
+  `locked_at` datetime DEFAULT NULL,
+  `last_error` text DEFAULT NULL,
+  `result` json DEFAULT NULL,
+  `created_by` int(11) DEFAULT NULL,
+  `created_at` datetime NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  `updated_at` datetime NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+  PRIMARY KEY (`id`),
+  KEY `ix_jobs_claim` (`status`, `priority`, `run_after`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+ALTER TABLE `media`
+  ADD COLUMN `status` enum('processing','ready','failed') NOT NULL DEFAULT 'ready' AFTER `blob_id`,
+  ADD COLUMN `job_id` int(11) DEFAULT NULL AFTER `status`,
+  ADD CONSTRAINT `media_job_fk` FOREIGN KEY (`job_id`) REFERENCES `jobs` (`id`);
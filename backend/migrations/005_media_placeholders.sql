@@ -0,0 +1,11 @@
+-- Low-quality image placeholder (a tiny WebP as a data: URI) and dominant
+-- colour, computed when an image is processed. NULL for media processed
+-- before this and for non-images.
+
+ALTER TABLE `media_blobs`
+  ADD COLUMN `placeholder` text DEFAULT NULL AFTER `aspect_ratio`,
+  ADD COLUMN `dominant_color` varchar(7) DEFAULT NULL AFTER `placeholder`;
+
+ALTER TABLE `media`
+  ADD COLUMN `placeholder` text DEFAULT NULL AFTER `variants`,
+  ADD COLUMN `dominant_color` varchar(7) DEFAULT NULL AFTER `placeholder`;
@@ -0,0 +1,17 @@
+-- Resumable uploads in progress (see resumable_uploads.py). Rows are removed
+-- when the upload completes, is cancelled or expires.
+
+CREATE TABLE `upload_sessions` (
+  `id` varchar(32) NOT NULL,
+  `user_id` int(11) NOT NULL,
+  `domain_id` int(11) NOT NULL,
+  `section_id` int(11) DEFAULT NULL,
+  `filename` varchar(255) NOT NULL,
+  `content_type` varchar(255) NOT NULL,
+  `upload_length` bigint(20) NOT NULL,
+  `upload_offset` bigint(20) NOT NULL DEFAULT 0,
+  `expires_at` datetime NOT NULL,
+  `created_at` datetime NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  PRIMARY KEY (`id`),
+  KEY `ix_upload_sessions_user_id` (`user_id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
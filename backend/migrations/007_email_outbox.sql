@@ -0,0 +1,7 @@
+-- Emails are queued and delivered by a background job (see mailer.py).
+-- `sent_at` holds the time queued until the message is delivered.
+
+ALTER TABLE `email_logs`
+  MODIFY COLUMN `status` enum('queued','sent','failed') NOT NULL DEFAULT 'sent',
+  ADD COLUMN `job_id` int(11) DEFAULT NULL AFTER `error`,
+  ADD CONSTRAINT `email_logs_job_fk` FOREIGN KEY (`job_id`) REFERENCES `jobs` (`id`);
@@ -0,0 +1,20 @@
+-- Bulk email campaigns: one row per mailing, its messages are email_logs rows
+-- delivered by a single "send_campaign" job (see mailer.py).
+
+CREATE TABLE `email_campaigns` (
+  `id` int(11) NOT NULL AUTO_INCREMENT,
+  `subject` varchar(500) NOT NULL,
+  `body` text NOT NULL,
+  `created_by` int(11) DEFAULT NULL,
+  `recipient_count` int(11) NOT NULL,
+  `job_id` int(11) DEFAULT NULL,
+  `created_at` datetime NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  PRIMARY KEY (`id`),
+  CONSTRAINT `email_campaigns_user_fk` FOREIGN KEY (`created_by`) REFERENCES `users` (`id`),
+  CONSTRAINT `email_campaigns_job_fk` FOREIGN KEY (`job_id`) REFERENCES `jobs` (`id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+ALTER TABLE `email_logs`
+  ADD COLUMN `campaign_id` int(11) DEFAULT NULL AFTER `job_id`,
+  ADD KEY `ix_email_logs_campaign_status` (`campaign_id`, `status`),
+  ADD CONSTRAINT `email_logs_campaign_fk` FOREIGN KEY (`campaign_id`) REFERENCES `email_campaigns` (`id`);
@@ -0,0 +1,25 @@
+-- Email log browsing with keyset pagination (ORDER BY id DESC; sent_at is
+-- rewritten on delivery, so it cannot key pages) and filters on status,
+-- recipient and sender, plus the archive that the retention job
+-- (tasks.archive_email_logs) moves old rows into, found by sent_at.
+
+ALTER TABLE `email_logs`
+  ADD KEY `ix_email_logs_sent_at` (`sent_at`, `id`),
+  ADD KEY `ix_email_logs_status_id` (`status`, `id`),
+  ADD KEY `ix_email_logs_to_email_id` (`to_email`, `id`),
+  ADD KEY `ix_email_logs_sent_by_id` (`sent_by`, `id`);
+
+CREATE TABLE `email_log_archive` (
+  `id` int(11) NOT NULL,
+  `to_email` varchar(255) NOT NULL,
+  `subject` varchar(500) NOT NULL,
+  `body_gz` mediumblob NOT NULL,
+  `sent_by` int(11) DEFAULT NULL,
+  `status` enum('queued','sent','failed') NOT NULL,
+  `error` text DEFAULT NULL,
+  `campaign_id` int(11) DEFAULT NULL,
+  `sent_at` datetime NOT NULL,
+  `archived_at` datetime NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  PRIMARY KEY (`id`),
+  KEY `ix_email_log_archive_sent_at` (`sent_at`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
@@ -0,0 +1,9 @@
+-- Cleanup of finished jobs (tasks.purge_jobs):
+-- WHERE status IN ('done', 'failed') AND updated_at < cutoff
+-- and at most one waiting run per periodic job (jobs.schedule_once): the
+-- kind is kept in `schedule_key` until the run is claimed; NULLs do not clash.
+
+ALTER TABLE `jobs`
+  ADD COLUMN `schedule_key` varchar(64) DEFAULT NULL AFTER `created_by`,
+  ADD UNIQUE KEY `schedule_key` (`schedule_key`),
+  ADD KEY `ix_jobs_finished` (`status`, `updated_at`);
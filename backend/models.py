@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Text, ForeignKey, Enum, Float, DateTime
+from sqlalchemy import Column, BigInteger, Integer, String, Text, ForeignKey, Enum, Float, DateTime, Index, JSON, LargeBinary
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from database import Base
@@ -51,13 +51,91 @@ class Media(Base):
     uploaded_by = Column(Integer, ForeignKey('users.id'))
     section_id = Column(Integer, ForeignKey('sections.id'))
     project_id = Column(Integer, ForeignKey('projects.id'), nullable=True)
-    type = Column(Enum('image', 'text'), default='image')
+    type = Column(Enum('image', 'video', 'text'), default='image')
     aspect_ratio = Column(Float, nullable=True)  # Added aspect_ratio field
     title = Column(String(255), nullable=False)  # Made title required
+    kind = Column(Enum('image', 'video', 'other'), default='other', nullable=False)  # Set on write, see crud.media_kind
+    variants = Column(JSON, nullable=True)  # Responsive renditions: [{width, height, format, url}]
+    placeholder = Column(Text, nullable=True)  # Tiny blurred image as a data: URI, shown while loading
+    dominant_color = Column(String(7), nullable=True)  # "#rrggbb"
+    blob_id = Column(Integer, ForeignKey('media_blobs.id'), nullable=True)  # None for media stored before dedup
+    status = Column(Enum('processing', 'ready', 'failed'), default='ready', nullable=False)  # Public reads show only 'ready'
+    job_id = Column(Integer, ForeignKey('jobs.id'), nullable=True)  # Job producing the files while 'processing'
     section = relationship("Section", back_populates="media_items")
     domain = relationship("Domain", back_populates="media_items")
     project = relationship("Project", back_populates="media_items")
 
+    __table_args__ = (
+        # Gallery lookups: WHERE domain_id = ? AND project_id IS NULL AND kind IN (...) ORDER BY id
+        Index('ix_media_gallery', 'domain_id', 'project_id', 'kind', 'id'),
+    )
+
+
+class MediaBlob(Base):
+    """
+    Processed files of one distinct upload, shared by every Media row whose
+    source had the same bytes. The files are removed when ref_count drops to 0.
+    """
+    __tablename__ = 'media_blobs'
+    id = Column(Integer, primary_key=True)
+    sha256 = Column(String(64), unique=True, nullable=False)  # Of the uploaded bytes
+    file_url = Column(Text, nullable=False)
+    variants = Column(JSON, nullable=True)
+    aspect_ratio = Column(Float, nullable=True)
+    placeholder = Column(Text, nullable=True)
+    dominant_color = Column(String(7), nullable=True)
+    size_bytes = Column(Integer, nullable=False, default=0)  # All stored files together
+    ref_count = Column(Integer, nullable=False, default=1)
+    created_at = Column(DateTime, server_default=func.now(), nullable=False)
+
+
+class Job(Base):
+    """Background work item, see jobs.py."""
+    __tablename__ = 'jobs'
+    id = Column(Integer, primary_key=True)
+    kind = Column(String(64), nullable=False)
+    payload = Column(JSON, nullable=False)
+    status = Column(Enum('queued', 'running', 'done', 'failed'), default='queued', nullable=False)
+    priority = Column(Integer, default=0, nullable=False)  # Higher runs first
+    attempts = Column(Integer, default=0, nullable=False)
+    max_attempts = Column(Integer, default=5, nullable=False)
+    run_after = Column(DateTime, nullable=False)
+    locked_by = Column(String(64), nullable=True)
+    locked_at = Column(DateTime, nullable=True)
+    last_error = Column(Text, nullable=True)
+    result = Column(JSON, nullable=True)
+    created_by = Column(Integer, nullable=True)  # User id, for the status endpoint; no FK so users stay deletable
+    # Kind of a periodic job while it waits to run (see jobs.schedule_once), else NULL
+    schedule_key = Column(String(64), nullable=True, unique=True)
+    created_at = Column(DateTime, server_default=func.now(), nullable=False)
+    updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now(), nullable=False)
+
+    __table_args__ = (
+        # Claim query: WHERE status = 'queued' AND run_after <= now ORDER BY priority DESC, id
+        Index('ix_jobs_claim', 'status', 'priority', 'run_after'),
+        # Cleanup: WHERE status IN ('done', 'failed') AND updated_at < cutoff
+        Index('ix_jobs_finished', 'status', 'updated_at'),
+    )
+
+
+class UploadSession(Base):
+    """Resumable upload in progress, see resumable_uploads.py."""
+    __tablename__ = 'upload_sessions'
+    id = Column(String(32), primary_key=True)  # Random token, also the name of the partial file
+    user_id = Column(Integer, nullable=False)  # No FKs, like jobs: sessions expire on their own
+    domain_id = Column(Integer, nullable=False)
+    section_id = Column(Integer, nullable=True)
+    filename = Column(String(255), nullable=False)
+    content_type = Column(String(255), nullable=False)
+    upload_length = Column(BigInteger, nullable=False)
+    upload_offset = Column(BigInteger, default=0, nullable=False)  # Bytes received so far
+    expires_at = Column(DateTime, nullable=False)
+    created_at = Column(DateTime, server_default=func.now(), nullable=False)
+
+    __table_args__ = (
+        Index('ix_upload_sessions_user_id', 'user_id'),
+    )
+
 
 class Project(Base):
     __tablename__ = 'projects'
@@ -112,6 +190,51 @@ class EmailLog(Base):
     subject = Column(String(500), nullable=False)
     body = Column(Text, nullable=False)
     sent_by = Column(Integer, ForeignKey('users.id'), nullable=True)
-    status = Column(Enum('sent', 'failed'), default='sent', nullable=False)
+    status = Column(Enum('queued', 'sent', 'failed'), default='sent', nullable=False)
     error = Column(Text, nullable=True)
-    sent_at = Column(DateTime, server_default=func.now(), nullable=False)
\ No newline at end of file
+    job_id = Column(Integer, ForeignKey('jobs.id'), nullable=True)  # Delivery job while queued
+    campaign_id = Column(Integer, ForeignKey('email_campaigns.id'), nullable=True)
+    sent_at = Column(DateTime, server_default=func.now(), nullable=False)  # Queued at, then delivered at
+
+    __table_args__ = (
+        # Campaign progress and the sender's batches: WHERE campaign_id = ? AND status = ?
+        Index('ix_email_logs_campaign_status', 'campaign_id', 'status'),
+        # The retention scan and sent_at ranges
+        Index('ix_email_logs_sent_at', 'sent_at', 'id'),
+        # Log browsing, newest first, keyset on id, filtered by status,
+        # recipient or sender (unfiltered pages use the primary key)
+        Index('ix_email_logs_status_id', 'status', 'id'),
+        Index('ix_email_logs_to_email_id', 'to_email', 'id'),
+        Index('ix_email_logs_sent_by_id', 'sent_by', 'id'),
+    )
+
+
+class EmailLogArchive(Base):
+    """Email logs past retention (see tasks.archive_email_logs); bodies zlib-compressed."""
+    __tablename__ = 'email_log_archive'
+    id = Column(Integer, primary_key=True, autoincrement=False)  # Same id it had in email_logs
+    to_email = Column(String(255), nullable=False)
+    subject = Column(String(500), nullable=False)
+    body_gz = Column(LargeBinary(length=16 * 1024 * 1024), nullable=False)
+    sent_by = Column(Integer, nullable=True)  # No FKs, archived rows outlive users and campaigns
+    status = Column(Enum('queued', 'sent', 'failed'), nullable=False)
+    error = Column(Text, nullable=True)
+    campaign_id = Column(Integer, nullable=True)
+    sent_at = Column(DateTime, nullable=False)
+    archived_at = Column(DateTime, server_default=func.now(), nullable=False)
+
+    __table_args__ = (
+        Index('ix_email_log_archive_sent_at', 'sent_at'),
+    )
+
+
+class EmailCampaign(Base):
+    """One mailing to many recipients; each message is an EmailLog row."""
+    __tablename__ = 'email_campaigns'
+    id = Column(Integer, primary_key=True)
+    subject = Column(String(500), nullable=False)  # Templates, see mailer.render
+    body = Column(Text, nullable=False)
+    created_by = Column(Integer, ForeignKey('users.id'), nullable=True)
+    recipient_count = Column(Integer, nullable=False)
+    job_id = Column(Integer, ForeignKey('jobs.id'), nullable=True)
+    created_at = Column(DateTime, server_default=func.now(), nullable=False)
\ No newline at end of file
@@ -0,0 +1,103 @@
+"""
+"Does user X own entity Y" in one indexed query.
+
+Every entity hangs off a domain, and the domain's user_id is the owner. Instead
+of loading the entity, then its project, then its domain, the resolver joins
+straight through to `domains.user_id`. The answer can be cached with
+OWNERSHIP_CACHE_TTL (see `cache.ownership_cache`), which is only safe with a
+single worker.
+"""
+from fastapi import HTTPException
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+import cache
+import models
+
+_OWNER_QUERIES = {
+    "domain": lambda entity_id: (
+        select(models.Domain.user_id).where(models.Domain.id == entity_id)
+    ),
+    "project": lambda entity_id: (
+        select(models.Domain.user_id)
+        .join(models.Project, models.Project.domain_id == models.Domain.id)
+        .where(models.Project.id == entity_id)
+    ),
+    "project_field": lambda entity_id: (
+        select(models.Domain.user_id)
+        .join(models.Project, models.Project.domain_id == models.Domain.id)
+        .join(models.ProjectField, models.ProjectField.project_id == models.Project.id)
+        .where(models.ProjectField.id == entity_id)
+    ),
+    "page": lambda entity_id: (
+        select(models.Domain.user_id)
+        .join(models.Page, models.Page.domain_id == models.Domain.id)
+        .where(models.Page.id == entity_id)
+    ),
+    "section": lambda entity_id: (
+        select(models.Domain.user_id)
+        .join(models.Page, models.Page.domain_id == models.Domain.id)
+        .join(models.Section, models.Section.page_id == models.Page.id)
+        .where(models.Section.id == entity_id)
+    ),
+    # Media created without a domain falls back to its uploader
+    "media": lambda entity_id: (
+        select(func.coalesce(models.Domain.user_id, models.Media.uploaded_by))
+        .select_from(models.Media)
+        .outerjoin(models.Domain, models.Media.domain_id == models.Domain.id)
+        .where(models.Media.id == entity_id)
+    ),
+}
+
+NOT_FOUND = {
+    "domain": "Domain not found",
+    "project": "Project not found",
+    "project_field": "Project field not found",
+    "page": "Page not found",
+    "section": "Section not found",
+    "media": "Media item not found",
+}
+
+
+def get_owner_id(db: Session, kind: str, entity_id: int) -> int | None:
+    """
+    Return the id of the user owning the entity, or None if it does not exist.
+    """
+    key = (kind, entity_id)
+    owner_id = cache.ownership_cache.get(key)
+    if owner_id is not None:
+        return owner_id
+
+    owner_id = db.execute(_OWNER_QUERIES[kind](entity_id)).scalar()
+    if owner_id is not None:
+        cache.ownership_cache.set(key, owner_id)
+    return owner_id
+
+
+async def get_owner_id_async(db: AsyncSession, kind: str, entity_id: int) -> int | None:
+    """Async version of `get_owner_id`, sharing its cache."""
+    key = (kind, entity_id)
+    owner_id = cache.ownership_cache.get(key)
+    if owner_id is not None:
+        return owner_id
+
+    owner_id = (await db.execute(_OWNER_QUERIES[kind](entity_id))).scalar()
+    if owner_id is not None:
+        cache.ownership_cache.set(key, owner_id)
+    return owner_id
+
+
+def is_owner(db: Session, kind: str, entity_id: int, user_id: int) -> bool:
+    return get_owner_id(db, kind, entity_id) == user_id
+
+
+def require_owner(db: Session, kind: str, entity_id: int, user_id: int, detail: str):
+    """
+    Raise 404 if the entity does not exist and 403 with `detail` if it belongs
+    to another user.
+    """
+    owner_id = get_owner_id(db, kind, entity_id)
+    if owner_id is None:
+        raise HTTPException(status_code=404, detail=NOT_FOUND[kind])
+    if owner_id != user_id:
+        raise HTTPException(status_code=403, detail=detail)
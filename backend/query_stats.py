@@ -0,0 +1,150 @@
+"""
+Per-request SQL statement counting and N+1 detection.
+
+Engine events record every statement into the stats object of the request
+that issued it (a ContextVar, so sync routes in the threadpool and async
+routes both report into the right request). The middleware adds
+
+    X-DB-Query-Count, X-DB-Query-Time-Ms
+
+to each response and logs a warning when the same statement ran at least
+QUERY_REPEAT_THRESHOLD times in one request, the usual sign of a lazy load
+inside a loop. Statements issued while a response is streaming are only in
+the log line, since the headers were already sent.
+
+Settings (environment):
+- QUERY_STATS_HEADERS: add the response headers (default: true)
+- QUERY_REPEAT_THRESHOLD: repeats of one statement flagged as N+1 (default: 5)
+"""
+import logging
+import os
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from sqlalchemy import event
+from starlette.datastructures import MutableHeaders
+
+QUERY_STATS_HEADERS = os.getenv("QUERY_STATS_HEADERS", "true").lower() == "true"
+QUERY_REPEAT_THRESHOLD = int(os.getenv("QUERY_REPEAT_THRESHOLD", "5"))
+
+logger = logging.getLogger("query_stats")
+
+
+class QueryStats:
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.statements: Counter = Counter()
+
+    def record(self, statement: str, seconds: float):
+        self.count += 1
+        self.seconds += seconds
+        self.statements[statement] += 1
+
+    def repeated(self, threshold: int = QUERY_REPEAT_THRESHOLD) -> list[tuple[str, int]]:
+        return [(sql, n) for sql, n in self.statements.most_common() if n >= threshold]
+
+
+_current: ContextVar[QueryStats | None] = ContextVar("query_stats", default=None)
+# Collectors registered by capture_queries(), which see statements from any request
+_collectors: list[QueryStats] = []
+_collectors_lock = threading.Lock()
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_start"].pop()
+    stats = _current.get()
+    if stats is not None:
+        stats.record(statement, elapsed)
+    if _collectors:
+        with _collectors_lock:
+            for collector in _collectors:
+                collector.record(statement, elapsed)
+
+
+def _handle_error(exception_context):
+    # A failed statement never reaches after_cursor_execute; drop its start
+    # so the next statement on this connection is not timed from it
+    conn = exception_context.connection
+    if conn is not None and conn.info.get("query_start"):
+        conn.info["query_start"].pop()
+
+
+def install(engine):
+    """Hook statement counting into a (sync) engine; use `.sync_engine` for async ones."""
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(engine, "handle_error", _handle_error)
+
+
+class QueryStatsMiddleware:
+    """ASGI middleware that scopes a QueryStats to each HTTP request."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = QueryStats()
+        token = _current.set(stats)
+
+        async def send_with_headers(message):
+            if message["type"] == "http.response.start" and QUERY_STATS_HEADERS:
+                headers = MutableHeaders(scope=message)
+                headers["X-DB-Query-Count"] = str(stats.count)
+                headers["X-DB-Query-Time-Ms"] = f"{stats.seconds * 1000:.2f}"
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_headers)
+        finally:
+            _current.reset(token)
+            for statement, n in stats.repeated():
+                logger.warning(
+                    "possible N+1: %s %s ran the same statement %d times: %s",
+                    scope["method"], scope["path"], n, " ".join(statement.split()),
+                )
+            logger.debug(
+                "%s %s: %d queries in %.2f ms",
+                scope["method"], scope["path"], stats.count, stats.seconds * 1000,
+            )
+
+
+@contextmanager
+def capture_queries():
+    """Collect every statement run inside the block, across threads and requests."""
+    stats = QueryStats()
+    with _collectors_lock:
+        _collectors.append(stats)
+    try:
+        yield stats
+    finally:
+        with _collectors_lock:
+            _collectors.remove(stats)
+
+
+@contextmanager
+def assert_max_queries(max_queries: int, allow_repeats: bool = False):
+    """
+    Test helper: fail if the block runs more than `max_queries` statements,
+    or (unless `allow_repeats`) repeats one statement N+1-style.
+
+        with query_stats.assert_max_queries(3):
+            client.get("/api/pages/")
+    """
+    with capture_queries() as stats:
+        yield stats
+    summary = "\n".join(f"  {n}x {' '.join(sql.split())}" for sql, n in stats.statements.most_common())
+    assert stats.count <= max_queries, f"{stats.count} queries, budget was {max_queries}:\n{summary}"
+    if not allow_repeats:
+        repeated = stats.repeated()
+        assert not repeated, f"possible N+1, statements repeated {QUERY_REPEAT_THRESHOLD}+ times:\n{summary}"
@@ -0,0 +1,180 @@
+"""
+Disk cache for on-demand image renditions.
+
+Each rendition is one file named after its key (source hash plus resize
+parameters), so a cached entry never goes stale: a changed source has a
+different key. The cache keeps an in-memory LRU index of the files and
+deletes the least recently used ones once the total size passes the budget.
+Concurrent requests for the same missing key share a single render, and
+files are not evicted while a response is sending them.
+
+Settings (environment):
+- RESIZE_CACHE_DIR: where renditions are written (default: ./resize-cache)
+- RESIZE_CACHE_MAX_BYTES: size budget of the directory (default: 512 MB)
+"""
+import asyncio
+import os
+import tempfile
+import threading
+from collections import Counter, OrderedDict
+import upload_files
+
+RESIZE_CACHE_DIR = os.getenv("RESIZE_CACHE_DIR", "./resize-cache")
+RESIZE_CACHE_MAX_BYTES = int(os.getenv("RESIZE_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+
+
+class DiskLRUCache:
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._entries: OrderedDict[str, int] = OrderedDict()  # file name -> size, oldest first
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._pending: dict[str, asyncio.Task] = {}
+        self._pins: Counter = Counter()  # file name -> responses still sending it
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+
+    def _load(self):
+        # Rebuild the index from disk, least recently used (oldest atime) first
+        files = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and not entry.name.startswith("."):
+                stat = entry.stat()
+                files.append((stat.st_atime, entry.name, stat.st_size))
+            elif entry.name.startswith(".render-"):
+                os.remove(entry.path)  # Interrupted render
+        for _, name, size in sorted(files):
+            self._entries[name] = size
+            self._bytes += size
+        self._evict()
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def _acquire(self, name: str) -> str | None:
+        # Path of a cached file, pinned until release(); None if not cached
+        with self._lock:
+            if name not in self._entries:
+                return None
+            self._entries.move_to_end(name)
+            self._pins[name] += 1
+        path = self.path(name)
+        if not os.path.exists(path):
+            # Removed behind our back
+            with self._lock:
+                self._bytes -= self._entries.pop(name, 0)
+                self._unpin(name)
+            return None
+        return path
+
+    def _unpin(self, name: str):
+        self._pins[name] -= 1
+        if self._pins[name] <= 0:
+            del self._pins[name]
+
+    def release(self, name: str):
+        """Let an entry returned by `get_or_render` be evicted again."""
+        with self._lock:
+            self._unpin(name)
+            self._evict()
+
+    def _add(self, name: str, size: int):
+        with self._lock:
+            self._bytes += size - self._entries.pop(name, 0)
+            self._entries[name] = size
+            self._evict(keep=name)
+
+    def _evict(self, keep: str | None = None):
+        # Oldest first, skipping files that are being sent
+        for name in list(self._entries):
+            if self._bytes <= self.max_bytes:
+                break
+            if name == keep or name in self._pins:
+                continue
+            self._bytes -= self._entries.pop(name)
+            self.evictions += 1
+            try:
+                os.remove(self.path(name))
+            except FileNotFoundError:
+                pass
+
+    async def _render(self, name: str, render):
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix=".render-")
+            os.close(fd)
+            try:
+                await render(tmp_path)
+                path = self.path(name)
+                os.replace(tmp_path, path)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+            self._add(name, os.path.getsize(path))
+        finally:
+            del self._pending[name]
+
+    async def get_or_render(self, name: str, render) -> str:
+        """
+        Return the path of the cached file `name`, calling `await render(tmp_path)`
+        to produce it on a miss. The file is pinned against eviction until
+        `release(name)`; `CachedFileResponse` does that once it is sent.
+
+        The render runs in a task of its own: callers asking for the same name
+        while it is in progress wait for it, and a caller that goes away only
+        stops waiting, without cancelling the render for the others.
+        """
+        counted = False
+        while True:
+            path = self._acquire(name)
+            if path is not None:
+                if not counted:
+                    self.hits += 1
+                return path
+
+            task = self._pending.get(name)
+            if task is None:
+                task = asyncio.ensure_future(self._render(name, render))
+                # Retrieved here so a failed render nobody waits for any more does not log a warning
+                task.add_done_callback(lambda t: t.cancelled() or t.exception())
+                self._pending[name] = task
+                if not counted:
+                    self.misses += 1
+            elif not counted:
+                self.coalesced += 1
+            counted = True
+            await asyncio.shield(task)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "evictions": self.evictions,
+            }
+
+
+class CachedFileResponse(upload_files.UploadFileResponse):
+    """Sends a file returned by `get_or_render` and then releases it."""
+
+    def __init__(self, cache: DiskLRUCache, name: str, path: str, **kwargs):
+        super().__init__(path, **kwargs)
+        self.cache = cache
+        self.name = name
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self.cache.release(self.name)
+
+
+renditions = DiskLRUCache(RESIZE_CACHE_DIR, RESIZE_CACHE_MAX_BYTES)
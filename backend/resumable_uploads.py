@@ -0,0 +1,117 @@
+"""
+Resumable uploads for large files (videos), modelled on the tus protocol.
+
+1. POST /api/upload/resumable with the file name, type and size creates a
+   session and an empty file under RESUMABLE_UPLOAD_DIR.
+2. PATCH /api/upload/resumable/{id} sends the bytes that go at the
+   `Upload-Offset` header, which must equal the bytes received so far. Bytes
+   that arrived before a dropped connection are kept, and HEAD on the session
+   tells the client where to continue. Each request streams into a file of
+   its own; only the one that advances the offset (a conditional UPDATE that
+   keeps the row locked) copies its bytes into the session file, so two
+   requests for the same offset cannot mix their data.
+3. POST /api/upload/resumable/{id}/complete hashes the file and creates the
+   media item the same way /api/upload does.
+
+A session that receives no data for RESUMABLE_UPLOAD_TTL seconds is removed
+by the "expire_upload_session" job.
+
+Settings (environment):
+- RESUMABLE_UPLOAD_DIR: where partial files are kept (default: ./upload-sessions)
+- RESUMABLE_UPLOAD_MAX_BYTES: largest file accepted (default: 2 GB)
+- RESUMABLE_UPLOAD_TTL: seconds a session survives without new data (default: 86400)
+- RESUMABLE_UPLOAD_MAX_SESSIONS: unfinished sessions per user (default: 10)
+"""
+import glob
+import hashlib
+import os
+import secrets
+import shutil
+from fastapi import HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+from starlette.requests import ClientDisconnect
+import storage
+
+RESUMABLE_UPLOAD_DIR = os.getenv("RESUMABLE_UPLOAD_DIR", "./upload-sessions")
+RESUMABLE_UPLOAD_MAX_BYTES = int(os.getenv("RESUMABLE_UPLOAD_MAX_BYTES", str(2 * 1024 * 1024 * 1024)))
+RESUMABLE_UPLOAD_TTL = float(os.getenv("RESUMABLE_UPLOAD_TTL", "86400"))
+RESUMABLE_UPLOAD_MAX_SESSIONS = int(os.getenv("RESUMABLE_UPLOAD_MAX_SESSIONS", "10"))
+
+CHUNK_CONTENT_TYPE = "application/offset+octet-stream"
+
+
+def new_session_id() -> str:
+    return secrets.token_hex(16)
+
+
+def session_path(session_id: str) -> str:
+    return os.path.join(RESUMABLE_UPLOAD_DIR, session_id)
+
+
+def create_file(session_id: str) -> str:
+    os.makedirs(RESUMABLE_UPLOAD_DIR, exist_ok=True)
+    path = session_path(session_id)
+    open(path, "xb").close()
+    return path
+
+
+def chunk_path(session_id: str) -> str:
+    """A new path for the body of one PATCH request."""
+    return f"{session_path(session_id)}.{secrets.token_hex(8)}"
+
+
+def remove_file(session_id: str) -> None:
+    """Remove the session file and the chunks of interrupted requests."""
+    path = session_path(session_id)
+    for leftover in (path, *glob.glob(glob.escape(path) + ".*")):
+        if os.path.exists(leftover):
+            os.remove(leftover)
+
+
+async def receive_chunk(request: Request, path: str, limit: int) -> int:
+    """
+    Write the request body into a new file at `path`, buffering up to
+    storage.CHUNK_SIZE in memory, and return the number of bytes written.
+
+    More than `limit` bytes is answered with 413. If the client disconnects
+    midway, what arrived so far is written and counted, so the next PATCH
+    continues from there instead of resending the whole chunk.
+    """
+    out = await run_in_threadpool(open, path, "xb")
+    written = 0
+    buffer = bytearray()
+    try:
+        try:
+            async for data in request.stream():
+                if written + len(buffer) + len(data) > limit:
+                    raise HTTPException(status_code=413, detail="Chunk exceeds the declared upload length")
+                buffer += data
+                if len(buffer) >= storage.CHUNK_SIZE:
+                    await run_in_threadpool(out.write, buffer)
+                    written += len(buffer)
+                    buffer = bytearray()
+        except ClientDisconnect:
+            pass
+        if buffer:
+            await run_in_threadpool(out.write, buffer)
+            written += len(buffer)
+    finally:
+        await run_in_threadpool(out.close)
+    return written
+
+
+def append_chunk(session_id: str, path: str, offset: int) -> None:
+    """Copy a received chunk into the session file at `offset`."""
+    with open(path, "rb") as src, open(session_path(session_id), "r+b") as out:
+        out.seek(offset)
+        shutil.copyfileobj(src, out, storage.CHUNK_SIZE)
+
+
+def hash_file(path: str) -> storage.SavedUpload:
+    digest = hashlib.sha256()
+    size = 0
+    with open(path, "rb") as src:
+        while chunk := src.read(storage.CHUNK_SIZE):
+            digest.update(chunk)
+            size += len(chunk)
+    return storage.SavedUpload(path=path, sha256=digest.hexdigest(), size=size)
@@ -1,4 +1,4 @@
-from pydantic import BaseModel, EmailStr
+from pydantic import BaseModel, EmailStr, computed_field
 from typing import Optional, List, Literal
 from datetime import datetime
 
@@ -64,6 +64,9 @@ class SectionRead(SectionBase):
     class Config:
         from_attributes = True
 
+class SectionOrder(BaseModel):
+    section_ids: List[int]  # Every section of the page, first to last
+
 # PAGE SCHEMAS
 class PageBase(BaseModel):
     title: Optional[str]
@@ -138,6 +141,21 @@ class ProjectFieldRead(ProjectFieldBase):
     id: int
 
 
+class ProjectFieldUpsert(BaseModel):
+    # Updates the field with this id, else the project's field with this
+    # field_key, else creates one; omitted values are left as they are
+    id: Optional[int] = None
+    field_key: Optional[str] = None
+    field_value: Optional[str] = None
+    field_type: Optional[str] = None
+    field_definition_id: Optional[int] = None
+
+
+class ProjectFieldBatch(BaseModel):
+    upsert: List[ProjectFieldUpsert] = []
+    delete: List[int] = []  # Field ids
+
+
 class ProjectRead(ProjectBase):
     id: int
     fields: List[ProjectFieldRead] = []
@@ -175,11 +193,29 @@ class SEORead(SEOBase):
         from_attributes = True
 
 # MEDIA SCHEMAS
+VARIANT_MIME_TYPES = {"avif": "image/avif", "webp": "image/webp", "jpeg": "image/jpeg"}
+
+
+class MediaVariant(BaseModel):
+    width: int
+    height: int
+    format: Literal['avif', 'webp', 'jpeg']
+    url: str
+
+
+def build_srcset(variants: Optional[List[MediaVariant]]) -> dict[str, str]:
+    """Group variants into one `srcset` string per MIME type, e.g. for <picture><source type=...>."""
+    srcset: dict[str, list[str]] = {}
+    for variant in sorted(variants or [], key=lambda v: v.width):
+        srcset.setdefault(VARIANT_MIME_TYPES[variant.format], []).append(f"{variant.url} {variant.width}w")
+    return {mime: ", ".join(entries) for mime, entries in srcset.items()}
+
+
 class MediaBase(BaseModel):
     title: str  # Made required to match database
     file_url: Optional[str]
     text: Optional[str]
-    type: Literal['image', 'text']
+    type: Literal['image', 'video', 'text']
     aspect_ratio: float | None = None  # h/w ratio, None for non-images
     
 class MediaCreate(BaseModel):
@@ -192,17 +228,41 @@ class MediaCreate(BaseModel):
     project_id: Optional[int] = None
     text: Optional[str] = None
     aspect_ratio: Optional[float] = None  # Added aspect_ratio field
+    # Variants, placeholder, colour and blob are set by the upload pipeline only
 
 class MediaRead(MediaBase):
     id: int
+    kind: Optional[str] = None  # image, video or other
     domain_id: Optional[int]  # Added domain_id field
     uploaded_by: Optional[int]
     section_id: Optional[int]
     project_id: Optional[int]
+    variants: Optional[List[MediaVariant]] = None
+    placeholder: Optional[str] = None  # data: URI to paint while the image loads
+    dominant_color: Optional[str] = None  # "#rrggbb"
+    status: Optional[str] = None  # processing, ready or failed
+    job_id: Optional[int] = None  # see GET /api/jobs/{job_id} while processing
+
+    @computed_field
+    @property
+    def srcset(self) -> dict[str, str]:
+        return build_srcset(self.variants)
 
     class Config:
         from_attributes = True
 
+class BulkUploadItem(BaseModel):
+    filename: str
+    status: Literal['created', 'failed']
+    deduplicated: bool = False  # Content was already stored; no processing needed
+    error: Optional[str] = None
+    media: Optional[MediaRead] = None
+
+class BulkUploadResult(BaseModel):
+    created: int
+    failed: int
+    results: List[BulkUploadItem]
+
 class MediaUpdate(BaseModel):
     title: Optional[str] = None
     text: Optional[str] = None
@@ -214,14 +274,60 @@ class MediaNoUploadedBy(BaseModel):
     title: str
     file_url: str
     type: str
+    kind: Optional[str] = None
     domain_id: int
     section_id: Optional[int]
     text: Optional[str]
+    variants: Optional[List[MediaVariant]] = None
+    placeholder: Optional[str] = None  # data: URI to paint while the image loads
+    dominant_color: Optional[str] = None  # "#rrggbb"
+
+    @computed_field
+    @property
+    def srcset(self) -> dict[str, str]:
+        return build_srcset(self.variants)
 
     class Config:
         orm_mode = True
 
 
+# JOB SCHEMAS
+class JobRead(BaseModel):
+    id: int
+    kind: str
+    status: Literal['queued', 'running', 'done', 'failed']
+    priority: int
+    attempts: int
+    max_attempts: int
+    run_after: datetime
+    last_error: Optional[str] = None
+    result: Optional[dict] = None
+    created_at: datetime
+    updated_at: datetime
+
+    class Config:
+        from_attributes = True
+
+
+# RESUMABLE UPLOAD SCHEMAS
+class ResumableUploadCreate(BaseModel):
+    filename: str
+    content_type: str = "application/octet-stream"
+    length: int  # Total size in bytes
+
+
+class ResumableUploadRead(BaseModel):
+    id: str
+    filename: str
+    content_type: str
+    upload_length: int
+    upload_offset: int
+    expires_at: datetime
+
+    class Config:
+        from_attributes = True
+
+
 # ADMIN SCHEMAS
 class AdminUserUpdate(BaseModel):
     name: Optional[str] = None
@@ -258,9 +364,39 @@ class EmailLogRead(BaseModel):
     subject: str
     body: str
     sent_by: Optional[int] = None
-    status: str
+    status: Literal['queued', 'sent', 'failed']
     error: Optional[str] = None
+    job_id: Optional[int] = None
+    campaign_id: Optional[int] = None
     sent_at: Optional[datetime] = None
 
     class Config:
-        from_attributes = True
\ No newline at end of file
+        from_attributes = True
+
+class EmailCampaignCreate(BaseModel):
+    subject: str
+    body: str  # $name, $email and $domains are filled in per recipient
+    # Recipients: an explicit list, or users filtered by role and/or owning one of domain_ids
+    recipients: Optional[List[EmailStr]] = None
+    role: Optional[Literal['admin', 'editor', 'client']] = None
+    domain_ids: Optional[List[int]] = None
+
+
+class EmailCampaignRead(BaseModel):
+    id: int
+    subject: str
+    created_by: Optional[int] = None
+    recipient_count: int
+    queued: int = 0
+    sent: int = 0
+    failed: int = 0
+    job_id: Optional[int] = None
+    created_at: datetime
+
+    @computed_field
+    @property
+    def status(self) -> Literal['sending', 'done']:
+        return "sending" if self.queued else "done"
+
+    class Config:
+        from_attributes = True
@@ -0,0 +1,251 @@
+"""
+On-disk handling of uploaded files.
+
+Uploads are stored content-addressed: identical uploads share one set of
+files (see models.MediaBlob for the reference counts), under
+uploads/blobs/{first two hex digits of the SHA-256}/. The files are named
+after the SHA-256 plus a random suffix chosen when they are stored
+(`new_blob_stem`), so removing the files of a deleted blob can never hit the
+files of a later upload of the same content.
+
+Settings (environment):
+- BULK_UPLOAD_MAX_FILES: files per bulk upload, archives counted by entry (default: 200)
+- BULK_UPLOAD_MAX_BYTES: total bytes per bulk upload, archives uncompressed (default: 500 MB)
+"""
+import hashlib
+import os
+import secrets
+import shutil
+import tempfile
+import zipfile
+from dataclasses import dataclass
+from fastapi import HTTPException, UploadFile
+from fastapi.concurrency import run_in_threadpool
+import media_processing
+
+CHUNK_SIZE = 1024 * 1024  # 1 MB
+MAX_FILE_BYTES = 20 * 1024 * 1024
+BULK_UPLOAD_MAX_FILES = int(os.getenv("BULK_UPLOAD_MAX_FILES", "200"))
+BULK_UPLOAD_MAX_BYTES = int(os.getenv("BULK_UPLOAD_MAX_BYTES", str(500 * 1024 * 1024)))
+
+UPLOAD_ROOT = "./uploads"
+BLOB_DIR = os.path.join(UPLOAD_ROOT, "blobs")
+
+
+@dataclass(frozen=True)
+class SavedUpload:
+    path: str  # temp file, the caller moves or removes it
+    sha256: str
+    size: int
+
+
+def _write_chunk(out, digest, chunk: bytes):
+    digest.update(chunk)
+    out.write(chunk)
+
+
+async def save_upload(file: UploadFile, directory: str, max_bytes: int) -> SavedUpload:
+    """
+    Copy an upload into a temp file inside `directory`, one chunk at a time,
+    hashing it on the way.
+
+    Memory use stays at one chunk per request regardless of the file size, and
+    the copy is aborted with 413 as soon as `max_bytes` is exceeded. The temp
+    file lives next to its final destination so it can be moved with
+    `os.replace`.
+    """
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".upload-")
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with os.fdopen(fd, "wb") as out:
+            while chunk := await file.read(CHUNK_SIZE):
+                size += len(chunk)
+                if size > max_bytes:
+                    raise HTTPException(status_code=413, detail="File too large")
+                await run_in_threadpool(_write_chunk, out, digest, chunk)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    return SavedUpload(path=tmp_path, sha256=digest.hexdigest(), size=size)
+
+
+def new_blob_stem(sha256: str) -> str:
+    """File name stem for a new set of stored files of this content."""
+    return f"{sha256}-{secrets.token_hex(4)}"
+
+
+def blob_location(stem: str) -> tuple[str, str]:
+    """Directory and URL prefix for the files of a blob (stem or SHA-256)."""
+    shard = stem[:2]
+    directory = os.path.join(BLOB_DIR, shard)
+    os.makedirs(directory, exist_ok=True)
+    return directory, f"/uploads/blobs/{shard}"
+
+
+def local_path(url: str) -> str:
+    """file_url is "/uploads/..." — prepend "." to get a relative path."""
+    return os.path.normpath("." + url)
+
+
+def file_size(url: str) -> int:
+    try:
+        return os.path.getsize(local_path(url))
+    except OSError:
+        return 0
+
+
+def stored_urls(stored: dict) -> list[str]:
+    """URLs of the files in a `store_files` result."""
+    return [stored["file_url"], *(v["url"] for v in stored["variants"] or [])]
+
+
+def remove_files(urls) -> None:
+    for url in urls:
+        path = local_path(url)
+        if os.path.exists(path):
+            os.remove(path)
+
+
+
+def _stored_files(src_path: str, stem: str, filename: str, processed: dict | None) -> dict:
+    directory, base_url = blob_location(stem)
+    if processed is not None:
+        variants = [
+            {"width": v["width"], "height": v["height"], "format": v["format"], "url": f"{base_url}/{v['file']}"}
+            for v in processed["variants"]
+        ]
+        file_url = f"{base_url}/{processed['file']}"
+        aspect_ratio = processed["aspect_ratio"]
+        placeholder = processed["placeholder"]
+        dominant_color = processed["dominant_color"]
+    else:
+        # Not an image, or conversion failed: store the original
+        remove_files(
+            f"{base_url}/{name}"
+            for name in (f"{stem}.webp", *media_processing.variant_files(stem))
+        )
+        save_filename = stem + os.path.splitext(filename)[1].lower()
+        # Link or copy rather than move, so a retry still finds the source.
+        # A hard link avoids rewriting large videos on the same filesystem.
+        tmp_path = os.path.join(directory, f".upload-{secrets.token_hex(8)}")
+        try:
+            os.link(src_path, tmp_path)
+        except OSError:
+            shutil.copyfile(src_path, tmp_path)
+        os.replace(tmp_path, os.path.join(directory, save_filename))
+        file_url = f"{base_url}/{save_filename}"
+        variants = None
+        aspect_ratio = None
+        placeholder = None
+        dominant_color = None
+
+    size_bytes = sum(file_size(url) for url in [file_url, *(v["url"] for v in variants or [])])
+    return {
+        "file_url": file_url,
+        "variants": variants,
+        "aspect_ratio": aspect_ratio,
+        "placeholder": placeholder,
+        "dominant_color": dominant_color,
+        "size_bytes": size_bytes,
+    }
+
+
+def store_files(user_id: int, src_path: str, stem: str, filename: str, is_image: bool) -> dict:
+    """
+    Write the processed files of an upload to its content-addressed location,
+    named after `stem` (see `new_blob_stem`): a full-size WebP plus responsive
+    variants for images, the original otherwise. Safe to repeat: the same
+    input and stem always produce the same files.
+
+    Runs in a job worker thread, within the transcode limits of `user_id`.
+    Raises media_processing.ImageTooLarge for images over the pixel budget;
+    images Pillow cannot decode are stored as they are. Any other failure
+    (of the pool, or the disk) is raised.
+
+    Returns:
+        dict: file_url, variants, aspect_ratio, placeholder, dominant_color and
+        size_bytes, see crud.attach_blob.
+    """
+    processed = None
+    if is_image:
+        directory, _ = blob_location(stem)
+        memory = media_processing.decode_cost(src_path)
+        try:
+            processed = media_processing.run_blocking(
+                user_id, media_processing.process_image, src_path, directory, stem, memory=memory
+            )
+        except media_processing.UnreadableImage:
+            processed = None
+    return _stored_files(src_path, stem, filename, processed)
+
+
+async def store_files_async(user_id: int, src_path: str, stem: str, filename: str, is_image: bool, per_user_limit: int | None = None) -> dict:
+    """`store_files` for the event loop, queued behind the pool's concurrency limits."""
+    processed = None
+    if is_image:
+        directory, _ = blob_location(stem)
+        memory = await run_in_threadpool(media_processing.decode_cost, src_path)
+        try:
+            processed = await media_processing.run_in_pool(
+                user_id, media_processing.process_image, src_path, directory, stem,
+                per_user_limit=per_user_limit, memory=memory,
+            )
+        except media_processing.UnreadableImage:
+            processed = None
+    return await run_in_threadpool(_stored_files, src_path, stem, filename, processed)
+
+
+def extract_zip(zip_path: str, directory: str, max_file_bytes: int, max_files: int, max_total_bytes: int) -> list:
+    """
+    Extract the files of an archive into temp files inside `directory`,
+    hashing them on the way. Sizes are enforced while copying, so an archive
+    lying about its sizes cannot fill the disk.
+
+    Returns:
+        list[tuple[str, SavedUpload | None, str | None]]: Per entry the file
+        name, the temp file (caller removes it) and an error message.
+    """
+    results = []
+    total = 0
+    try:
+        with zipfile.ZipFile(zip_path) as archive:
+            for info in archive.infolist():
+                name = os.path.basename(info.filename)
+                if info.is_dir() or not name or name.startswith(".") or info.filename.startswith("__MACOSX/"):
+                    continue
+                if len(results) >= max_files:
+                    raise HTTPException(status_code=413, detail=f"Too many files, at most {max_files} per upload")
+                if info.file_size > max_file_bytes:
+                    results.append((name, None, "File too large"))
+                    continue
+
+                fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".upload-")
+                digest = hashlib.sha256()
+                size = 0
+                error = None
+                with os.fdopen(fd, "wb") as out, archive.open(info) as src:
+                    while chunk := src.read(CHUNK_SIZE):
+                        size += len(chunk)
+                        total += len(chunk)
+                        if size > max_file_bytes:
+                            error = "File too large"
+                            break
+                        if total > max_total_bytes:
+                            raise HTTPException(status_code=413, detail="Archive too large")
+                        digest.update(chunk)
+                        out.write(chunk)
+                if error:
+                    os.remove(tmp_path)
+                    results.append((name, None, error))
+                else:
+                    results.append((name, SavedUpload(path=tmp_path, sha256=digest.hexdigest(), size=size), None))
+    except BaseException:
+        for _, saved, _ in results:
+            if saved is not None and os.path.exists(saved.path):
+                os.remove(saved.path)
+        if "tmp_path" in locals() and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return results
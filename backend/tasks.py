@@ -0,0 +1,209 @@
+"""
+Job handlers. Imported by the API and by worker.py so both know every kind.
+"""
+import os
+import smtplib
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+from sqlalchemy.orm import Session
+import crud
+import jobs
+import mailer
+import media_processing
+import models
+import resumable_uploads
+import storage
+
+
+def _upload_failed(db: Session, payload: dict, error: str):
+    crud.set_media_status(db, payload["media_id"], "failed")
+    if os.path.exists(payload["path"]):
+        os.remove(payload["path"])
+
+
+@jobs.handler("process_upload", on_failure=_upload_failed)
+def process_upload(db: Session, payload: dict) -> dict:
+    """
+    Turn the raw upload at payload["path"] into stored files and mark its media
+    item ready. Skips processing when the same content was stored meanwhile.
+    """
+    media_id = payload["media_id"]
+    media_item = db.get(models.Media, media_id)
+    if media_item is not None:
+        uploaded_by = media_item.uploaded_by
+        media_item = crud.attach_blob(db, media_id, payload["sha256"])
+        if media_item is None:
+            try:
+                stored = storage.store_files(
+                    uploaded_by, payload["path"], payload["stem"], payload["filename"], payload["is_image"]
+                )
+            except media_processing.ImageTooLarge as exc:
+                raise jobs.PermanentError(str(exc)) from exc
+            media_item = crud.attach_blob(db, media_id, payload["sha256"], stored)
+
+    if os.path.exists(payload["path"]):
+        os.remove(payload["path"])
+    if media_item is None:
+        # Deleted while waiting for processing
+        return {"media_id": media_id, "deleted": True}
+    return {"media_id": media_id, "file_url": media_item.file_url}
+
+
+@jobs.handler("delete_files")
+def delete_files(db: Session, payload: dict) -> dict:
+    storage.remove_files(payload["urls"])
+    return {"removed": len(payload["urls"])}
+
+
+@jobs.handler("expire_upload_session")
+def expire_upload_session(db: Session, payload: dict) -> dict:
+    """Remove a resumable upload that received no data for its TTL."""
+    session = db.get(models.UploadSession, payload["session_id"])
+    if session is None:
+        # Completed or cancelled
+        return {"expired": False}
+    remaining = (session.expires_at - datetime.utcnow()).total_seconds()
+    if remaining > 0:
+        # Still receiving data: look again when it would expire
+        jobs.enqueue(db, "expire_upload_session", payload, priority=jobs.PRIORITY_LOW, delay=remaining)
+        return {"expired": False, "rescheduled": True}
+    if crud.delete_upload_session(db, session.id):
+        resumable_uploads.remove_file(session.id)
+    return {"expired": True}
+
+
+def _email_failed(db: Session, payload: dict, error: str):
+    crud.set_emails_status(db, [payload["email_log_id"]], "failed", error.removeprefix("jobs.PermanentError: "))
+
+
+@jobs.handler("send_email", on_failure=_email_failed)
+def send_email(db: Session, payload: dict) -> dict:
+    """Deliver a queued EmailLog; temporary SMTP failures are retried by the queue."""
+    log = db.get(models.EmailLog, payload["email_log_id"])
+    if log is None or log.status == "sent":
+        return {"sent": False}
+    try:
+        mailer.send(log.to_email, log.subject, log.body, mailer.stable_message_id(f"email-log-{log.id}"))
+    except (smtplib.SMTPException, OSError) as exc:
+        if mailer.is_permanent(exc):
+            raise jobs.PermanentError(f"SMTP error: {exc}") from exc
+        raise
+    crud.set_emails_status(db, [log.id], "sent")
+    return {"sent": True}
+
+
+CAMPAIGN_BATCH_SIZE = 100
+
+
+def _campaign_failed(db: Session, payload: dict, error: str):
+    crud.fail_queued_campaign_emails(db, payload["campaign_id"], error)
+
+
+@jobs.handler("send_campaign", on_failure=_campaign_failed)
+def send_campaign(db: Session, payload: dict) -> dict:
+    """
+    Deliver the queued messages of a campaign, CAMPAIGN_BATCH_SIZE at a time.
+    Each batch is recorded with one UPDATE for the sent messages and one per
+    distinct permanent error. Messages that hit a temporary error stay queued
+    and the job is retried for them. To stay within the lock timeout, the job
+    hands over to a new one after half of it.
+    """
+    campaign_id = payload["campaign_id"]
+    deadline = time.monotonic() + jobs.JOB_LOCK_TIMEOUT / 2
+    after_id = 0
+    sent = failed = 0
+    deferred = []
+    while batch := crud.get_queued_campaign_emails(db, campaign_id, after_id, CAMPAIGN_BATCH_SIZE):
+        after_id = batch[-1].id
+        results = mailer.send_many({
+            log.id: mailer.build_message(log.to_email, log.subject, log.body, mailer.stable_message_id(f"email-log-{log.id}"))
+            for log in batch
+        })
+        sent_ids = []
+        refused = defaultdict(list)
+        for log_id, exc in results.items():
+            if exc is None:
+                sent_ids.append(log_id)
+            elif mailer.is_permanent(exc):
+                refused[f"SMTP error: {exc}"].append(log_id)
+            else:
+                deferred.append(exc)
+        crud.set_emails_status(db, sent_ids, "sent")
+        for error, log_ids in refused.items():
+            crud.set_emails_status(db, log_ids, "failed", error)
+        sent += len(sent_ids)
+        failed += sum(len(log_ids) for log_ids in refused.values())
+
+        if time.monotonic() > deadline:
+            job = jobs.enqueue(db, "send_campaign", payload, priority=jobs.PRIORITY_LOW)
+            db.get(models.EmailCampaign, campaign_id).job_id = job.id
+            return {"sent": sent, "failed": failed, "continued_in": job.id}
+
+    if deferred:
+        raise RuntimeError(f"{len(deferred)} messages deferred, last error: {deferred[-1]!r}")
+    return {"sent": sent, "failed": failed}
+
+
+EMAIL_LOG_ARCHIVE_BATCH_SIZE = 1000
+
+
+def _archive_email_logs_failed(db: Session, payload: dict, error: str):
+    # Keep the schedule going after a run that failed for good
+    jobs.schedule_once(db, "archive_email_logs", payload, delay=mailer.EMAIL_LOG_ARCHIVE_INTERVAL)
+    db.commit()
+
+
+@jobs.handler("archive_email_logs", on_failure=_archive_email_logs_failed)
+def archive_email_logs(db: Session, payload: dict) -> dict:
+    """
+    Move email logs older than EMAIL_LOG_RETENTION_DAYS to the archive, one
+    batch per transaction, then schedule the next run. A large backlog is
+    worked off in runs of at most half the lock timeout.
+    """
+    cutoff = datetime.utcnow() - timedelta(days=mailer.EMAIL_LOG_RETENTION_DAYS)
+    deadline = time.monotonic() + jobs.JOB_LOCK_TIMEOUT / 2
+    archived = 0
+    while moved := crud.archive_email_logs(db, cutoff, EMAIL_LOG_ARCHIVE_BATCH_SIZE):
+        archived += moved
+        if time.monotonic() > deadline:
+            jobs.schedule_once(db, "archive_email_logs", payload)
+            return {"archived": archived, "continued": True}
+    jobs.schedule_once(db, "archive_email_logs", payload, delay=mailer.EMAIL_LOG_ARCHIVE_INTERVAL)
+    return {"archived": archived}
+
+
+JOB_PURGE_BATCH_SIZE = 1000
+
+
+def _purge_jobs_failed(db: Session, payload: dict, error: str):
+    # Keep the schedule going after a run that failed for good
+    jobs.schedule_once(db, "purge_jobs", payload, delay=jobs.JOB_PURGE_INTERVAL)
+    db.commit()
+
+
+@jobs.handler("purge_jobs", on_failure=_purge_jobs_failed)
+def purge_jobs(db: Session, payload: dict) -> dict:
+    """
+    Delete jobs that finished more than JOB_RETENTION_DAYS ago, one batch per
+    transaction, then schedule the next run.
+    """
+    cutoff = datetime.utcnow() - timedelta(days=jobs.JOB_RETENTION_DAYS)
+    deadline = time.monotonic() + jobs.JOB_LOCK_TIMEOUT / 2
+    purged = 0
+    while deleted := jobs.purge_finished(db, cutoff, JOB_PURGE_BATCH_SIZE):
+        purged += deleted
+        if time.monotonic() > deadline:
+            jobs.schedule_once(db, "purge_jobs", payload)
+            return {"purged": purged, "continued": True}
+    jobs.schedule_once(db, "purge_jobs", payload, delay=jobs.JOB_PURGE_INTERVAL)
+    return {"purged": purged}
+
+
+def schedule_periodic(db: Session):
+    """Seed the jobs that reschedule themselves; called when a process starts."""
+    if mailer.EMAIL_LOG_RETENTION_DAYS > 0:
+        jobs.schedule_once(db, "archive_email_logs", {})
+    if jobs.JOB_RETENTION_DAYS > 0:
+        jobs.schedule_once(db, "purge_jobs", {})
+    db.commit()
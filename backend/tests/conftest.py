@@ -0,0 +1,65 @@
+import atexit
+import itertools
+import os
+import shutil
+import sys
+import tempfile
+
+import pytest
+
+# The modules read their settings from the environment on import: give them a
+# throwaway SQLite database and working directory (uploads, upload sessions,
+# resize cache), and no MySQL, TLS or embedded job workers
+_workdir = tempfile.mkdtemp(prefix="nebula-cms-tests-")
+atexit.register(shutil.rmtree, _workdir, ignore_errors=True)
+os.chdir(_workdir)
+os.makedirs("uploads", exist_ok=True)
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{_workdir}/test.db")
+os.environ.setdefault("JOB_WORKER_EMBEDDED", "false")
+os.environ.setdefault("SMTP_HOST", "127.0.0.1")
+os.environ.setdefault("SMTP_USE_TLS", "false")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+_ids = itertools.count(1)
+
+
+@pytest.fixture
+def db_session():
+    import database
+    session = database.SessionLocal()
+    yield session
+    session.close()
+
+
+@pytest.fixture
+def make_user(db_session):
+    """Create a user with one domain; returns (user, domain)."""
+    import models
+
+    def make(role: str = "client"):
+        n = next(_ids)
+        user = models.User(name=f"User {n}", email=f"user{n}@example.com", password="x", role=role)
+        db_session.add(user)
+        db_session.flush()
+        domain = models.Domain(name=f"site{n}.example.com", user_id=user.id)
+        db_session.add(domain)
+        db_session.commit()
+        return user, domain
+
+    return make
+
+
+@pytest.fixture
+def client_for():
+    """A TestClient logged in as the given user (startup events do not run)."""
+    from fastapi.testclient import TestClient
+    import main
+    from auth import create_access_token
+
+    def make(user):
+        client = TestClient(main.app)
+        client.cookies.set("access_token", create_access_token({"user_id": user.id}))
+        return client
+
+    return make
@@ -0,0 +1,70 @@
+"""Token revocation: the in-memory and SQLite stores, and logout end to end."""
+import time
+
+import pytest
+
+import auth
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request, tmp_path):
+    if request.param == "memory":
+        return auth.MemoryRevocationStore()
+    return auth.SQLiteRevocationStore(str(tmp_path / "revoked.sqlite3"))
+
+
+def test_revoked_until_expiry(store):
+    now = time.time()
+    store.revoke("live", now + 60)
+    store.revoke("expired", now - 1)
+    assert store.is_revoked("live")
+    assert not store.is_revoked("expired")
+    assert not store.is_revoked("never-revoked")
+
+
+def test_memory_store_evicts_expired_tokens():
+    store = auth.MemoryRevocationStore()
+    now = time.time()
+    for n in range(100):
+        store.revoke(f"old-{n}", now - 1)
+    store.revoke("live", now + 60)
+    # Eviction runs on revoke, without any lookup of the old tokens
+    assert len(store) == 1
+
+
+def test_memory_store_revoked_again_keeps_later_expiry():
+    store = auth.MemoryRevocationStore()
+    now = time.time()
+    store.revoke("token", now + 0.05)
+    store.revoke("token", now + 60)
+    time.sleep(0.1)
+    store.revoke("other", now + 60)  # evicts the first heap entry of "token"
+    assert store.is_revoked("token")
+
+
+def test_sqlite_store_is_shared_between_processes(tmp_path):
+    path = str(tmp_path / "revoked.sqlite3")
+    # Two stores on one file stand in for two workers on the same host
+    first, second = auth.SQLiteRevocationStore(path), auth.SQLiteRevocationStore(path)
+    first.revoke("token", time.time() + 60)
+    assert second.is_revoked("token")
+
+
+def test_sqlite_store_purges_expired_rows(tmp_path):
+    store = auth.SQLiteRevocationStore(str(tmp_path / "revoked.sqlite3"), purge_interval=0)
+    store.revoke("expired", time.time() - 1)
+    store.revoke("live", time.time() + 60)
+    rows = store._connect().execute("SELECT COUNT(*) FROM revoked_tokens").fetchone()[0]
+    assert rows == 1
+
+
+def test_logout_revokes_the_token(make_user, client_for):
+    user, _ = make_user()
+    client = client_for(user)
+    token = client.cookies.get("access_token")
+    assert client.get("/api/me").status_code == 200
+
+    assert client.post("/api/logout").status_code == 200
+    assert auth.is_token_blacklisted(token)
+    client.cookies.set("access_token", token)  # replayed after logout
+    assert client.get("/api/me").status_code == 401
@@ -0,0 +1,131 @@
+"""
+mailer.SMTPPool and the send_email job against a local aiosmtpd server.
+
+Run from backend/:
+
+    pip install -r requirements-dev.txt
+    python -m pytest tests
+"""
+import socket
+
+import pytest
+from aiosmtpd.controller import Controller
+from aiosmtpd.handlers import Sink
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import StaticPool
+
+import jobs
+import mailer
+import models
+import tasks
+
+
+class Recorder(Sink):
+    def __init__(self):
+        self.messages = []
+
+    async def handle_DATA(self, server, session, envelope):
+        self.messages.append(envelope)
+        return "250 OK"
+
+
+class Refuser(Sink):
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        return "550 No such user"
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture
+def smtp(monkeypatch):
+    """Start a server with the given handler and point mailer.pool at it."""
+    controllers = []
+
+    def start(handler):
+        controller = Controller(handler, hostname="127.0.0.1", port=_free_port())
+        controller.start()
+        controllers.append(controller)
+        monkeypatch.setattr(mailer, "SMTP_HOST", controller.hostname)
+        monkeypatch.setattr(mailer, "SMTP_PORT", controller.port)
+        monkeypatch.setattr(mailer, "SMTP_USE_TLS", False)
+        monkeypatch.setattr(mailer, "SMTP_USER", "")
+        pool = mailer.SMTPPool(size=2)
+        monkeypatch.setattr(mailer, "pool", pool)
+        return pool
+
+    yield start
+    mailer.pool.close()
+    for controller in controllers:
+        controller.stop()
+
+
+@pytest.fixture
+def db():
+    engine = create_engine("sqlite://", poolclass=StaticPool, connect_args={"check_same_thread": False})
+    models.Base.metadata.create_all(engine)
+    with Session(engine) as session:
+        yield session
+    engine.dispose()
+
+
+def _queue(db: Session, to_email: str, body: str = "Hello") -> models.EmailLog:
+    log = models.EmailLog(to_email=to_email, subject="Test", body=body, status="queued")
+    db.add(log)
+    db.commit()
+    return log
+
+
+def test_pool_reuses_connections(smtp):
+    handler = Recorder()
+    pool = smtp(handler)
+    for n in range(3):
+        pool.send(mailer.build_message("a@example.com", f"Message {n}", "Hello"))
+    assert [envelope.rcpt_tos for envelope in handler.messages] == [["a@example.com"]] * 3
+    assert pool.stats() == {"size": 2, "idle": 1, "connects": 1, "sent": 3}
+
+
+@pytest.mark.parametrize("error", [ConnectionResetError, BrokenPipeError])
+def test_pool_replaces_dropped_connection(smtp, error):
+    handler = Recorder()
+    pool = smtp(handler)
+    pool.send(mailer.build_message("a@example.com", "First", "Hello"))
+
+    # The idle connection was closed by the server; using it fails at socket level
+    server, _ = pool._idle[-1]
+
+    def dropped(*args, **kwargs):
+        raise error()
+
+    server.send_message = dropped
+    pool.send(mailer.build_message("a@example.com", "Second", "Hello"))
+    assert len(handler.messages) == 2
+    assert pool.stats()["connects"] == 2
+
+
+def test_send_email_delivers_and_marks_sent(smtp, db):
+    handler = Recorder()
+    smtp(handler)
+    log = _queue(db, "b@example.com", "<p>Hi</p>")
+    assert tasks.send_email(db, {"email_log_id": log.id}) == {"sent": True}
+    db.refresh(log)
+    assert log.status == "sent"
+    (envelope,) = handler.messages
+    assert envelope.rcpt_tos == ["b@example.com"]
+    assert f"<email-log-{log.id}@".encode() in envelope.content
+    assert b"text/html" in envelope.content
+
+    # A retried job does not send twice
+    assert tasks.send_email(db, {"email_log_id": log.id}) == {"sent": False}
+    assert len(handler.messages) == 1
+
+
+def test_send_email_refused_recipient_is_permanent(smtp, db):
+    smtp(Refuser())
+    log = _queue(db, "nobody@example.com")
+    with pytest.raises(jobs.PermanentError, match="550"):
+        tasks.send_email(db, {"email_log_id": log.id})
@@ -0,0 +1,78 @@
+"""PUT /api/projects/{id}/fields: one batch of upserts and deletes, applied all or nothing."""
+import pytest
+
+
+@pytest.fixture
+def project(make_user, client_for):
+    """A client and a project with the fields client=ACME and year=2024."""
+    user, domain = make_user()
+    client = client_for(user)
+    project = client.post("/api/projects/", json={"domain_id": domain.id, "title": "Project"}).json()
+    response = _batch(client, project["id"], upsert=[
+        {"field_key": "client", "field_value": "ACME"},
+        {"field_key": "year", "field_value": "2024"},
+    ])
+    assert response.status_code == 200
+    return client, project["id"]
+
+
+def _batch(client, project_id, upsert=(), delete=()):
+    return client.put(f"/api/projects/{project_id}/fields", json={"upsert": list(upsert), "delete": list(delete)})
+
+
+def _fields(response):
+    return {field["field_key"]: field for field in response.json()["fields"]}
+
+
+def test_upsert_by_id_and_key_and_delete(project):
+    client, project_id = project
+    fields = _fields(client.get(f"/api/projects/{project_id}"))
+    response = _batch(
+        client, project_id,
+        upsert=[
+            {"id": fields["client"]["id"], "field_value": "Initech"},
+            {"field_key": "role", "field_value": "Design"},
+        ],
+        delete=[fields["year"]["id"]],
+    )
+    assert response.status_code == 200
+    values = {key: field["field_value"] for key, field in _fields(response).items()}
+    assert values == {"client": "Initech", "role": "Design"}
+
+    # An existing field_key updates that field instead of adding a second one
+    response = _batch(client, project_id, upsert=[{"field_key": "role", "field_value": "Build", "field_type": "textarea"}])
+    role = _fields(response)["role"]
+    assert (role["field_value"], role["field_type"]) == ("Build", "textarea")
+    assert len(response.json()["fields"]) == 2
+
+
+@pytest.mark.parametrize("item", [
+    {"field_key": "client", "field_type": None},
+    {"field_key": None, "field_value": "x"},
+    {"field_value": "no key"},
+], ids=["null-type", "null-key", "new-without-key"])
+def test_invalid_item_writes_nothing(project, item):
+    client, project_id = project
+    before = client.get(f"/api/projects/{project_id}").json()
+    response = _batch(client, project_id, upsert=[{"field_key": "new", "field_value": "x"}, item])
+    assert response.status_code == 400
+    assert client.get(f"/api/projects/{project_id}").json() == before
+
+
+def test_unknown_field_ids(project):
+    client, project_id = project
+    assert _batch(client, project_id, upsert=[{"id": 999999, "field_value": "x"}]).status_code == 404
+    assert _batch(client, project_id, delete=[999999]).status_code == 404
+
+
+def test_updated_and_deleted_field(project):
+    client, project_id = project
+    field_id = _fields(client.get(f"/api/projects/{project_id}"))["client"]["id"]
+    response = _batch(client, project_id, upsert=[{"id": field_id, "field_value": "x"}], delete=[field_id])
+    assert response.status_code == 400
+
+
+def test_other_users_project(project, make_user, client_for):
+    _, project_id = project
+    other, _ = make_user()
+    assert _batch(client_for(other), project_id, upsert=[{"field_key": "k", "field_value": "v"}]).status_code == 403
@@ -0,0 +1,75 @@
+"""Public project responses: cache, per-domain invalidation and ETag revalidation."""
+import cache
+
+
+def _projects(client, domain_name, etag=None):
+    headers = {"If-None-Match": etag} if etag else {}
+    return client.get(f"/api/public/projects/{domain_name}", headers=headers)
+
+
+def _create_project(client, domain_id, title):
+    response = client.post("/api/projects/", json={"domain_id": domain_id, "title": title})
+    assert response.status_code == 200
+
+
+def test_etag_on_miss_and_hit(make_user, client_for):
+    user, domain = make_user()
+    client = client_for(user)
+    _create_project(client, domain.id, "First")
+
+    miss = _projects(client, domain.name)
+    assert miss.status_code == 200
+    assert miss.headers["ETag"]
+    hit = _projects(client, domain.name)
+    assert hit.json() == miss.json()
+    assert hit.headers["ETag"] == miss.headers["ETag"]
+
+    # The tag of the streamed first response revalidates
+    revalidated = _projects(client, domain.name, miss.headers["ETag"])
+    assert revalidated.status_code == 304
+    assert revalidated.content == b""
+    assert revalidated.headers["ETag"] == miss.headers["ETag"]
+
+
+def test_revalidates_after_eviction(make_user, client_for):
+    user, domain = make_user()
+    client = client_for(user)
+    _create_project(client, domain.id, "First")
+    etag = _projects(client, domain.name).headers["ETag"]
+
+    cache.public_cache.clear()
+    assert _projects(client, domain.name, etag).status_code == 304
+
+
+def test_write_changes_body_and_etag(make_user, client_for):
+    user, domain = make_user()
+    client = client_for(user)
+    _create_project(client, domain.id, "First")
+    first = _projects(client, domain.name)
+
+    _create_project(client, domain.id, "Second")
+    second = _projects(client, domain.name, first.headers["ETag"])
+    assert second.status_code == 200
+    assert second.headers["ETag"] != first.headers["ETag"]
+    assert [project["title"] for project in second.json()] == ["First", "Second"]
+
+
+def test_other_domain_write_keeps_cached_entry(make_user, client_for):
+    user, domain = make_user()
+    other_user, other_domain = make_user()
+    client, other_client = client_for(user), client_for(other_user)
+    _create_project(client, domain.id, "Mine")
+    _projects(client, domain.name)
+    etag = _projects(client, domain.name).headers["ETag"]
+
+    _create_project(other_client, other_domain.id, "Theirs")
+    assert _projects(client, domain.name, etag).status_code == 304
+
+
+def test_etag_matches():
+    assert cache.etag_matches('"a"', '"a"')
+    assert cache.etag_matches('W/"a"', '"a"')
+    assert cache.etag_matches('"b", "a"', '"a"')
+    assert cache.etag_matches("*", '"a"')
+    assert not cache.etag_matches('"b"', '"a"')
+    assert not cache.etag_matches(None, '"a"')
@@ -0,0 +1,95 @@
+"""
+Query budgets of the list endpoints that used to load relationships per row.
+Each is requested for a small and a larger site under the same budget, so a
+statement per project, section or media item fails the test.
+"""
+import pytest
+
+import cache
+import models
+import query_stats
+
+
+def _seed(db, domain, size: int):
+    """`size` pages of `size` sections, projects with fields and media, gallery media."""
+    pages = [models.Page(title=f"Page {i}", hierarchy=i, domain_id=domain.id) for i in range(size)]
+    db.add_all(pages)
+    db.flush()
+    for page in pages:
+        db.add_all(models.Section(page_id=page.id, title=f"Section {i}", position=i, type="text") for i in range(size))
+    for i in range(size):
+        project = models.Project(domain_id=domain.id, title=f"Project {i}")
+        db.add(project)
+        db.flush()
+        db.add_all([
+            models.ProjectField(project_id=project.id, field_key="client", field_value="ACME"),
+            models.ProjectField(project_id=project.id, field_key="year", field_value="2024"),
+            models.Media(title=f"Cover {i}", type="image", kind="image", file_url=f"/uploads/cover{i}.jpg",
+                         domain_id=domain.id, uploaded_by=domain.user_id, project_id=project.id),
+            models.Media(title=f"Photo {i}", type="image", kind="image", file_url=f"/uploads/photo{i}.jpg",
+                         domain_id=domain.id, uploaded_by=domain.user_id),
+        ])
+    db.commit()
+    return pages
+
+
+@pytest.fixture(params=[2, 8], ids=["small", "large"])
+def site(request, db_session, make_user, client_for):
+    user, domain = make_user()
+    pages = _seed(db_session, domain, request.param)
+    client = client_for(user)
+    client.get("/api/me")  # the user is cached from here on, as for any session
+    # Plain values: touching the committed ORM objects would query inside the budget
+    return client, domain.id, domain.name, [page.id for page in pages], request.param
+
+
+def test_projects_of_domain(site):
+    client, domain_id, _, _, size = site
+    with query_stats.assert_max_queries(2):
+        response = client.get(f"/api/projects/domain/{domain_id}")
+    assert response.status_code == 200
+    assert len(response.json()) == size
+    assert all(len(project["fields"]) == 2 for project in response.json())
+
+
+def test_public_projects(site):
+    client, _, domain_name, _, size = site
+    cache.public_cache.clear()
+    with query_stats.assert_max_queries(3):
+        response = client.get(f"/api/public/projects/{domain_name}")
+    assert response.status_code == 200
+    projects = response.json()
+    assert len(projects) == size
+    assert all(len(project["fields"]) == 2 and len(project["media_items"]) == 1 for project in projects)
+
+
+def test_gallery(site):
+    client, domain_id, _, _, size = site
+    with query_stats.assert_max_queries(1):
+        response = client.get(f"/api/fill-gallery/{domain_id}")
+    assert response.status_code == 200
+    assert len(response.json()) == size  # project media is not in the gallery
+
+
+def test_sections_of_page(site):
+    client, _, _, page_ids, size = site
+    with query_stats.assert_max_queries(2):
+        response = client.get(f"/api/sections/{page_ids[0]}")
+    assert response.status_code == 200
+    assert len(response.json()) == size
+
+
+def test_pages_with_section_counts(site):
+    client, _, _, _, size = site
+    with query_stats.assert_max_queries(1):
+        response = client.get("/api/pages/")
+    assert response.status_code == 200
+    assert sorted(page["sections"] for page in response.json()) == [size] * size
+
+
+def test_budget_catches_n_plus_one(site, db_session):
+    _, domain_id, _, _, size = site
+    with pytest.raises(AssertionError, match="possible N\\+1|budget"):
+        with query_stats.assert_max_queries(size):
+            for project in db_session.query(models.Project).filter_by(domain_id=domain_id):
+                project.fields  # lazy load per project
@@ -0,0 +1,101 @@
+"""Resumable uploads: PATCH at the offset HEAD reports, and completing into a media item."""
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import resumable_uploads
+
+BODY = bytes(range(256)) * 8  # 2048 bytes
+
+
+@pytest.fixture
+def upload(make_user, client_for):
+    """A client and the URL of a new session for BODY."""
+    user, domain = make_user()
+    client = client_for(user)
+    response = client.post(
+        "/api/upload/resumable",
+        params={"domain_id": domain.id},
+        json={"filename": "notes.bin", "length": len(BODY)},
+    )
+    assert response.status_code == 201
+    assert response.headers["Upload-Offset"] == "0"
+    return client, response.headers["Location"]
+
+
+def _patch(client, url, offset, chunk, content_type=resumable_uploads.CHUNK_CONTENT_TYPE):
+    return client.patch(url, content=chunk, headers={"Content-Type": content_type, "Upload-Offset": str(offset)})
+
+
+def _received(url):
+    with open(resumable_uploads.session_path(url.rsplit("/", 1)[1]), "rb") as f:
+        return f.read()
+
+
+def test_resume_from_head(upload):
+    client, url = upload
+    assert _patch(client, url, 0, BODY[:1000]).headers["Upload-Offset"] == "1000"
+    # The client lost the response: HEAD tells it where to continue
+    head = client.head(url)
+    assert head.status_code == 200
+    assert head.headers["Upload-Offset"] == "1000"
+    assert head.headers["Upload-Length"] == str(len(BODY))
+    assert _patch(client, url, 1000, BODY[1000:]).status_code == 204
+    assert _received(url) == BODY
+
+
+def test_stale_offset_conflicts(upload):
+    client, url = upload
+    _patch(client, url, 0, BODY[:1000])
+    response = _patch(client, url, 0, BODY[:1000])
+    assert response.status_code == 409
+    assert response.headers["Upload-Offset"] == "1000"
+    assert _received(url) == BODY[:1000]
+
+
+def test_chunk_past_length_is_rejected(upload):
+    client, url = upload
+    assert _patch(client, url, 0, BODY + b"extra").status_code == 413
+    assert client.head(url).headers["Upload-Offset"] == "0"
+
+
+def test_chunk_content_type_is_required(upload):
+    client, url = upload
+    assert _patch(client, url, 0, BODY, content_type="application/octet-stream").status_code == 415
+
+
+def test_concurrent_chunks_at_one_offset(upload):
+    client, url = upload
+    with ThreadPoolExecutor(2) as pool:
+        statuses = list(pool.map(lambda chunk: _patch(client, url, 0, chunk).status_code, [BODY[:1000], BODY[:1000]]))
+    assert sorted(statuses) == [204, 409]
+    assert client.head(url).headers["Upload-Offset"] == "1000"
+    assert _received(url) == BODY[:1000]
+
+
+def test_other_user_cannot_see_the_session(upload, make_user, client_for):
+    _, url = upload
+    other, _ = make_user()
+    other_client = client_for(other)
+    assert other_client.head(url).status_code == 404
+    assert _patch(other_client, url, 0, BODY).status_code == 404
+
+
+def test_complete(upload):
+    client, url = upload
+    assert client.post(f"{url}/complete").status_code == 409  # nothing received yet
+    _patch(client, url, 0, BODY)
+    response = client.post(f"{url}/complete")
+    assert response.status_code == 200
+    assert response.json()["status"] == "processing"
+    assert client.head(url).status_code == 404
+
+
+def test_cancel_removes_the_file(upload):
+    client, url = upload
+    _patch(client, url, 0, BODY[:1000])
+    path = resumable_uploads.session_path(url.rsplit("/", 1)[1])
+    assert client.delete(url).status_code == 204
+    assert client.head(url).status_code == 404
+    assert not os.path.exists(path)
@@ -0,0 +1,89 @@
+"""PUT /api/pages/{id}/sections/order: reordering, and moving sections between pages of a domain."""
+import pytest
+
+import models
+
+
+@pytest.fixture
+def site(db_session, make_user, client_for):
+    """Two pages of three sections on one domain, one page on a second domain of the same user."""
+    user, domain = make_user()
+    other_domain = models.Domain(name=f"second.{domain.name}", user_id=user.id)
+    db_session.add(other_domain)
+    db_session.flush()
+    pages = [
+        models.Page(title="Home", hierarchy=0, domain_id=domain.id),
+        models.Page(title="About", hierarchy=1, domain_id=domain.id),
+        models.Page(title="Elsewhere", hierarchy=0, domain_id=other_domain.id),
+    ]
+    db_session.add_all(pages)
+    db_session.flush()
+    sections = {
+        page.title: [models.Section(page_id=page.id, title=f"{page.title} {i}", position=i, type="text") for i in range(3)]
+        for page in pages
+    }
+    db_session.add_all(section for page_sections in sections.values() for section in page_sections)
+    db_session.commit()
+    page_ids = {page.title: page.id for page in pages}
+    section_ids = {title: [section.id for section in page_sections] for title, page_sections in sections.items()}
+    return client_for(user), page_ids, section_ids
+
+
+def _order(client, page_id, section_ids):
+    return client.put(f"/api/pages/{page_id}/sections/order", json={"section_ids": section_ids})
+
+
+def _section_ids(client, page_id):
+    # The listing is not sorted by position
+    sections = sorted(client.get(f"/api/sections/{page_id}").json(), key=lambda section: section["position"])
+    return [section["id"] for section in sections]
+
+
+def test_reorder_within_page(site):
+    client, pages, sections = site
+    new_order = sections["Home"][::-1]
+    response = _order(client, pages["Home"], new_order)
+    assert response.status_code == 200
+    assert [section["id"] for section in response.json()] == new_order
+    assert [section["position"] for section in response.json()] == [0, 1, 2]
+    assert _section_ids(client, pages["Home"]) == new_order
+
+
+def test_move_from_page_on_same_domain(site):
+    client, pages, sections = site
+    moved = sections["About"][1]
+    new_order = [sections["Home"][0], moved, *sections["Home"][1:]]
+    response = _order(client, pages["Home"], new_order)
+    assert response.status_code == 200
+    assert _section_ids(client, pages["Home"]) == new_order
+    assert _section_ids(client, pages["About"]) == [sections["About"][0], sections["About"][2]]
+
+
+def test_move_from_other_domain_is_rejected(site):
+    client, pages, sections = site
+    response = _order(client, pages["Home"], [*sections["Home"], sections["Elsewhere"][0]])
+    assert response.status_code == 400
+    assert _section_ids(client, pages["Home"]) == sections["Home"]
+    assert _section_ids(client, pages["Elsewhere"]) == sections["Elsewhere"]
+
+
+def test_invalid_lists(site):
+    client, pages, sections = site
+    home = sections["Home"]
+    assert _order(client, pages["Home"], [home[0], home[0], home[1], home[2]]).status_code == 400
+    assert _order(client, pages["Home"], home[:2]).status_code == 400  # a section of the page is missing
+    assert _section_ids(client, pages["Home"]) == home
+
+
+def test_other_users_section_is_not_found(site, make_user, client_for, db_session):
+    client, pages, sections = site
+    other, other_domain = make_user()
+    page = models.Page(title="Theirs", hierarchy=0, domain_id=other_domain.id)
+    db_session.add(page)
+    db_session.flush()
+    section = models.Section(page_id=page.id, title="Theirs", position=0, type="text")
+    db_session.add(section)
+    db_session.commit()
+    assert _order(client, pages["Home"], [*sections["Home"], section.id]).status_code == 404
+    # Nor can anyone else reorder the page
+    assert _order(client_for(other), pages["Home"], sections["Home"]).status_code == 403
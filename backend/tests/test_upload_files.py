@@ -0,0 +1,119 @@
+"""/uploads: range requests, validators and the caching rules of upload_files."""
+import asyncio
+import os
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+import upload_files
+
+BODY = bytes(range(256)) * 40  # 10240 bytes
+
+
+@pytest.fixture(scope="module")
+def client():
+    return TestClient(main.app)
+
+
+@pytest.fixture(scope="module")
+def blob_url():
+    name = "ab" * 32 + "-0123abcd.bin"
+    os.makedirs("uploads/blobs/ab", exist_ok=True)
+    with open(f"uploads/blobs/ab/{name}", "wb") as f:
+        f.write(BODY)
+    return f"/uploads/blobs/ab/{name}"
+
+
+@pytest.fixture(scope="module")
+def legacy_url():
+    with open("uploads/legacy.bin", "wb") as f:
+        f.write(BODY)
+    return "/uploads/legacy.bin"
+
+
+def test_blob_is_immutable(client, blob_url):
+    response = client.get(blob_url)
+    assert response.status_code == 200
+    assert response.content == BODY
+    assert response.headers["cache-control"] == upload_files.IMMUTABLE
+    assert response.headers["etag"] == f'"{os.path.basename(blob_url)}"'
+    assert response.headers["accept-ranges"] == "bytes"
+
+
+def test_single_range(client, blob_url):
+    response = client.get(blob_url, headers={"Range": "bytes=100-199"})
+    assert response.status_code == 206
+    assert response.headers["content-range"] == f"bytes 100-199/{len(BODY)}"
+    assert response.content == BODY[100:200]
+
+
+def test_suffix_range(client, blob_url):
+    response = client.get(blob_url, headers={"Range": "bytes=-10"})
+    assert response.status_code == 206
+    assert response.content == BODY[-10:]
+
+
+def test_unsatisfiable_range(client, blob_url):
+    response = client.get(blob_url, headers={"Range": f"bytes={len(BODY)}-"})
+    assert response.status_code == 416
+
+
+def test_if_range(client, blob_url):
+    etag = client.get(blob_url).headers["etag"]
+    matching = client.get(blob_url, headers={"Range": "bytes=0-9", "If-Range": etag})
+    assert matching.status_code == 206
+    assert matching.content == BODY[:10]
+    # The file changed since the client's partial copy: send all of it
+    stale = client.get(blob_url, headers={"Range": "bytes=0-9", "If-Range": '"other"'})
+    assert stale.status_code == 200
+    assert stale.content == BODY
+
+
+def test_blob_not_modified(client, blob_url):
+    etag = client.get(blob_url).headers["etag"]
+    response = client.get(blob_url, headers={"If-None-Match": etag})
+    assert response.status_code == 304
+
+
+def test_legacy_file_revalidates(client, legacy_url):
+    response = client.get(legacy_url)
+    assert response.status_code == 200
+    assert response.headers["cache-control"] == upload_files.REVALIDATE
+    assert client.get(legacy_url, headers={"If-None-Match": response.headers["etag"]}).status_code == 304
+
+
+def _send_zerocopy(path: str, headers: list[tuple[bytes, bytes]]) -> list[dict]:
+    sent = []
+    scope = {
+        "type": "http",
+        "method": "GET",
+        "headers": headers,
+        "extensions": {"http.response.zerocopysend": {}},
+    }
+
+    async def receive():
+        return {"type": "http.request"}
+
+    async def send(message):
+        if message["type"] == "http.response.zerocopysend":
+            message = {**message, "file": message["file"].name}
+        sent.append(message)
+
+    asyncio.run(upload_files.UploadFileResponse(path)(scope, receive, send))
+    return sent
+
+
+def test_zerocopy_whole_file(blob_url):
+    path = blob_url.lstrip("/")
+    start, body = _send_zerocopy(path, [])
+    assert start["status"] == 200
+    assert body == {"type": "http.response.zerocopysend", "file": path, "offset": 0, "count": len(BODY)}
+
+
+def test_zerocopy_single_range(blob_url):
+    path = blob_url.lstrip("/")
+    start, body = _send_zerocopy(path, [(b"range", b"bytes=100-199")])
+    assert start["status"] == 206
+    assert (b"content-range", f"bytes 100-199/{len(BODY)}".encode()) in start["headers"]
+    assert (body["offset"], body["count"]) == (100, 100)
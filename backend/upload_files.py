@@ -0,0 +1,86 @@
+"""
+Serving of the files under /uploads.
+
+Everything stored since uploads became content-addressed lives under
+uploads/blobs/ and is named after the SHA-256 of its content plus a suffix
+per stored copy (see storage), so a URL there never changes meaning: those responses are marked immutable
+for a year and their ETag is the file name, identical on every host sharing
+the uploads directory. Other files (stored before, or written in place) are
+sent with `no-cache`, so clients keep them but revalidate with
+If-None-Match / If-Modified-Since and get a 304 while they are unchanged.
+
+Range requests (video seeking, resumed downloads) get 206 responses, also
+with If-Range. Bodies are sent zero-copy when the server supports it:
+whole files with the ASGI `http.response.pathsend` extension (handled by
+Starlette), whole files and single ranges with `http.response.zerocopysend`
+(a sendfile() on the open file). Otherwise the file is streamed in chunks.
+"""
+import os
+import anyio
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse, MalformedRangeHeader, RangeNotSatisfiable, Response
+from starlette.staticfiles import NotModifiedResponse, StaticFiles
+from starlette.types import Receive, Scope, Send
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"
+
+
+class UploadFileResponse(FileResponse):
+    """FileResponse that uses sendfile() through `http.response.zerocopysend` when offered."""
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if (
+            scope["type"] != "http"
+            or scope["method"].upper() == "HEAD"
+            or self.status_code != 200
+            or "http.response.zerocopysend" not in scope.get("extensions", {})
+        ):
+            return await super().__call__(scope, receive, send)
+
+        if self.stat_result is None:
+            self.stat_result = await anyio.to_thread.run_sync(os.stat, self.path)
+            self.set_stat_headers(self.stat_result)
+        size = self.stat_result.st_size
+        status, start, end = 200, 0, size
+
+        headers = Headers(scope=scope)
+        http_range = headers.get("range")
+        http_if_range = headers.get("if-range")
+        if http_range is not None and (http_if_range is None or self._should_use_range(http_if_range)):
+            try:
+                ranges = self._parse_range_header(http_range, size)
+            except (MalformedRangeHeader, RangeNotSatisfiable):
+                # Starlette answers 400 / 416
+                return await super().__call__(scope, receive, send)
+            if len(ranges) > 1:
+                # multipart/byteranges; rare enough to stream
+                return await super().__call__(scope, receive, send)
+            if ranges:
+                status, (start, end) = 206, ranges[0]
+                self.headers["content-range"] = f"bytes {start}-{end - 1}/{size}"
+                self.headers["content-length"] = str(end - start)
+
+        file = await anyio.to_thread.run_sync(open, self.path, "rb")
+        try:
+            await send({"type": "http.response.start", "status": status, "headers": self.raw_headers})
+            await send({"type": "http.response.zerocopysend", "file": file, "offset": start, "count": end - start})
+        finally:
+            file.close()
+        if self.background is not None:
+            await self.background()
+
+
+class UploadFiles(StaticFiles):
+    """StaticFiles for the uploads directory, with the caching rules above."""
+
+    def file_response(self, full_path, stat_result: os.stat_result, scope: Scope, status_code: int = 200) -> Response:
+        if self.get_path(scope).startswith("blobs" + os.sep):
+            headers = {"cache-control": IMMUTABLE, "etag": f'"{os.path.basename(full_path)}"'}
+        else:
+            headers = {"cache-control": REVALIDATE}
+
+        response = UploadFileResponse(full_path, status_code=status_code, headers=headers, stat_result=stat_result)
+        if self.is_not_modified(response.headers, Headers(scope=scope)):
+            return NotModifiedResponse(response.headers)
+        return response
@@ -0,0 +1,42 @@
+"""
+Standalone job worker. Run from backend/ on a host that shares the uploads
+directory with the API:
+
+    JOB_WORKER_CONCURRENCY=4 python worker.py
+
+Set JOB_WORKER_EMBEDDED=false on the API when all work should go here.
+"""
+import logging
+import signal
+import threading
+
+import database
+import jobs
+import mailer
+import media_processing
+import tasks
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    signal.signal(signal.SIGINT, lambda *_: stop.set())
+
+    db = database.SessionLocal()
+    try:
+        tasks.schedule_periodic(db)
+    finally:
+        db.close()
+
+    worker = jobs.Worker()
+    worker.start()
+    logging.getLogger("jobs").info("worker started with %d threads", worker.concurrency)
+    stop.wait()
+    worker.stop()
+    media_processing.shutdown()
+    mailer.pool.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -45,7 +45,7 @@ interface EmailLog {
   to_email: string
   subject: string
   body: string
-  status: "sent" | "failed"
+  status: "queued" | "sent" | "failed"
   error: string | null
   sent_at: string | null
 }
@@ -661,7 +661,7 @@ function EmailTab() {
         body: JSON.stringify({ to_email: to, subject, body }),
       })
       if (res.ok) {
-        showToast(`Email sent to ${to}`, "success")
+        showToast(`Email to ${to} queued`, "success")
         setTo("")
         setSubject("")
         setBody("")
@@ -781,7 +781,7 @@ function EmailTab() {
                 >
                   <div className="flex items-center gap-3">
                     <span
-                      className={`flex-shrink-0 w-2 h-2 rounded-full ${log.status === "sent" ? "bg-green-400" : "bg-red-400"}`}
+                      className={`flex-shrink-0 w-2 h-2 rounded-full ${log.status === "sent" ? "bg-green-400" : log.status === "queued" ? "bg-yellow-400" : "bg-red-400"}`}
                     />
                     <div className="flex-1 min-w-0">
                       <p className="text-sm text-white truncate font-medium">{log.subject}</p>
@@ -100,7 +100,8 @@ export default function ImagesPage() {
         } else {
           const data = await response.json()
           // Endpoint is domain-scoped; keep only non-text media.
-          setMediaItems(data.filter((item: MediaItem) => item.type !== "text"))
+          // Uploads still processing (or failed) have no file to show yet
+          setMediaItems(data.filter((item: MediaItem) => item.type !== "text" && item.file_url))
         }
       } catch (error) {
         console.error(error)
@@ -124,6 +124,32 @@ export function ImageUpload({
       })
   }
 
+  // New content is transcoded in the background: the upload answers with
+  // status "processing" and no file_url, so poll its job until the files exist
+  const waitForProcessing = async (media: any) => {
+    let delay = 500
+    while (media.status === "processing" && media.job_id) {
+      await new Promise((resolve) => setTimeout(resolve, delay))
+      delay = Math.min(delay * 2, 4000)
+
+      const response = await fetch(`${API_URL}/api/jobs/${media.job_id}`, { credentials: "include" })
+      if (!response.ok) {
+        throw new Error("Could not check the processing status")
+      }
+      const job = await response.json()
+      if (job.status === "failed") {
+        throw new Error(job.last_error || "Processing failed")
+      }
+      if (job.status === "done") {
+        if (!job.result?.file_url) {
+          throw new Error("The file was deleted while processing")
+        }
+        return { ...media, status: "ready", file_url: job.result.file_url }
+      }
+    }
+    return media
+  }
+
   const uploadFileToServer = async (uploadFile: UploadFile) => {
     if (!uploadFile.file) {
       setUploadFiles((prev) =>
@@ -171,12 +197,14 @@ export function ImageUpload({
         throw new Error(mapBackendErrorToMessage(detail))
       }
 
-      const uploadedFile = await response.json()
+      const uploadedFile = await waitForProcessing(await response.json())
 
+      // The media item's own status (ready) must not replace the upload status
+      const { status: _mediaStatus, ...media } = uploadedFile
       setUploadFiles((prev) =>
         prev.map((f) =>
           f.id === uploadFile.id
-            ? { ...f, status: "success", progress: 100, ...uploadedFile }
+            ? { ...f, ...media, status: "success", progress: 100 }
             : f
         )
       )
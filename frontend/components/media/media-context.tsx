@@ -61,7 +61,8 @@ export function MediaProvider({ children }: { children: React.ReactNode }) {
           throw new Error("Failed to fetch media")
         }
         const data = await response.json()
-        const filtered = data.filter((item: MediaItem) => item.type !== "text")
+        // Uploads still processing (or failed) have no file to show yet
+        const filtered = data.filter((item: MediaItem) => item.type !== "text" && item.file_url)
         setMediaItems(filtered)
       } catch (error) {
         console.error(error)